@@ -19,13 +19,16 @@ Pour une acquisition longue dÃ©sactiver la mise en veille du PC
 """
 import time
 import os
+import sqlite3
+import threading
 import numpy as np
 import serial
 from pyfirmata import Arduino
 from flask_socketio import SocketIO
 
 # Motors
-from core.kinematic_chains.motors_varian_634 import GeneralMotorsController
+from core.kinematic_chains.motors_varian_634 import GeneralMotorsController, StopRequested
+from core.kinematic_chains.scan_program import ScanProgram
 
 # Voltage acquisition
 from core.electronics_controler.ni_pci_6221 import ElectronicVarian634
@@ -33,6 +36,14 @@ from core.electronics_controler.ni_pci_6221 import ElectronicVarian634
 # Data processing
 from core.utils.experiment_manager import ExperimentManager
 from core.utils.digital_signal_processing import SignalProcessingVarian634
+from core.utils.calibration import CALIBRATIONS
+from core.utils.experiment_catalog import ExperimentCatalog
+
+
+TITLE_DATA_ACQUISITION = ["Longueur d'onde (nm)", "Absorbance", "Tension reference (Volt)", "Tension echantillon (Volt)", 
+                          "pas de vis (mm)", "Incertitude reference (Volt)", "Incertitude echantillon (Volt)"]
+# Raw data of a scan: amplitude of each lamp pulse, with the screw position and the photodiode (1 or 2)
+TITLE_RAW_PULSES = ["pas de vis (mm)", "Photodiode", "Amplitude impulsion (Volt)"]
 
 
 class Varian634AcquisitionMode:
@@ -43,7 +54,8 @@ class Varian634AcquisitionMode:
     """
 
     def __init__(self, arduino_motors_instance: serial.Serial, arduino_sensors_instance: Arduino, 
-                 socketio : SocketIO, sample_name : str, cuvette_choice : str, slot_size : str):
+                 socketio : SocketIO, sample_name : str, cuvette_choice : str, slot_size : str, 
+                 daq : ElectronicVarian634 = None, stop_event : threading.Event = None):
         """
         Initializes the Varian634BaselineScanning class.
 
@@ -51,32 +63,53 @@ class Varian634AcquisitionMode:
             arduino_motors_instance: Instance representing the Arduino connected to motors.
             arduino_sensors_instance: Instance representing the Arduino connected to the fork.
             mode_variable_slits: Mode for variable slits.
+            daq: Voltage acquisition (ElectronicVarian634 on the NI-PCI 6221 by default, 
+                SimulatedElectronicVarian634 for the simulated hardware).
+            stop_event: Stop of the acquisition, checked between the steps and in the waits 
+                of the motions (StopRequested is raised once it is set).
         """
         # Init hardware
         self.arduino_motors = arduino_motors_instance
         self.arduino_sensors = arduino_sensors_instance
         self.motors_controller = GeneralMotorsController(self.arduino_motors, self.arduino_sensors)
+        self.stop_event = stop_event if stop_event is not None else threading.Event()
+        self.motors_controller.stop_event = self.stop_event
         self.slits_position = [0, 0.065, 0.135, 0.22] # position of slits [2nm, 1nm, 0.5nm, 0.2nm]
-        self.daq = ElectronicVarian634()
+        self.daq = daq if daq is not None else ElectronicVarian634()
         self.channels = ['Dev1/ai0', 'Dev1/ai1']
 
         # Init digital processing
-        self.signal_processing = SignalProcessingVarian634()
         self.peak_search_window = 60
+        self.fly_scan_speed = 100  # nm/min (survey speed)
+        self.adaptive_coarse_factor = 5  # coarse step = 5 * fine step in adaptive_mode
+        self.backlash_approach = 0.05  # mm, overshoot when the screw goes back to a position
         self.slot_size = slot_size
         # Init experiment tools
         self.socketio = socketio
         self.experim_manager = ExperimentManager(sample_name, slot_size)  
         self.raw_data = os.path.join(os.getcwd() ,'raw_data') 
         self.path, self.date = self.experim_manager.creation_directory_date_slot(self.raw_data)
+        # Calibration of the day and the slit of the experiment (see CalibrationRegistry.get)
+        self.signal_processing = SignalProcessingVarian634(CALIBRATIONS.get(self.date, slot_size))
         self.sample_name = sample_name
         self.cuvette_choice = cuvette_choice
         self.title_file_sample = f"{self.date}_{self.slot_size}_{self.sample_name}"
+        # The scan is saved in a binary spectrum store (.v634); the CSV of the raw data is 
+        # written during the scan, a CSV of the whole result only on demand
+        self.export_csv = False
+        # Each scan is recorded in the catalog of the experiments (echantillons.db by default)
+        self.catalog_path = None
+        # Amplitudes of the lamp pulses of the scan (see record_raw_pulses), saved in float32 
+        # next to the scan
+        self.raw_pulses = []
         
 
-    def initialisation_setting(self, wavelenght_min, wavelenght_max, wavelength_step):
+    def initialisation_setting(self, wavelenght_min, wavelenght_max, wavelength_step, direction=1):
         """
         Initi
+
+        The screw goes to the start of the scan: the course of wavelenght_max for a scan 
+        towards +X (direction 1), the course of wavelenght_min towards -X (direction -1).
         """
 
         course_final = self.signal_processing.calculate_course(wavelenght_min)
@@ -89,85 +122,281 @@ class Varian634AcquisitionMode:
         print("step", step)
         print(number_measurements)
         self.motors_controller.unlock_motors()
-        self.motors_controller.relative_move()
-        time.sleep(1)
-        self.motors_controller.move_screw(course_initial)
-        time.sleep(course_initial*60/10)
+        course_start = course_initial if direction > 0 else course_initial + step*number_measurements
+        self.motors_controller.move_screw_to(course_start, self.backlash_approach, direction)
+        self.motors_controller.wait_for_idle()
         return course_initial, step, number_measurements
 
 
-    def perform_step_measurement(self):
+    def check_stop(self):
         """
-        Measures voltage across two photodiodes by switching mirror position between measurements.
+        Raises StopRequested when a stop of the acquisition is requested (see stop_event).
+        """
+        if self.stop_event.is_set():
+            raise StopRequested("Acquisition stopped on request")
 
-        Returns:
-            Tuple containing measured voltages from photodiode 1 and photodiode 2.
+    def record_point(self, scan_buffer, i, position, voltages_photodiode_1, voltages_photodiode_2, 
+                     uncertainty_photodiode_1, uncertainty_photodiode_2, data_writer):
+        """
+        Computes the absorbance of a point, stores it in the scan buffer, appends it to the 
+        raw data CSV file and sends it to the interface.
+
+        Parameters:
+            scan_buffer: Measurement buffer of the scan (see measure_positions).
+            i: Index of the point in the buffer.
+            position: Screw position of the point.
+            voltages_photodiode_1, voltages_photodiode_2: Voltages of the photodiodes.
+            uncertainty_photodiode_1, uncertainty_photodiode_2: Uncertainties of the voltages.
+            data_writer: CsvDataWriter to which the measurement is appended.
+        """
+        [voltage_reference, voltage_sample] = self.experim_manager.link_cuvette_voltage(self.cuvette_choice, 
+                                                                            voltages_photodiode_1, voltages_photodiode_2)
+        [uncertainty_reference, uncertainty_sample] = self.experim_manager.link_cuvette_voltage(self.cuvette_choice, 
+                                                                            uncertainty_photodiode_1, uncertainty_photodiode_2)
+        wavelength = self.signal_processing.calculate_wavelength(position)
+        absorbance = np.log10(voltage_reference/voltage_sample)
+        scan_buffer[i] = [wavelength, absorbance, voltage_reference, voltage_sample, position, 
+                          uncertainty_reference, uncertainty_sample]
+        print(f"point {i + 1}/{len(scan_buffer)} : wavelength {wavelength:.2f} nm, absorbance {absorbance:.4f}")
+
+        # Save data incrementally
+        data_writer.write_row(scan_buffer[i].tolist())
+        self.socketio.emit('update_data', {'data_y': absorbance, "data_x": wavelength, "slitId": self.slot_size})
+
+    def record_raw_pulses(self, positions, photodiode, amplitudes):
+        """
+        Keeps the amplitudes of the lamp pulses of an acquisition (raw data of the scan).
+
+        Parameters:
+            positions: Screw position of the acquisition, or of each pulse (fly scan).
+            photodiode: Photodiode measured (1 or 2).
+            amplitudes: Arrays of the amplitudes of the pulses (see ElectronicVarian634.pulse_record).
+        """
+        amplitudes = np.concatenate(amplitudes) if amplitudes else np.empty(0)
+        self.raw_pulses.append(np.array([np.broadcast_to(positions, amplitudes.shape), 
+                                         np.full(amplitudes.shape, photodiode), amplitudes]))
+
+    def measure_positions(self, positions, current_position, data_writer, direction=1):
         """
-        voltage_photodiode_2 = self.daq.voltage_acquisition_scanning_baseline(self.channels[0])
-        self.motors_controller.move_mirror_motor(0.33334)  # Move mirror to switch cuvette
-        time.sleep(1)  # Wait for mirror adjustment
-        voltage_photodiode_1 = self.daq.voltage_acquisition_scanning_baseline(self.channels[1])
-        self.motors_controller.move_mirror_motor(-0.33334)  # Move mirror back
-        time.sleep(1)
+        Measures the absorbance at each screw position, in the given order.
 
-        return voltage_photodiode_1, voltage_photodiode_2
+        The whole scan is compiled into a G-code program streamed to GRBL (see ScanProgram). 
+        Positions behind the current one are approached with an overshoot of `backlash_approach` 
+        so that every point is measured with the screw moving in the scan direction. Towards -X, 
+        the positions are compensated for the backlash of the screw (see BacklashModel). GRBL 
+        holds in each acquisition window until the acquisition is done, and the mirror goes 
+        back to the photodiode 2 while the screw moves to the next position.
 
-   
+        Parameters:
+            positions: Screw positions to measure.
+            current_position: Screw position before the first move (as commanded).
+            data_writer: CsvDataWriter to which each measurement is appended.
+            direction: Direction of the scan (1: towards +X, -1: towards -X).
+
+        Returns:
+            Array of shape (len(positions), 7) with the wavelength, absorbance, reference voltage, 
+            sample voltage, screw position and the uncertainties of the voltages of each measurement.
+        """
+        # Measurement buffer: one row per position
+        # [wavelength, absorbance, reference voltage, sample voltage, screw position, 
+        #  reference voltage uncertainty, sample voltage uncertainty]
+        scan_buffer = np.empty((len(positions), len(TITLE_DATA_ACQUISITION)))
+        self.motors_controller.wait_for_idle()
+        status = self.motors_controller.get_status()
+        start_position = status['WPos'] if status['WPos'] is not None else status['MPos']
+        program = ScanProgram(self.motors_controller.grbl, mirror_move=0.33334, backlash_approach=self.backlash_approach, 
+                              stop_event=self.stop_event)
+        commanded_positions = self.motors_controller.screw_backlash.compensate(np.asarray(positions), direction)
+        program.compile(commanded_positions, current_position, start_position, self.motors_controller.settle_time, direction)
+        # The DAQ tasks stay open for all the positions
+        with self.daq.session(self.channels):
+            program.start()
+            try:
+                voltages = []
+                for window in program.windows:
+                    point, channel, _ = window
+                    program.wait_window(window)  # Diffraction grating and mirror settled
+                    self.check_stop()
+                    self.daq.pulse_record = []
+                    voltages.append(self.daq.voltage_acquisition(self.channels[channel]))
+                    program.resume()
+                    self.record_raw_pulses(positions[point], 2 - channel, self.daq.pulse_record)
+                    if channel == 1:
+                        (voltage_photodiode_2, uncertainty_photodiode_2), (voltage_photodiode_1, uncertainty_photodiode_1) = voltages
+                        voltages = []
+                        self.record_point(scan_buffer, point, positions[point], voltage_photodiode_1, voltage_photodiode_2, 
+                                          uncertainty_photodiode_1, uncertainty_photodiode_2, data_writer)
+            except BaseException:
+                program.abort()
+                raise
+            finally:
+                self.daq.pulse_record = None
+            program.finish()
+        self.motors_controller.wait_for_idle()
 
-    def precision_mode(self, course_initial, step, number_measurements):
+        return scan_buffer
+
+    def precision_mode(self, course_initial, step, number_measurements, direction=1):
         """
         Performs precise measurements across a range of positions, calculates wavelength, and stores results.
 
+        The measurements are stored in a buffer sized for the whole scan and each step is
+        appended to the raw data CSV file as soon as it is measured.
+
         Parameters:
             screw_travel: Total distance for the screw to travel during the measurement.
             number_measurements: Number of measurements to take across the screw travel distance.
+            direction: 1 to scan towards +X (descending wavelengths) from course_initial, -1 to 
+                scan towards -X (ascending wavelengths) from the end of the range.
 
         Returns:
-            A tuple containing lists of wavelengths, absorbance, reference voltages, sample voltages, and screw positions.
+            A tuple containing lists of wavelengths, absorbance, reference voltages, sample voltages, screw positions 
+            and uncertainties of the reference and sample voltages.
         """
-        # Precision measurement setup
-        voltages_reference, voltages_sample = np.array([]), np.array([])
-    
-        no_screw, wavelengths, absorbances = np.array([]), np.array([]), np.array([])
-        time_per_step = (step * 60) / 10  # Time calculation for each step
+        positions = course_initial + np.arange(number_measurements + 1) * step
+        if direction < 0:
+            positions = positions[::-1]
+        current_position = self.motors_controller.screw_backlash.compensate(positions[0], direction)
 
         self.motors_controller.unlock_motors()
         self.motors_controller.execute_g_code("G91")  # Set relative movement mode
-        time.sleep(1)  # Wait for command acknowledgment
-        for i in range(0, number_measurements + 1):
-            voltages_photodiode_1, voltages_photodiode_2 = self.perform_step_measurement()
-            # Move diffraction grating
-            [voltage_reference, voltage_sample] = self.experim_manager.link_cuvette_voltage(self.cuvette_choice, 
-                                                                                voltages_photodiode_1, voltages_photodiode_2)
-            # Store measurement data for plotting
-            voltages_reference = np.append(voltages_reference, voltage_reference)
-            voltages_sample= np.append(voltages_sample, voltage_sample)
-
-            print("voltages_reference :", voltages_reference, "type", voltages_reference.dtype)
-            print("voltages_sample :", voltages_sample, "type", voltages_sample.dtype)
-            position = course_initial + i * step
-            no_screw = np.append(no_screw, position)
-            print("no_screw :", no_screw , "type", no_screw.dtype)
-            wavelengths = np.append(wavelengths, self.signal_processing.calculate_wavelength(position))
-            print("wavelengths :", wavelengths, "type", wavelengths.dtype)
-            absorbances= np.append(absorbances, np.log10(voltage_reference/voltage_sample))
-            print("absorbances :", absorbances, "type", absorbances.dtype)
-            self.motors_controller.move_screw(step)
-
-            # Save data incrementally             
-            title_data_acquisition = ["Longueur d'onde (nm)", "Absorbance", "Tension reference (Volt)", "Tension echantillon (Volt)", 
-                                  "pas de vis (mm)"]
-            # .tolist() because all data was in numpy.float64 and that create conflict with 
-            datas = [wavelengths, absorbances, voltages_reference, voltages_sample, no_screw]
-            title_file = "raw_data_" + self.title_file_sample
-            self.experim_manager.save_data_csv(self.path, datas, title_data_acquisition, title_file) 
-            self.socketio.emit('update_data', {'data_y': np.log10(voltage_reference/voltage_sample), "data_x": self.signal_processing.calculate_wavelength(position), "slitId": self.slot_size})
-           
-            time.sleep(time_per_step)# Wait for diffraction grating adjustment         
-
-        return wavelengths, absorbances, voltages_reference, voltages_sample, no_screw
-
-    def acquisition(self, mode, wavelenght_min, wavelenght_max, wavelenght_step):
+        title_file = "raw_data_" + self.title_file_sample
+        with self.experim_manager.open_data_csv(self.path, TITLE_DATA_ACQUISITION, title_file) as data_writer:
+            scan_buffer = self.measure_positions(positions, current_position, data_writer, direction)
+
+        # Same order of the points in both directions
+        scan_buffer = scan_buffer[np.argsort(scan_buffer[:, 4])]
+        return tuple(scan_buffer.T)
+
+    def adaptive_mode(self, course_initial, step, number_measurements):
+        """
+        Performs a coarse survey of the spectrum, then rescans at the fine step only 
+        the regions of interest (absorption bands, strong slopes) found in the survey.
+
+        The survey uses a step `adaptive_coarse_factor` times larger than `step`, on points of 
+        the fine grid. The coarse and fine points are merged into one spectrum sorted by 
+        screw position.
+
+        Parameters:
+            course_initial: Screw position at the start of the scan.
+            step: Fine screw step, used inside the regions of interest.
+            number_measurements: Number of fine steps across the screw travel distance.
+
+        Returns:
+            A tuple containing lists of wavelengths, absorbance, reference voltages, sample voltages, screw positions 
+            and uncertainties of the reference and sample voltages.
+        """
+        factor = self.adaptive_coarse_factor
+        fine_index = np.arange(number_measurements + 1)
+        coarse_index = fine_index[::factor]
+        if coarse_index[-1] != fine_index[-1]:
+            coarse_index = np.append(coarse_index, fine_index[-1])
+
+        self.motors_controller.unlock_motors()
+        self.motors_controller.execute_g_code("G91")  # Set relative movement mode
+        title_file = "raw_data_" + self.title_file_sample
+        with self.experim_manager.open_data_csv(self.path, TITLE_DATA_ACQUISITION, title_file) as data_writer:
+            # First pass: coarse survey
+            coarse_positions = course_initial + coarse_index * step
+            coarse_buffer = self.measure_positions(coarse_positions, course_initial, data_writer)
+
+            # Regions of interest on the fine grid: fine points around each coarse point of interest
+            interest = self.signal_processing.regions_of_interest(coarse_buffer[:, 0], coarse_buffer[:, 1])
+            fine_mask = np.zeros(number_measurements + 1, dtype=bool)
+            for index in coarse_index[interest]:
+                fine_mask[max(index - factor, 0):index + factor + 1] = True
+            fine_mask[coarse_index] = False
+            print(f"Adaptive scan : {np.count_nonzero(fine_mask)} fine points to rescan")
+
+            # Second pass: fine rescan of the regions of interest
+            fine_positions = course_initial + fine_index[fine_mask] * step
+            fine_buffer = self.measure_positions(fine_positions, coarse_positions[-1], data_writer)
+
+        scan_buffer = np.concatenate((coarse_buffer, fine_buffer))
+        scan_buffer = scan_buffer[np.argsort(scan_buffer[:, 4])]
+        return tuple(scan_buffer.T)
+
+    def fly_mode(self, course_initial, step, number_measurements):
+        """
+        Measures the spectrum while the diffraction grating moves at constant speed (fly scan).
+
+        The screw travels once over the whole range for each photodiode (G1 move at the feed 
+        rate giving `fly_scan_speed` nm/min) while the voltage is acquired continuously. Each 
+        lamp pulse is mapped back to a screw position and the pulses are averaged on the 
+        same screw positions as precision_mode. The points of each travel are written to the
+        raw data CSV as soon as it is folded: the first travel without photodiode 1 nor
+        absorbance (NaN), then the complete points after the second travel.
+
+        Parameters:
+            course_initial: Screw position at the start of the scan.
+            step: Screw travel between two points of the spectrum.
+            number_measurements: Number of steps across the screw travel distance.
+
+        Returns:
+            A tuple containing lists of wavelengths, absorbance, reference voltages, sample voltages, screw positions 
+            and uncertainties of the reference and sample voltages.
+        """
+        screw_travel = step * number_measurements
+        no_screw = course_initial + np.arange(number_measurements + 1) * step
+        wavelength_travel = abs(self.signal_processing.calculate_wavelength(no_screw[0]) 
+                                - self.signal_processing.calculate_wavelength(no_screw[-1]))
+        feed_rate = self.fly_scan_speed * screw_travel / wavelength_travel  # mm/min
+        time_acquisition = screw_travel * 60 / feed_rate + 1  # 1 s margin for the acceleration
+
+        self.motors_controller.unlock_motors()
+        self.motors_controller.execute_g_code("G91")  # Set relative movement mode
+
+        wavelengths = self.signal_processing.calculate_wavelength(no_screw)
+        voltages_photodiodes = []
+        title_file = "raw_data_" + self.title_file_sample
+        with self.experim_manager.open_data_csv(self.path, TITLE_DATA_ACQUISITION, title_file) as data_writer:
+            # Photodiode 2 (mirror at rest) then photodiode 1 (mirror switched), one travel each
+            for physical_channel, mirror_move in zip(self.channels, [0.33334, -0.33334]):
+                moment, pulse_voltages = self.daq.voltage_acquisition_fly_scan(
+                    physical_channel, time_acquisition, 
+                    lambda: self.motors_controller.move_screw_linear(screw_travel, feed_rate), self.stop_event)
+                self.motors_controller.wait_for_idle()
+                self.check_stop()
+                pulse_positions = course_initial + np.clip(moment * feed_rate / 60, 0, screw_travel)
+                self.record_raw_pulses(pulse_positions, 2 if physical_channel == self.channels[0] else 1, [pulse_voltages])
+                voltages_photodiodes.append(self.signal_processing.resample_on_grid(pulse_positions, pulse_voltages, no_screw, 
+                                                                                    return_standard_error=True))
+                if physical_channel == self.channels[0]:
+                    # Points of the first travel written at once, photodiode 1 and absorbance not measured yet
+                    not_measured = np.full(len(no_screw), np.nan)
+                    voltages_photodiode_2, uncertainties_photodiode_2 = voltages_photodiodes[0]
+                    [voltages_reference, voltages_sample] = self.experim_manager.link_cuvette_voltage(
+                        self.cuvette_choice, not_measured, voltages_photodiode_2)
+                    [uncertainties_reference, uncertainties_sample] = self.experim_manager.link_cuvette_voltage(
+                        self.cuvette_choice, not_measured, uncertainties_photodiode_2)
+                    for row in zip(wavelengths, not_measured, voltages_reference, voltages_sample, no_screw, 
+                                   uncertainties_reference, uncertainties_sample):
+                        data_writer.write_row(row)
+                    # Back to the start of the scan, approached towards +X as in the sweep (backlash)
+                    self.motors_controller.move_screw_to(course_initial, self.backlash_approach)
+                    self.motors_controller.move_mirror_motor(mirror_move)  # Move mirror to switch cuvette
+                    self.motors_controller.wait_for_idle()
+                else:
+                    self.motors_controller.move_mirror_motor(mirror_move)  # Move mirror back
+                    self.motors_controller.wait_for_idle()
+
+            (voltages_photodiode_2, uncertainties_photodiode_2), (voltages_photodiode_1, uncertainties_photodiode_1) = voltages_photodiodes
+            [voltages_reference, voltages_sample] = self.experim_manager.link_cuvette_voltage(self.cuvette_choice, 
+                                                                                  voltages_photodiode_1, voltages_photodiode_2)
+            [uncertainties_reference, uncertainties_sample] = self.experim_manager.link_cuvette_voltage(self.cuvette_choice, 
+                                                                                  uncertainties_photodiode_1, uncertainties_photodiode_2)
+            absorbances = np.log10(voltages_reference/voltages_sample)
+            # Complete points written as soon as the second travel is folded
+            for row in zip(wavelengths, absorbances, voltages_reference, voltages_sample, no_screw, 
+                           uncertainties_reference, uncertainties_sample):
+                data_writer.write_row(row)
+                self.socketio.emit('update_data', {'data_y': row[1], "data_x": row[0], "slitId": self.slot_size})
+
+        return (wavelengths, absorbances, voltages_reference, voltages_sample, no_screw, 
+                uncertainties_reference, uncertainties_sample)
+
+    def acquisition(self, mode, wavelenght_min, wavelenght_max, wavelenght_step, scan_mode="precision", 
+                    wavelength_order="descending"):
         """
         Manages the complete acquisition process, including motor initialization and data saving.
 
@@ -175,21 +404,103 @@ class Varian634AcquisitionMode:
             screw_travel: Total distance for the screw to travel.
             number_measurements: Total number of measurements to perform.
             mode: Acquisition mode (e.g., baseline, scanning).
+            scan_mode: "precision" to stop at every step, "fly" to scan at constant speed, 
+                "adaptive" to rescan at the fine step only the bands found by a coarse survey.
+            wavelength_order: "descending" (screw towards +X) or "ascending" (screw towards -X, 
+                precision mode only). The screw stays at the end of the scan: alternating the 
+                order of consecutive scans avoids the return of the screw between them.
 
         Returns:
             The result of the precision mode operation, including wavelengths and absorbance values.
+
+        Raises:
+            StopRequested: The acquisition was stopped (see stop_event): the scan is not saved, 
+                its raw data CSV holds the points measured.
         """
+        start_time = time.strftime('%Y-%m-%dT%H:%M:%S')
+        self.raw_pulses = []
+        self.check_stop()
         # state_motor_motor_slits 
         self.motors_controller.initialisation_motors(self.slot_size)
+        self.check_stop()
         
-        [course_initial, step , number_measurements] = self.initialisation_setting(wavelenght_min, wavelenght_max, wavelenght_step)
-        data_acquisition = self.precision_mode(course_initial, step, number_measurements)
+        direction = -1 if wavelength_order == "ascending" and scan_mode == "precision" else 1
+        [course_initial, step , number_measurements] = self.initialisation_setting(wavelenght_min, wavelenght_max, 
+                                                                                   wavelenght_step, direction)
+        if scan_mode == "precision":
+            data_acquisition = self.precision_mode(course_initial, step, number_measurements, direction)
+        else:
+            scan_modes = {"fly": self.fly_mode, "adaptive": self.adaptive_mode}
+            data_acquisition = scan_modes[scan_mode](course_initial, step, number_measurements)
         # Data saving
-        title_data_acquisition = ["Longueur d'onde (nm)", "Absorbance", "Tension reference (Volt)", "Tension echantillon (Volt)", 
-                                  "pas de vis (mm)"]
         title_file = "raw_data_" + mode + "_" + self.title_file_sample
-        self.experim_manager.save_data_csv(self.path, data_acquisition, title_data_acquisition, title_file)  
+        metadata = {'mode': mode, 'scan_mode': scan_mode, 'wavelength_order': wavelength_order,
+                    'sample': self.sample_name, 'cuvette': self.cuvette_choice, 
+                    'calibration': self.signal_processing.calibration.to_dict(),
+                    'wavelength_range': [wavelenght_min, wavelenght_max, wavelenght_step], 'start': start_time}
+        path_file = self.experim_manager.save_data_store(self.path, data_acquisition, TITLE_DATA_ACQUISITION, 
+                                                         title_file, metadata)
+        if self.raw_pulses:
+            self.experim_manager.save_data_store(self.path, np.concatenate(self.raw_pulses, axis=1), TITLE_RAW_PULSES, 
+                                                 "raw_pulses_" + mode + "_" + self.title_file_sample, 
+                                                 dict(metadata, scan=os.path.basename(path_file)), dtype='float32')
+        self.catalog_run(path_file, data_acquisition, metadata)
+        if self.export_csv:
+            self.experim_manager.export_data_csv(self.path, title_file)
         self.motors_controller.wait_for_idle()
-        self.motors_controller.reset_screw_position(step*number_measurements)   
-        self.motors_controller.wait_for_idle()        
+        self.motors_controller.save_machine_state()
         return data_acquisition[:2]
+
+    def catalog_run(self, path_file, data_acquisition, metadata):
+        """
+        Records a scan and its points in the catalog of the experiments. The scan is already 
+        saved: a catalog that cannot be written (locked, read-only) does not stop the acquisition.
+
+        Parameters:
+            path_file: Spectrum store of the scan.
+            data_acquisition: Columns of the scan (see TITLE_DATA_ACQUISITION).
+            metadata: Metadata of the scan.
+        """
+        wavelength_min, wavelength_max, wavelength_step = metadata['wavelength_range']
+        try:
+            ExperimentCatalog(self.catalog_path).add_run(
+                sample=self.sample_name, slit=self.slot_size, cuvette=self.cuvette_choice, date=self.date,
+                mode=metadata['mode'], wavelength_min=wavelength_min, wavelength_max=wavelength_max,
+                wavelength_step=wavelength_step, path=path_file, metadata=metadata, 
+                wavelength=data_acquisition[0], absorbance=data_acquisition[1], screw_position=data_acquisition[4])
+        except sqlite3.Error as error:
+            print(f"Catalog not updated ({error}) : {path_file}")
+
+    def backlash_calibration(self, wavelenght_min, wavelenght_max, wavelenght_step):
+        """
+        Calibrates the backlash of the screw (see BacklashModel): scans the sample towards +X, 
+        then towards -X without compensation, and measures the shift between the two spectra.
+        The sample needs sharp features (e.g. holmium oxide filter) over the range.
+
+        Parameters:
+            wavelenght_min: Minimum wavelength of the scans.
+            wavelenght_max: Maximum wavelength of the scans.
+            wavelenght_step: Step of the scans.
+
+        Returns:
+            float: The shift of the screw positions of the scans towards -X in mm.
+        """
+        backlash = self.motors_controller.screw_backlash
+        backlash.shift = 0.0
+        title_file_sample = self.title_file_sample
+        scans = {}
+        for wavelength_order in ("descending", "ascending"):
+            self.title_file_sample = f"{title_file_sample}_backlash_{wavelength_order}"
+            self.motors_controller.initialisation_motors(self.slot_size)
+            direction = -1 if wavelength_order == "ascending" else 1
+            [course_initial, step, number_measurements] = self.initialisation_setting(wavelenght_min, wavelenght_max, 
+                                                                                       wavelenght_step, direction)
+            scans[wavelength_order] = self.precision_mode(course_initial, step, number_measurements, direction)
+        self.title_file_sample = title_file_sample
+        forward, backward = scans["descending"], scans["ascending"]
+        shift = backlash.calibrate(forward[4], forward[1], backward[4], backward[1])
+        backlash.save()
+        self.motors_controller.wait_for_idle()
+        self.motors_controller.save_machine_state()
+        print(f"Backlash of the screw: {shift:.4f} mm")
+        return shift
@@ -0,0 +1,167 @@
+"""
+Sensors of the VARIAN 634 read with an Arduino UNO running StandardFirmata (pyfirmata):
+limit switch of the screw, optical forks of the mirror and of the variable slits, switch
+of the slits.
+
+One service per board reads the Firmata messages in a single thread (in place of one
+pyfirmata.util.Iterator per caller), keeps the value of the watched pins and notifies
+the changes: the waits on a sensor wake up on the first message reporting the new value.
+"""
+
+import threading
+import time
+import weakref
+import serial
+from pyfirmata import INPUT
+
+
+class FirmataSensorService:
+    """
+    Reads the digital sensors wired on an Arduino running StandardFirmata.
+
+    Attributes:
+        board (pyfirmata.Arduino): Arduino of the sensors.
+        sampling_interval (int): Firmata sampling interval in ms.
+        values (dict): Last value of each watched pin (None until the first report).
+    """
+
+    services = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def for_board(cls, board, sampling_interval=19):
+        """
+        Returns the service of a board, created on first use: all the users of a board
+        share its service (a single reader of the Firmata messages).
+
+        Args:
+            board (pyfirmata.Arduino): Arduino of the sensors.
+            sampling_interval (int): Firmata sampling interval in ms (used on creation).
+
+        Returns:
+            FirmataSensorService: Service of the board.
+        """
+        if board not in cls.services:
+            cls.services[board] = cls(board, sampling_interval)
+        return cls.services[board]
+
+    def __init__(self, board, sampling_interval=19):
+        """
+        Args:
+            board (pyfirmata.Arduino): Arduino of the sensors.
+            sampling_interval (int): Firmata sampling interval in ms.
+        """
+        self.board = board
+        self.sampling_interval = sampling_interval
+        self.board.samplingOn(sampling_interval)
+        self.report_timeout = 1.0  # s, first report of a pin after the start of its reporting
+        self.condition = threading.Condition()
+        self.values = {}
+        self.callbacks = {}
+        self.running = True
+        self.reader = threading.Thread(target=self.read_messages, daemon=True)
+        self.reader.start()
+
+    def watch(self, pins):
+        """
+        Configures pins as inputs reported by Firmata and waits for their first report.
+
+        Args:
+            pins (list): Digital pins of the sensors.
+        """
+        with self.condition:
+            new_pins = [pin for pin in pins if pin not in self.values]
+            for pin in new_pins:
+                self.board.digital[pin].mode = INPUT  # enables the reporting of the pin
+                self.values[pin] = self.board.digital[pin].read()
+            self.condition.wait_for(lambda: all(self.values[pin] is not None for pin in pins), self.report_timeout)
+
+    def read(self, pin):
+        """
+        Args:
+            pin (int): Digital pin of the sensor.
+
+        Returns:
+            bool: Last value reported for the pin.
+        """
+        if pin not in self.values:
+            self.watch([pin])
+        return self.values[pin]
+
+    def add_callback(self, pin, callback):
+        """
+        Calls callback(pin, value) from the reader thread each time the value of a pin changes.
+
+        Args:
+            pin (int): Digital pin of the sensor.
+            callback (callable): Function called with the pin and its new value.
+        """
+        self.watch([pin])
+        with self.condition:
+            self.callbacks.setdefault(pin, []).append(callback)
+
+    def remove_callback(self, pin, callback):
+        """
+        Removes a callback added with add_callback.
+
+        Args:
+            pin (int): Digital pin of the sensor.
+            callback (callable): Function to remove.
+        """
+        with self.condition:
+            self.callbacks.get(pin, []).remove(callback)
+
+    def wait_for_state(self, pin, value, timeout=None):
+        """
+        Blocks until a pin has the given value.
+
+        Args:
+            pin (int): Digital pin of the sensor.
+            value (bool): Value waited for.
+            timeout (float): Maximum waiting time in seconds (no limit by default).
+
+        Raises:
+            TimeoutError: The pin does not have the value after the timeout.
+        """
+        self.watch([pin])
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.values[pin] == value, timeout):
+                raise TimeoutError(f"The sensor on pin {pin} is not {value} after {timeout} s")
+
+    def close(self):
+        """
+        Stops the reader thread.
+        """
+        self.running = False
+        self.reader.join()
+        FirmataSensorService.services.pop(self.board, None)
+
+    def read_messages(self):
+        """
+        Reader thread: handles the Firmata messages and notifies the changes of the watched pins.
+        """
+        while self.running:
+            try:
+                while self.board.bytes_available():
+                    self.board.iterate()
+            except (AttributeError, serial.SerialException, OSError):
+                break  # port closed
+            self.check_changes()
+            time.sleep(self.sampling_interval / 2000)
+
+    def check_changes(self):
+        """
+        Updates the values of the watched pins, calls the callbacks of the pins which changed
+        and wakes up the waits.
+        """
+        changes = []
+        with self.condition:
+            for pin in self.values:
+                value = self.board.digital[pin].read()
+                if value != self.values[pin]:
+                    self.values[pin] = value
+                    changes.append((pin, value))
+            if changes:
+                self.condition.notify_all()
+            callbacks = [(callback, pin, value) for pin, value in changes for callback in self.callbacks.get(pin, [])]
+        for callback, pin, value in callbacks:
+            callback(pin, value)
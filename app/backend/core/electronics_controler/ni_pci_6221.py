@@ -22,8 +22,10 @@ the voltage from the photodiode is directly
 proportional to the received light intensity.
 
 3. Therefore, by measuring 
-the minimum amplitude of 
-the square signal produced by the photodiode, 
+the amplitude of the lamp pulses in 
+the square signal produced by the photodiode 
+(samples folded by the period of the lamp 
+pulse train, see fold_lamp_pulses), 
 it becomes possible to quantify the intensity 
 of the received light. This information 
 is crucial for subsequent calculations, 
@@ -38,11 +40,20 @@ of the analyzed chemical sample.
 
 import time
 import sys
+from contextlib import contextmanager
 import numpy as np
-import nidaqmx
-from nidaqmx.constants import AcquisitionType, TerminalConfiguration, VoltageUnits
-from pyfirmata import util, INPUT
-from scipy.signal import find_peaks
+from core.electronics_controler.firmata_sensors import FirmataSensorService
+from core.utils.lazy_import import LazyImport
+
+# NI-DAQmx imported on first use: the server (and the simulated hardware) start without it
+nidaqmx = LazyImport('nidaqmx')
+AcquisitionType = LazyImport('nidaqmx.constants', 'AcquisitionType')
+Edge = LazyImport('nidaqmx.constants', 'Edge')
+TaskMode = LazyImport('nidaqmx.constants', 'TaskMode')
+TerminalConfiguration = LazyImport('nidaqmx.constants', 'TerminalConfiguration')
+VoltageUnits = LazyImport('nidaqmx.constants', 'VoltageUnits')
+AnalogSingleChannelReader = LazyImport('nidaqmx.stream_readers', 'AnalogSingleChannelReader')
+AnalogUnscaledReader = LazyImport('nidaqmx.stream_readers', 'AnalogUnscaledReader')
 
 
 class ElectronicVarian634:
@@ -69,15 +80,47 @@ class ElectronicVarian634:
         # cf link : Figure 8. NI PCI/PXI-6221 Pinout
         # /Dev1/ctr0 : pin 2 / pin 36 (ground)
         self.device = '/Dev1/ctr0'
-
-    def configure_task_voltage(self, task_voltage, physical_channel):
+        # Start trigger of the finite acquisitions on the lamp pulse train: each acquisition 
+        # starts on a rising edge of ctr0 and lasts pulses_per_acquisition lamp periods
+        self.trigger_on_lamp = False
+        self.trigger_source = '/Dev1/Ctr0InternalOutput'
+        self.pulses_per_acquisition = 20
+        # Start of the lamp pulse after the rising edge, in fraction of the period
+        self.lamp_pulse_phase = 0.0
+        # Phase of the pulses found on the samples (acquisition not triggered): minimum contrast 
+        # between the pulse and the dark levels, in standard errors of the mean profile
+        self.min_pulse_contrast = 5.0
+        # Adaptive integration: blocks of number_of_samples() samples are acquired until the 
+        # relative standard error of the amplitude is below the target or the time is over
+        self.adaptive_integration = False
+        self.target_relative_error = 0.002
+        self.max_integration_time = 5.0  # s
+        # Fly scan : number of lamp periods read from the continuous acquisition at once
+        self.fly_scan_periods_per_read = 10
+        # Session : tasks kept open for a whole scan (see open_session)
+        self.task_impulsion = None
+        self.session_tasks = {}  # finite acquisition task of each photodiode channel
+        self.session_channels = []
+        # Raw (int16) acquisition, scaled only for the values that are kept
+        self.raw_acquisition = False
+        # Preallocated numpy buffers reused by all the reads (see get_buffer)
+        self.buffers = {}
+        # Amplitudes of the lamp pulses of each acquisition (raw data of the scans), appended 
+        # by acquire_lamp_pulses when it is a list
+        self.pulse_record = None
+
+    def configure_task_voltage(self, task_voltage, physical_channel, sample_mode=None):
         """
         Configures the analog voltage measurement task.
 
         Parameters:
         - task_voltage : nidaqmx task object.
         - physical_channel (str) : Analog input physical_channel to configure (e.g., 'Dev1/ai0').
+        - sample_mode (AcquisitionType) : FINITE (default) for a step acquisition, CONTINUOUS for a fly scan 
+        (samples_per_channel is then the size of the acquisition buffer).
         """
+        if sample_mode is None:
+            sample_mode = AcquisitionType.FINITE
         # terminal_config = TerminalConfiguration.DIFF 
         # because we measure the potential difference between two ports of the NI PCI/PXI-6221 Pinout
         # e.g., The voltage at Dev1/ai0 terminals = potential_pin_68 - potential_pin_34
@@ -86,7 +129,34 @@ class ElectronicVarian634:
         #sample_mode=AcquisitionType.FINITE : Acquire or generate a finite number of samples. 
         # But why is it better than CONTINUOUS?
         # Better...
-        task_voltage.timing.cfg_samp_clk_timing(self.sample_rate, samps_per_chan=self.samples_per_channel, sample_mode=AcquisitionType.FINITE)
+        task_voltage.timing.cfg_samp_clk_timing(self.sample_rate, samps_per_chan=self.number_of_samples(), sample_mode=sample_mode)
+        if self.trigger_on_lamp and sample_mode == AcquisitionType.FINITE:
+            # The acquisition starts with a lamp period: a read holds a whole number of pulses at a known phase
+            task_voltage.triggers.start_trigger.cfg_dig_edge_start_trig(self.trigger_source, trigger_edge=Edge.RISING)
+
+    def number_of_samples(self):
+        """
+        Number of samples per channel of a finite acquisition.
+
+        Returns:
+        - number_of_samples (int) : pulses_per_acquisition lamp periods when the acquisition is 
+        triggered on the lamp, samples_per_channel otherwise.
+        """
+        if self.trigger_on_lamp:
+            return self.pulses_per_acquisition * int(round(self.sample_rate / self.frequency[0]))
+        return self.samples_per_channel
+
+    def lamp_pulse_window(self):
+        """
+        Samples of the lamp pulse in a period starting on a rising edge of ctr0.
+
+        Returns:
+        - lamp_on (array bool) : True for the samples of the lamp pulse.
+        """
+        samples_per_period = int(round(self.sample_rate / self.frequency[0]))
+        index = np.arange(samples_per_period)
+        start = int(round(self.lamp_pulse_phase * samples_per_period))
+        return (index - start) % samples_per_period < int(round(self.duty_cycle[0] * samples_per_period))
 
     def configure_task_impulsion(self, task_impulsion):
         """
@@ -101,6 +171,54 @@ class ElectronicVarian634:
         task_impulsion.timing.cfg_implicit_timing(sample_mode=AcquisitionType.CONTINUOUS)
         task_impulsion.start()
     
+    def get_buffer(self, shape, dtype=np.float64):
+        """
+        Returns a preallocated buffer, created on first use and reused by the following reads.
+
+        Parameters:
+        - shape (tuple int) : Shape of the buffer, e.g. (number of channels, samples per channel).
+        - dtype : numpy type of the samples (float64 for volts, int16 for raw samples).
+
+        Returns:
+        - buffer (array) : Buffer whose content is overwritten by the next read of the same shape.
+        """
+        key = (shape, np.dtype(dtype))
+        if key not in self.buffers:
+            self.buffers[key] = np.empty(shape, dtype=dtype)
+        return self.buffers[key]
+
+    def read_voltages(self, task, number_of_samples=None):
+        """
+        Reads the voltage of a single channel task into a preallocated numpy buffer.
+
+        Parameters:
+        - task : nidaqmx task object with one analog input channel.
+        - number_of_samples (int) : Number of samples to read (number_of_samples() by default).
+
+        Returns:
+        - voltages (array float) : Measured voltages (buffer reused by the next read).
+        """
+        number_of_samples = self.number_of_samples() if number_of_samples is None else number_of_samples
+        voltages = self.get_buffer((number_of_samples,))
+        reader = AnalogSingleChannelReader(task.in_stream)
+        reader.read_many_sample(voltages, number_of_samples_per_channel=number_of_samples)
+        return voltages
+
+    def scale_raw(self, task, channel_index, raw_values):
+        """
+        Converts raw int16 samples of a channel into volts with the device scaling polynomial.
+
+        Parameters:
+        - task : nidaqmx task object of the raw samples.
+        - channel_index (int) : Index of the channel in the task.
+        - raw_values (array int16 or float) : Raw samples, or a reduction of them (min, mean...).
+
+        Returns:
+        - voltages (array float) : Voltages in volts.
+        """
+        coefficients = task.ai_channels[channel_index].ai_dev_scaling_coeff
+        return np.polynomial.polynomial.polyval(np.asarray(raw_values, dtype=np.float64), coefficients)
+
     def measure_voltage(self, task, physical_channel):
         """
         Measures voltage across the specified physical_channel.
@@ -110,12 +228,11 @@ class ElectronicVarian634:
         - physical_channel (str) : Analog input physical_channel to measure (e.g., 'Dev1/ai0').
 
         Returns:
-        - voltages (list float): List of measured voltages.
+        - voltages (array float): Measured voltages (buffer reused by the next read).
         """
 
-        voltages = []
         self.configure_task_voltage(task, physical_channel)
-        voltages = task.read(number_of_samples_per_channel=self.samples_per_channel)
+        voltages = self.read_voltages(task)
         task.stop()
         return voltages
 
@@ -130,41 +247,324 @@ class ElectronicVarian634:
         Returns:
         - mean (float) : Mean of the measured voltages.
         """
-        voltages = []
-        self.configure_task_voltage(task, physical_channel)
-        voltages = task.read(number_of_samples_per_channel=self.samples_per_channel)
-        voltages = np.array(self.measure_voltage(task, physical_channel))
+        voltages = self.measure_voltage(task, physical_channel)
         mean = np.mean(voltages)
         return mean
     
 
+    def open_session(self, physical_channels):
+        """
+        Opens the tasks used for a whole scan: the lamp pulse train on ctr0, which keeps 
+        running, and one finite acquisition task per photodiode channel, configured and 
+        verified once so that each measurement only starts the task of its channel. A 
+        measurement samples its channel alone: the channels are not multiplexed and only 
+        the samples used are read. The NI-PCI 6221 has a single analog input timing engine: 
+        the task of a channel holds it only while it runs (a task committed for the whole 
+        scan would keep the other one from starting).
+
+        Parameters:
+        - physical_channels (list str) : Analog input channels of the photodiodes (e.g., ['Dev1/ai0', 'Dev1/ai1']).
+        """
+        if self.session_tasks:
+            return
+        self.task_impulsion = nidaqmx.Task()
+        self.configure_task_impulsion(self.task_impulsion)
+        for physical_channel in physical_channels:
+            task = nidaqmx.Task()
+            self.configure_task_voltage(task, physical_channel)
+            task.control(TaskMode.TASK_VERIFY)
+            self.session_tasks[physical_channel] = task
+        self.session_channels = list(physical_channels)
+
+    def close_session(self):
+        """
+        Stops and releases the tasks opened by open_session.
+        """
+        if not self.session_tasks:
+            return
+        self.task_impulsion.stop()
+        self.task_impulsion.close()
+        for task in self.session_tasks.values():
+            task.close()
+        self.task_impulsion = None
+        self.session_tasks = {}
+        self.session_channels = []
+
+    @contextmanager
+    def session(self, physical_channels):
+        """
+        Keeps the acquisition tasks open for the duration of a `with` block.
+
+        Parameters:
+        - physical_channels (list str) : Analog input channels of the photodiodes (e.g., ['Dev1/ai0', 'Dev1/ai1']).
+        """
+        self.open_session(physical_channels)
+        try:
+            yield self
+        finally:
+            self.close_session()
+
+    def read_session(self, physical_channel):
+        """
+        Runs one finite acquisition with the session task of a channel, read into a 
+        preallocated buffer.
+
+        Parameters:
+        - physical_channel (str) : Analog input physical_channel to measure (e.g., 'Dev1/ai0').
+
+        Returns:
+        - voltages (array float) : Voltages measured on physical_channel (buffer reused by 
+        the next read).
+        """
+        task = self.session_tasks[physical_channel]
+        task.start()
+        voltages = self.read_voltages(task)
+        task.stop()
+        return voltages
+
+    def read_session_raw(self, physical_channel):
+        """
+        Runs one finite acquisition with the session task of a channel and returns the raw 
+        unscaled samples (int16, 4 times lighter than volts in float64). Use scale_raw to 
+        convert the values kept.
+
+        Parameters:
+        - physical_channel (str) : Analog input physical_channel to measure (e.g., 'Dev1/ai0').
+
+        Returns:
+        - raw_values (array int16) : Raw samples of physical_channel (view of the buffer 
+        reused by the next read).
+        """
+        task = self.session_tasks[physical_channel]
+        shape = (1, self.number_of_samples())
+        raw_values = self.get_buffer(shape, np.int16)
+        task.start()
+        reader = AnalogUnscaledReader(task.in_stream)
+        reader.read_int16(raw_values, number_of_samples_per_channel=shape[1])
+        task.stop()
+        return raw_values[0]
+
+    def fold_lamp_pulses(self, voltages, lamp_on=None):
+        """
+        Folds the samples by the period of the lamp pulse train (reshape of the samples into 
+        one row per period) and averages, for each period, the samples of the lamp pulse 
+        and the samples between two pulses.
+
+        When the phase of the pulses is unknown, the samples of the pulse are found on the mean 
+        profile of all the periods: they are those below the middle of its range (the 
+        photodiode signal is negative). On a dark or noisy signal, this threshold only splits 
+        the noise and "on minus off" is biased: below a contrast of min_pulse_contrast (see 
+        pulse_contrast), the nominal pulse window is used instead, placed on the pulses of the 
+        other half of the periods (see locate_pulse_window). The window of a period does not 
+        depend on its noise: the amplitude stays "on minus off", without bias on a dark 
+        signal, and the scatter of the amplitudes gives its standard error.
+
+        Parameters:
+        - voltages (array) : Samples of one channel, in volts or raw int16.
+        - lamp_on (array bool) : Samples of the pulse in a period, when the phase is known 
+        (acquisition triggered on the lamp, see lamp_pulse_window).
+
+        Returns:
+        - on_means (array float) : Mean of the pulse samples of each period.
+        - off_means (array float) : Mean of the other samples of each period.
+        """
+        samples_per_period = int(round(self.sample_rate / self.frequency[0]))
+        number_of_periods = len(voltages) // samples_per_period
+        pulses = np.reshape(voltages[:number_of_periods*samples_per_period], (number_of_periods, samples_per_period))
+        if lamp_on is None:
+            profile = np.mean(pulses, axis=0)
+            lamp_on = profile < (np.min(profile) + np.max(profile)) / 2
+            if self.pulse_contrast(pulses, lamp_on) < self.min_pulse_contrast and number_of_periods > 1:
+                # Pulse not found on the profile: windows of the even periods placed on the odd ones 
+                # and conversely
+                on_means, off_means = np.empty(number_of_periods), np.empty(number_of_periods)
+                for periods, other_periods in ((slice(0, None, 2), slice(1, None, 2)), 
+                                               (slice(1, None, 2), slice(0, None, 2))):
+                    window = self.locate_pulse_window(np.mean(pulses[other_periods], axis=0))
+                    on_means[periods], off_means[periods] = self.window_means(pulses[periods], window)
+                return on_means, off_means
+        return self.window_means(pulses, lamp_on)
+
+    def window_means(self, pulses, lamp_on):
+        """
+        Means of the samples in and out of the pulse window of each period.
+
+        Parameters:
+        - pulses (array) : Samples, one row per period.
+        - lamp_on (array bool) : Samples of the pulse in a period.
+
+        Returns:
+        - on_means (array float) : Mean of the pulse samples of each period.
+        - off_means (array float) : Mean of the other samples of each period (plain mean of 
+        the period, as on_means, for a window without dark samples).
+        """
+        if lamp_on.all() or not lamp_on.any():
+            # Window without dark samples: plain mean
+            return np.mean(pulses, axis=1), np.zeros(len(pulses))
+        lamp_off = ~lamp_on
+        on_means = pulses @ (lamp_on / np.count_nonzero(lamp_on))
+        off_means = pulses @ (lamp_off / np.count_nonzero(lamp_off))
+        return on_means, off_means
+
+    def locate_pulse_window(self, profile):
+        """
+        Nominal pulse window (duty cycle of the lamp, see lamp_pulse_window) at the phase where 
+        the mean of the profile in the window is the lowest (matched filter of the pulse).
+
+        Parameters:
+        - profile (array) : Mean profile of a lamp period.
+
+        Returns:
+        - lamp_on (array bool) : Samples of the pulse in a period.
+        """
+        samples_per_period = len(profile)
+        width = np.count_nonzero(self.lamp_pulse_window())
+        cumulative = np.cumsum(np.concatenate(([0.0], profile, profile[:width])))
+        start = np.argmin(cumulative[width:width + samples_per_period] - cumulative[:samples_per_period])
+        return (np.arange(samples_per_period) - start) % samples_per_period < width
+
+    def pulse_contrast(self, pulses, lamp_on):
+        """
+        Contrast of the pulses found on the mean profile: difference between the dark and 
+        pulse levels of the profile divided by the standard error of a sample of the profile 
+        (scatter of the samples between the periods). Splitting pure noise gives about 1.6.
+
+        Parameters:
+        - pulses (array) : Samples, one row per period.
+        - lamp_on (array bool) : Samples of the pulse in a period.
+
+        Returns:
+        - contrast (float) : Contrast of the pulses, 0 when it cannot be estimated (a single 
+        period, or no sample on one side).
+        """
+        if len(pulses) < 2 or lamp_on.all() or not lamp_on.any():
+            return 0.0
+        profile = np.mean(pulses, axis=0)
+        standard_error = np.sqrt(np.mean(np.var(pulses, axis=0, ddof=1)) / len(pulses))
+        contrast = np.mean(profile[~lamp_on]) - np.mean(profile[lamp_on])
+        return contrast / standard_error if standard_error > 0 else np.inf
+
+    def lock_in_amplitude(self, on_means, off_means):
+        """
+        Amplitude of the lamp pulses and its standard error.
+
+        Parameters:
+        - on_means (array float) : Mean of the pulse samples of each period.
+        - off_means (array float) : Mean of the other samples of each period.
+
+        Returns:
+        - amplitude (float) : Mean amplitude of the pulses (negative, as the photodiode signal).
+        - standard_error (float) : Standard error of the mean amplitude.
+        """
+        amplitudes = on_means - off_means
+        standard_error = np.std(amplitudes, ddof=1) / np.sqrt(len(amplitudes)) if len(amplitudes) > 1 else np.inf
+        return np.mean(amplitudes), standard_error
+
+    def acquire_lamp_pulses(self, physical_channel):
+        """
+        Acquires number_of_samples() samples and folds them by the period of the lamp 
+        pulse train (see fold_lamp_pulses). The tasks of the session are used when a 
+        session is open on physical_channel. The amplitudes of the pulses are appended to 
+        pulse_record when it is a list.
+
+        Parameters:
+        - physical_channel (str) : Analog input physical_channel to measure (e.g., 'Dev1/ai0').
+
+        Returns:
+        - on_means (array float) : Mean of the pulse samples of each period in volts.
+        - off_means (array float) : Mean of the other samples of each period in volts.
+        """
+        lamp_on = self.lamp_pulse_window() if self.trigger_on_lamp else None
+        if physical_channel in self.session_channels and self.raw_acquisition:
+            # Only the means of each period are scaled to volts
+            on_means, off_means = self.fold_lamp_pulses(self.read_session_raw(physical_channel), lamp_on)
+            on_means = self.scale_raw(self.session_tasks[physical_channel], 0, on_means)
+            off_means = self.scale_raw(self.session_tasks[physical_channel], 0, off_means)
+        elif physical_channel in self.session_channels:
+            on_means, off_means = self.fold_lamp_pulses(self.read_session(physical_channel), lamp_on)
+        else:
+            with nidaqmx.Task() as task_impulsion, nidaqmx.Task() as task_voltage:
+                self.configure_task_impulsion(task_impulsion)
+                self.configure_task_voltage(task_voltage, physical_channel)
+                on_means, off_means = self.fold_lamp_pulses(self.read_voltages(task_voltage), lamp_on)
+                task_impulsion.stop()
+                task_voltage.stop()
+        if self.pulse_record is not None:
+            self.pulse_record.append(on_means - off_means)
+        return on_means, off_means
+
+    def voltage_acquisition_lock_in(self, physical_channel):
+        """
+        Measures the amplitude of the lamp pulses on one acquisition (see acquire_lamp_pulses).
+
+        Parameters:
+        - physical_channel (str) : Analog input physical_channel to measure (e.g., 'Dev1/ai0').
+
+        Returns:
+        - amplitude (float) : Mean amplitude of the lamp pulses in volts.
+        - standard_error (float) : Standard error of the amplitude in volts.
+        """
+        return self.lock_in_amplitude(*self.acquire_lamp_pulses(physical_channel))
+
+    def voltage_acquisition_adaptive(self, physical_channel):
+        """
+        Acquires blocks of lamp pulses until the standard error of the amplitude falls below 
+        target_relative_error times the amplitude, or until max_integration_time is reached.
+        Bright wavelengths stop after one block, dark ones are averaged longer.
+
+        Parameters:
+        - physical_channel (str) : Analog input physical_channel to measure (e.g., 'Dev1/ai0').
+
+        Returns:
+        - amplitude (float) : Mean amplitude of the lamp pulses in volts.
+        - standard_error (float) : Standard error of the amplitude in volts.
+        """
+        number_of_pulses, sum_amplitudes, sum_squares = 0, 0.0, 0.0
+        start_time = time.time()
+        while True:
+            on_means, off_means = self.acquire_lamp_pulses(physical_channel)
+            amplitudes = on_means - off_means
+            number_of_pulses += len(amplitudes)
+            sum_amplitudes += np.sum(amplitudes)
+            sum_squares += np.sum(amplitudes**2)
+            amplitude = sum_amplitudes / number_of_pulses
+            variance = max(sum_squares - number_of_pulses * amplitude**2, 0.0) / max(number_of_pulses - 1, 1)
+            standard_error = np.sqrt(variance / number_of_pulses)
+            if standard_error <= self.target_relative_error * abs(amplitude):
+                break
+            if time.time() - start_time >= self.max_integration_time:
+                break
+        return amplitude, standard_error
+
+    def voltage_acquisition(self, physical_channel):
+        """
+        Measures the amplitude of the lamp pulses and its standard error, with the adaptive 
+        integration when adaptive_integration is set.
+
+        Parameters:
+        - physical_channel (str) : Analog input physical_channel to measure (e.g., 'Dev1/ai0').
+
+        Returns:
+        - amplitude (float) : Mean amplitude of the lamp pulses in volts.
+        - standard_error (float) : Standard error of the amplitude in volts.
+        """
+        if self.adaptive_integration:
+            return self.voltage_acquisition_adaptive(physical_channel)
+        return self.voltage_acquisition_lock_in(physical_channel)
+
     def voltage_acquisition_scanning_baseline(self, physical_channel):
         """
         Performs voltage acquisition based on the task type.
+        The tasks of the session are used when a session is open on physical_channel.
 
         Parameters:
         - physical_channel (str) : Analog input physical_channel to measure (e.g., 'Dev1/ai0').
 
         Returns:
-        - min_voltages (float) :  Mean of the measured voltages.
+        - amplitude (float) : Mean amplitude of the lamp pulses (see voltage_acquisition_lock_in).
         """
-
-        min_voltages=[]
-        with nidaqmx.Task() as task_impulsion, nidaqmx.Task() as task_voltage:
-            self.configure_task_impulsion(task_impulsion)
-            self.configure_task_voltage(task_voltage, physical_channel)
-            for _ in range(3):
-                # Acquisition des données
-                voltages = task_voltage.read(number_of_samples_per_channel=self.samples_per_channel)
-                # Conversion des données en un tableau numpy pour faciliter les calculs
-                voltages = np.array(voltages)
-                # Trouver et stocker le minimum
-                min_voltage = np.min(voltages)
-                min_voltages.append(min_voltage)
-            task_impulsion.stop()
-            task_voltage.stop()
-            mean = np.mean(min_voltages)
-        return mean
+        amplitude, _ = self.voltage_acquisition_lock_in(physical_channel)
+        return amplitude
 
 
     def voltage_acquisition_chemical_kinetics(self, physical_channel, time_acquisition, delay_between_measurements):
@@ -178,11 +578,11 @@ class ElectronicVarian634:
 
         Returns:
         - moment (list float) : List of time instants.
-        - voltages (list float) : List of minimum measured voltages.
+        - voltages (list float) : List of mean amplitudes of the lamp pulses.
         """
         mean_voltages = []
         moment = []
-        peak_search_window = (self.samples_per_channel/self.frequency[0])
+        lamp_on = self.lamp_pulse_window() if self.trigger_on_lamp else None
 
         with nidaqmx.Task() as task_impulsion, nidaqmx.Task() as task_voltage:
             self.configure_task_impulsion(task_impulsion)
@@ -190,16 +590,11 @@ class ElectronicVarian634:
             start_time = time.time()
             while time.time() - start_time < time_acquisition + 1:  # Loop for the specified duration
                 start_time_temp = time.time() # Data acquisition
-                voltages = task_voltage.read(number_of_samples_per_channel=self.samples_per_channel)
+                voltages = self.read_voltages(task_voltage)
                 moment.append(start_time_temp - start_time)
-                peaks, _ = find_peaks(voltages, distance=peak_search_window)
-                # Conversion des données en un tableau numpy pour faciliter les calculs
-                # Convertir les indices des pics en un array python
-                peak_voltages = np.array([voltages[i] for i in peaks])
-                print(peak_voltages)
-                print(np.shape(peak_voltages))
-                # Trouver et stocker le minimum
-                mean_voltage = np.mean(peak_voltages)
+                # Amplitude des impulsions de la lampe
+                mean_voltage, standard_error = self.lock_in_amplitude(*self.fold_lamp_pulses(voltages, lamp_on))
+                print(f"amplitude : {mean_voltage} V +/- {standard_error} V")
                 mean_voltages.append(mean_voltage)               
                             
                 # Loop for wait
@@ -216,6 +611,49 @@ class ElectronicVarian634:
 
 
     
+    def voltage_acquisition_fly_scan(self, physical_channel, time_acquisition, start_motion, stop_event=None):
+        """
+        Acquires the voltage continuously while the diffraction grating moves and 
+        reduces it to one voltage per lamp pulse.
+
+        Parameters:
+        - physical_channel (str) : Analog input physical_channel to measure (e.g., 'Dev1/ai0').
+        - time_acquisition (float) : Acquisition duration in seconds.
+        - start_motion (callable) : Function sending the motion to GRBL, called once 
+        the acquisition is running.
+        - stop_event (threading.Event) : Stop of the acquisition: once set, the acquisition 
+        ends after the current read (pulses acquired so far).
+
+        Returns:
+        - moment (array float) : Instant of each lamp pulse in seconds, from the start of the motion.
+        - pulse_voltages (array float) : Amplitude of each lamp pulse.
+        """
+        samples_per_period = int(self.sample_rate / self.frequency[0])
+        periods_per_read = self.fly_scan_periods_per_read
+        number_of_reads = int(np.ceil(time_acquisition * self.frequency[0] / periods_per_read))
+        pulse_voltages = np.empty(number_of_reads * periods_per_read)
+
+        with nidaqmx.Task() as task_impulsion, nidaqmx.Task() as task_voltage:
+            self.configure_task_impulsion(task_impulsion)
+            self.configure_task_voltage(task_voltage, physical_channel, sample_mode=AcquisitionType.CONTINUOUS)
+            task_voltage.start()
+            start_time = time.time()
+            start_motion()
+            motion_delay = time.time() - start_time
+            for i in range(number_of_reads):
+                if stop_event is not None and stop_event.is_set():
+                    pulse_voltages = pulse_voltages[:i*periods_per_read]
+                    break
+                # Reads are a whole number of lamp periods: one amplitude per pulse
+                voltages = self.read_voltages(task_voltage, periods_per_read*samples_per_period)
+                on_means, off_means = self.fold_lamp_pulses(voltages)
+                pulse_voltages[i*periods_per_read:(i+1)*periods_per_read] = on_means - off_means
+            task_impulsion.stop()
+            task_voltage.stop()
+
+        moment = (np.arange(len(pulse_voltages)) + 0.5) / self.frequency[0] - motion_delay
+        return moment, pulse_voltages
+
     def sensors_state(self, board, pin):
         """
         Provides the digital state of a sensor: True or False.
@@ -223,24 +661,12 @@ class ElectronicVarian634:
             - board (class) : class Arduino of pyfirmata 
             - pin (int) : output pin of sensor on the Arduino 
         """
-        # Configure digital port 3 as input
-        board.digital[pin].mode = INPUT
-
-        # Create an Iterator instance to not miss incoming data
-        it = util.Iterator(board)
-        it.start()
-
-        # Allow the iterator to start
-        time.sleep(1)
-        
-        # Read the value of digital port 3
-        digital_value = board.digital[pin].read()
+        # Read the value of the digital port (service shared by all the users of the board)
+        digital_value = FirmataSensorService.for_board(board).read(pin)
 
         # Display the value
         print(f"Value read on digital port {pin}:", digital_value)
-
-        # Wait a bit before reading again
-        time.sleep(0.1)
+        return digital_value
 
 
 
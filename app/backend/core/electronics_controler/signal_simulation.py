@@ -3,182 +3,214 @@ Programme de simulation signal des photodiode
 """
 
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy.signal import find_peaks
+from core.utils.lazy_import import LazyImport
+
+find_peaks = LazyImport('scipy.signal', 'find_peaks')  # imported on first use
 
 # Paramètres
 longueur = 100000  # Longueur de la série de données
 periode = 2500  # Période à laquelle la fonction prend une valeur non nulle
 peak_search_window = periode
+
+
+def photodiode_signal_simu(amplitude=1.0, nombre_echantillons=longueur, periode_impulsion=periode, 
+                           largeur_impulsion=1, phase=0, bruit_ecart_type=0.0058):
+    """
+    Simulation de la tension d'une photodiode éclairée par la lampe à arc au Xénon
+
+    Chaque impulsion de la lampe donne une tension négative d'amplitude 
+    amplitude * a, avec a tiré uniformément entre 0.6 et 1.1 (fluctuation 
+    de la lampe d'une impulsion à l'autre), à laquelle s'ajoute un bruit gaussien.
+
+    Paramètres:
+    - amplitude (float) : amplitude moyenne des impulsions (Volt)
+    - nombre_echantillons (int) : nombre d'échantillons simulés
+    - periode_impulsion (int) : période des impulsions en échantillons
+    - largeur_impulsion (int) : durée d'une impulsion en échantillons
+    - phase (int) : indice du début de la première impulsion
+    - bruit_ecart_type (float) : écart-type du bruit (Volt)
+
+    Retourne:
+    - y (array float) : tension simulée (Volt)
+    """
+    y = np.zeros(nombre_echantillons)
+    debuts = np.arange(phase % periode_impulsion - periode_impulsion, nombre_echantillons, periode_impulsion)
+    a = np.random.uniform(0.6, 1.1, len(debuts))
+    # Indice de chaque échantillon dans sa période (position par rapport au début de l'impulsion)
+    indice = (np.arange(nombre_echantillons) - debuts[0]) % periode_impulsion
+    numero = (np.arange(nombre_echantillons) - debuts[0]) // periode_impulsion
+    impulsion = indice < largeur_impulsion
+    y[impulsion] = -amplitude * a[numero[impulsion]]
+    y += np.random.normal(0, bruit_ecart_type, nombre_echantillons)
+    return y
+
+
 def photodiode_voltages_simu():
     """
     Simulation de la tension des photodiode
     """
     # Génération des données
     x = np.arange(0,1,1/longueur)
-    y = np.zeros(longueur)
-    a = np.random.uniform(0.6, 1.1, longueur // periode)
-
-    for i in range(len(a)):
-        y[i * periode] = a[i] * -1
+    y = photodiode_signal_simu()
 
     # Nota : écart type mini bien avec log opti pour des valeurs < -1 
     # Sinon pour des valeurs au-dessus de > -1 la moyennes c'est mieux
 
-    # Ajout de bruit
-    bruit = np.random.normal(0, 0.0058, longueur)  # Moyenne 0, écart-type 0.5
-    y += bruit
     y_dect= -y
     peaks, _ = find_peaks(y_dect, distance=peak_search_window)
     # Conversion des données en un tableau numpy pour faciliter les calculs
     # Convertir les indices des pics en un array python
     peak_voltages = -np.array([y_dect[i] for i in peaks])
     return x, y, peaks, peak_voltages
-
-[x, y, peaks, peaks_voltages] = photodiode_voltages_simu()
-
-# Affichage des données
-plt.figure(figsize=(10, 6))
-plt.plot(x, y, label="Tension photodiode simulé")
-plt.xlabel("Temps (s)", fontsize=14)
-plt.ylabel("Tension (Volt)", fontsize=14)
-plt.title("Tension photodiode simulé")
-plt.legend()
-plt.grid(True)
-plt.show()
-
-# Affichage des pics
-plt.figure(figsize=(10, 6))
-plt.plot(x, y, label="Tension photodiode simulé")
-plt.plot(x[peaks], peaks_voltages, "x", color='red', label="Pics")
-plt.xlabel("Temps (s)", fontsize=14)
-plt.ylabel("Tension (Volt)", fontsize=14)
-plt.title("Pics du signal simulé")
-plt.legend()
-plt.grid(True)  
-plt.show()
-
-mediane_par_instant = np.median(peaks_voltages)
-moyenne_pic = np.mean(peaks_voltages)
-print("mediane_par_instant", mediane_par_instant)
-print("moyenne_pic", moyenne_pic )
-N = 20  # Nombre de signaux
-ecart_type_medianes = []
-
-
-ecart_type_medianes = []
-ecart_type_moyennes = []
-ecart_type_mini = []
-ecart_type_peak= []
-for n in range(1,N):
-    moyennes= []
-    medianes = []
-    mini=[]
-    # Génération des N signaux
-    signaux = np.zeros((n, longueur))
-    for i in range(n):
-        [x, y, peaks, peaks_voltages] = photodiode_voltages_simu()
-        mini.append(np.min(y))
-        mediane_par_instant = np.median(peaks_voltages)
-        moyenne_par_instant= np.mean(peaks_voltages)
-        moyennes.append(moyenne_par_instant)
-        medianes.append(mediane_par_instant)
-
-    x_2 = np.arange(n)
-    
-    ecart_type_medianes.append(np.std(medianes))
-    ecart_type_moyennes.append(np.std(moyennes))
-    ecart_type_mini.append(np.std(mini))
-    ecart_type_peak.append(np.std(-peaks_voltages))
-
-
-print(f"L'écart-type de medianes est: {ecart_type_medianes}")
-print(f"L'écart-type de moyennes est: {ecart_type_moyennes}")
-print(f"L'écart-type de mini est: {ecart_type_mini}")
-print(f"L'écart-type des peak est: {ecart_type_peak}")
-
-
-plt.figure(figsize=(10, 6))
-plt.plot(x_2, ecart_type_medianes, label="ecart_type_medianes", color="red")
-plt.plot(x_2, ecart_type_moyennes, label="ecart_type_moyennes", color="blue")
-plt.plot(x_2, ecart_type_mini ,label="ecart_type_mini")
-
-
-
-
-plt.xlabel("Nombre d'acquisition de la tension")
-plt.ylabel("Valeur l'écart type")
-plt.legend()
-plt.grid(True)
-plt.show()
-import scipy.signal as signal
-
-
-
-# Signal d'exemple
-x = np.random.randn(100)  # Un signal aléatoire
-
-# Filtrage passe-bas
-b, a = signal.butter(4, 0.05)
-y_filtre = signal.filtfilt(b, a, x)
-
-# Affichage
-plt.figure(figsize=(10, 6))
-plt.plot(x, label='Signal original')
-plt.plot(y_filtre, label='Signal filtré')
-plt.xlabel('Temps')
-plt.ylabel('Amplitude')
-plt.title('Filtrage passe-bas avec Butterworth')
-plt.legend()
-plt.grid(True)
-plt.show()
-
-def moyenne_mobile(x, N=5):
-    return np.convolve(x, np.ones(N)/N, mode='valid')
-
-# Signal d'exemple
-x = np.random.randn(100)
-
-# Application de la moyenne mobile
-y_moyenne_mobile = moyenne_mobile(x)
-
-# Affichage
-plt.figure(figsize=(10, 6))
-plt.plot(x, label='Signal original')
-plt.plot(y_moyenne_mobile, label='Moyenne mobile (N=5)')
-plt.xlabel('Temps')
-plt.ylabel('Amplitude')
-plt.title('Application de la moyenne mobile')
-plt.legend()
-plt.grid(True)
-plt.show()
-
-
-medianes=-np.array(medianes)
-moyennes=-np.array(moyennes)
-mini=-np.array(mini)
-
-plt.figure(figsize=(10, 6))
-plt.plot(x_2, np.log(medianes), label="Médiane à chaque instant", color="red")
-plt.plot(x_2, np.log(moyennes), label="moyenne à chaque instant", color="blue")
-plt.plot(x_2, np.log(mini) ,label="mini à chaque instant")
-
-
-# Calcul de l'écart-type
-ecart_type_medianes = np.std(np.log(medianes))
-ecart_type_moyennes = np.std(np.log(moyennes))
-ecart_type_mini = np.std(np.log(mini))
-ecart_type_peak=np.std(np.log(-peaks_voltages))
-
-print(f"L'écart-type de medianes log est: {ecart_type_medianes}")
-print(f"L'écart-type de moyennes log est: {ecart_type_moyennes}")
-print(f"L'écart-type de mini log est: {ecart_type_mini}")
-print(f"L'écart-type de peak log est: {ecart_type_peak}")
 
 
-plt.xlabel("Temps")
-plt.ylabel("Valeur")
-plt.title("Médiane des valeurs à chaque instant pour N signaux")
-plt.legend()
-plt.grid(True)
-plt.show()
\ No newline at end of file
+if __name__ == "__main__":
+    import matplotlib.pyplot as plt
+
+    [x, y, peaks, peaks_voltages] = photodiode_voltages_simu()
+
+    # Affichage des données
+    plt.figure(figsize=(10, 6))
+    plt.plot(x, y, label="Tension photodiode simulé")
+    plt.xlabel("Temps (s)", fontsize=14)
+    plt.ylabel("Tension (Volt)", fontsize=14)
+    plt.title("Tension photodiode simulé")
+    plt.legend()
+    plt.grid(True)
+    plt.show()
+
+    # Affichage des pics
+    plt.figure(figsize=(10, 6))
+    plt.plot(x, y, label="Tension photodiode simulé")
+    plt.plot(x[peaks], peaks_voltages, "x", color='red', label="Pics")
+    plt.xlabel("Temps (s)", fontsize=14)
+    plt.ylabel("Tension (Volt)", fontsize=14)
+    plt.title("Pics du signal simulé")
+    plt.legend()
+    plt.grid(True)  
+    plt.show()
+
+    mediane_par_instant = np.median(peaks_voltages)
+    moyenne_pic = np.mean(peaks_voltages)
+    print("mediane_par_instant", mediane_par_instant)
+    print("moyenne_pic", moyenne_pic )
+    N = 20  # Nombre de signaux
+    ecart_type_medianes = []
+
+
+    ecart_type_medianes = []
+    ecart_type_moyennes = []
+    ecart_type_mini = []
+    ecart_type_peak= []
+    for n in range(1,N):
+        moyennes= []
+        medianes = []
+        mini=[]
+        # Génération des N signaux
+        signaux = np.zeros((n, longueur))
+        for i in range(n):
+            [x, y, peaks, peaks_voltages] = photodiode_voltages_simu()
+            mini.append(np.min(y))
+            mediane_par_instant = np.median(peaks_voltages)
+            moyenne_par_instant= np.mean(peaks_voltages)
+            moyennes.append(moyenne_par_instant)
+            medianes.append(mediane_par_instant)
+
+        x_2 = np.arange(n)
+
+        ecart_type_medianes.append(np.std(medianes))
+        ecart_type_moyennes.append(np.std(moyennes))
+        ecart_type_mini.append(np.std(mini))
+        ecart_type_peak.append(np.std(-peaks_voltages))
+
+
+    print(f"L'écart-type de medianes est: {ecart_type_medianes}")
+    print(f"L'écart-type de moyennes est: {ecart_type_moyennes}")
+    print(f"L'écart-type de mini est: {ecart_type_mini}")
+    print(f"L'écart-type des peak est: {ecart_type_peak}")
+
+
+    plt.figure(figsize=(10, 6))
+    plt.plot(x_2, ecart_type_medianes, label="ecart_type_medianes", color="red")
+    plt.plot(x_2, ecart_type_moyennes, label="ecart_type_moyennes", color="blue")
+    plt.plot(x_2, ecart_type_mini ,label="ecart_type_mini")
+
+
+
+
+    plt.xlabel("Nombre d'acquisition de la tension")
+    plt.ylabel("Valeur l'écart type")
+    plt.legend()
+    plt.grid(True)
+    plt.show()
+    import scipy.signal as signal
+
+
+
+    # Signal d'exemple
+    x = np.random.randn(100)  # Un signal aléatoire
+
+    # Filtrage passe-bas
+    b, a = signal.butter(4, 0.05)
+    y_filtre = signal.filtfilt(b, a, x)
+
+    # Affichage
+    plt.figure(figsize=(10, 6))
+    plt.plot(x, label='Signal original')
+    plt.plot(y_filtre, label='Signal filtré')
+    plt.xlabel('Temps')
+    plt.ylabel('Amplitude')
+    plt.title('Filtrage passe-bas avec Butterworth')
+    plt.legend()
+    plt.grid(True)
+    plt.show()
+
+    def moyenne_mobile(x, N=5):
+        return np.convolve(x, np.ones(N)/N, mode='valid')
+
+    # Signal d'exemple
+    x = np.random.randn(100)
+
+    # Application de la moyenne mobile
+    y_moyenne_mobile = moyenne_mobile(x)
+
+    # Affichage
+    plt.figure(figsize=(10, 6))
+    plt.plot(x, label='Signal original')
+    plt.plot(y_moyenne_mobile, label='Moyenne mobile (N=5)')
+    plt.xlabel('Temps')
+    plt.ylabel('Amplitude')
+    plt.title('Application de la moyenne mobile')
+    plt.legend()
+    plt.grid(True)
+    plt.show()
+
+
+    medianes=-np.array(medianes)
+    moyennes=-np.array(moyennes)
+    mini=-np.array(mini)
+
+    plt.figure(figsize=(10, 6))
+    plt.plot(x_2, np.log(medianes), label="Médiane à chaque instant", color="red")
+    plt.plot(x_2, np.log(moyennes), label="moyenne à chaque instant", color="blue")
+    plt.plot(x_2, np.log(mini) ,label="mini à chaque instant")
+
+
+    # Calcul de l'écart-type
+    ecart_type_medianes = np.std(np.log(medianes))
+    ecart_type_moyennes = np.std(np.log(moyennes))
+    ecart_type_mini = np.std(np.log(mini))
+    ecart_type_peak=np.std(np.log(-peaks_voltages))
+
+    print(f"L'écart-type de medianes log est: {ecart_type_medianes}")
+    print(f"L'écart-type de moyennes log est: {ecart_type_moyennes}")
+    print(f"L'écart-type de mini log est: {ecart_type_mini}")
+    print(f"L'écart-type de peak log est: {ecart_type_peak}")
+
+
+    plt.xlabel("Temps")
+    plt.ylabel("Valeur")
+    plt.title("Médiane des valeurs à chaque instant pour N signaux")
+    plt.legend()
+    plt.grid(True)
+    plt.show()
@@ -0,0 +1,115 @@
+"""
+Backlash model of the lead screw of the diffraction grating (X), for the scans in both
+directions.
+
+The wavelength calibration (SignalProcessingVarian634.calculate_wavelength) holds for
+positions reached with the screw moving towards +X (descending wavelengths). Because of
+the play of the screw, a position reached moving towards -X leaves the carriage shifted:
+the same feature of a spectrum appears at another screw position. The model is this
+shift, measured by the correlation of two scans of the same sample in opposite
+directions; the scans towards -X move the screw to position + shift to measure at the
+wavelength of position.
+"""
+
+import json
+import os
+import numpy as np
+
+
+class BacklashModel:
+    """
+    Shift of the screw positions of the scans towards -X.
+
+    Attributes:
+        path (str): JSON file of the calibration.
+        shift (float): Screw position of a feature in a scan towards -X minus its position
+            in a scan towards +X, in mm.
+        calibration_date (str): Date of the calibration (None when not calibrated).
+    """
+
+    def __init__(self, path=None):
+        """
+        Args:
+            path (str): JSON file of the calibration (screw_backlash.json in the working directory by default).
+        """
+        self.path = path if path is not None else os.path.join(os.getcwd(), 'screw_backlash.json')
+        self.shift = 0.0
+        self.calibration_date = None
+        self.load()
+
+    def compensate(self, position, direction):
+        """
+        Screw position to command to measure at the wavelength of position.
+
+        Args:
+            position (float or array): Screw position (calibration of the scans towards +X).
+            direction (int): Direction of the motion of the screw (+1 or -1).
+
+        Returns:
+            float or array: Screw position to command.
+        """
+        return position + self.shift if direction < 0 else position
+
+    def calibrate(self, positions_forward, absorbance_forward, positions_backward, absorbance_backward, resolution=0.0005, 
+                  max_shift=0.1):
+        """
+        Measures the shift by correlation of two spectra of the same sample scanned towards
+        +X (forward) and towards -X (backward), on their common screw range: the shift is the
+        lag minimising the mean squared difference of the spectra.
+
+        Args:
+            positions_forward (array): Screw positions of the scan towards +X.
+            absorbance_forward (array): Absorbance of the scan towards +X.
+            positions_backward (array): Screw positions commanded in the scan towards -X
+                (without compensation).
+            absorbance_backward (array): Absorbance of the scan towards -X.
+            resolution (float): Step of the common grid of the correlation in mm.
+            max_shift (float): Largest shift searched in mm.
+
+        Returns:
+            float: The shift in mm.
+        """
+        order_forward, order_backward = np.argsort(positions_forward), np.argsort(positions_backward)
+        positions_forward, absorbance_forward = np.asarray(positions_forward)[order_forward], np.asarray(absorbance_forward)[order_forward]
+        positions_backward, absorbance_backward = np.asarray(positions_backward)[order_backward], np.asarray(absorbance_backward)[order_backward]
+        start = max(positions_forward[0], positions_backward[0])
+        stop = min(positions_forward[-1], positions_backward[-1])
+        grid = np.arange(start, stop, resolution)
+        forward = np.interp(grid, positions_forward, absorbance_forward)
+        backward = np.interp(grid, positions_backward, absorbance_backward)
+        # Mean squared difference of the spectra over their overlap for each lag (the maximum
+        # of the cross-correlation, without its bias towards the null lag for broad bands)
+        lags = np.arange(-int(max_shift / resolution), int(max_shift / resolution) + 1)
+        lags = lags[np.abs(lags) < len(grid) // 2]
+        difference = np.array([np.mean((backward[max(lag, 0):len(grid) + min(lag, 0)]
+                                        - forward[max(-lag, 0):len(grid) - max(lag, 0)])**2) for lag in lags])
+        best = int(np.argmin(difference))
+        # Sub-sample lag: vertex of the parabola through the minimum and its neighbours
+        offset = 0.0
+        if 0 < best < len(lags) - 1:
+            left, centre, right = difference[best - 1:best + 2]
+            curvature = left - 2 * centre + right
+            if curvature > 0:
+                offset = 0.5 * (left - right) / curvature
+        self.shift = float((lags[best] + offset) * resolution)
+        self.calibration_date = np.datetime64('today').astype(str)
+        return self.shift
+
+    def save(self):
+        """
+        Writes the calibration in its JSON file.
+        """
+        with open(self.path, 'w', encoding='utf-8') as file:
+            json.dump({'shift': self.shift, 'calibration_date': self.calibration_date}, file, indent=4)
+
+    def load(self):
+        """
+        Reads the calibration from its JSON file, if it exists (no shift otherwise).
+        """
+        try:
+            with open(self.path, encoding='utf-8') as file:
+                data = json.load(file)
+            self.shift = float(data['shift'])
+            self.calibration_date = data['calibration_date']
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
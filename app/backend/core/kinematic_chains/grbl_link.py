@@ -0,0 +1,503 @@
+"""
+Serial link with GRBL (Arduino with the CNC shield of the VARIAN 634 motors).
+
+GRBL replies 'ok' or 'error:<code>' to each line it has executed and holds the lines
+received in a serial RX buffer of 128 bytes. The link streams the G-code with the
+character counting flow control of the GRBL documentation (Streaming a G-code program
+to GRBL): a line is sent as soon as the lines waiting for their reply and this line fit
+in the RX buffer, so that GRBL always has the next lines to plan.
+
+A reader thread reads everything GRBL sends:
+- 'ok' / 'error:<code>' : reply of the oldest line waiting for its reply,
+- '<...>' : status report (reply to the realtime command '?'),
+- 'ALARM:<code>' : alarm, kept until the motors are unlocked ($X) or homed ($H),
+- '[...]', '$<n>=<value>' : informations attached to the reply of the current line,
+- 'Grbl ...' : start or reset of GRBL, the lines waiting for their reply are lost.
+
+A poller thread requests a status report ('?') at a fixed rate. The reports are parsed
+into a cached machine state (state, MPos, WPos, feed rate, buffer fill): positions are
+read in memory, and the waits on the state wake up on the first report that satisfies them.
+"""
+
+import re
+import threading
+import time
+import weakref
+from collections import deque
+
+
+RX_BUFFER_SIZE = 128  # bytes, serial RX buffer of GRBL on the Arduino UNO
+REALTIME_COMMANDS = ('?', '!', '~', '\x18', '\x85')
+NUMBER = r"([-+]?[0-9]*\.?[0-9]+)"
+# Version in the start message ('Grbl 1.1h ...') or the build info ('[VER:1.1h...]', '[0.9j...]')
+VERSION = re.compile(r"(?:Grbl |\[VER:|\[)(\d+)\.(\d+)")
+
+
+def parse_status_report(response):
+    """
+    Parse a GRBL status report.
+    <Idle,MPos:0.000,0.000,0.000,WPos:0.000,0.000,0.000> (GRBL 0.9)
+    <Run|MPos:0.000,0.000,0.000|Bf:15,128|FS:0,0> (GRBL 1.1)
+
+    Args:
+        response (str): Status report line.
+
+    Returns:
+        dict: The machine state 'state' ('Idle', 'Run', 'Hold', 'Alarm'...), the positions 
+        'MPos', 'WPos' and the work offset 'WCO' (tuple X, Y, Z), the feed rate 'feed' (mm/min) 
+        and the buffer fill 'Bf' (free planner blocks, free RX bytes), None when not reported.
+    """
+    state = re.search(r"<([A-Za-z]+)", response)
+    status = {'state': state.group(1) if state else None}
+    for position in ('MPos', 'WPos', 'WCO'):
+        match = re.search(position + ":" + ",".join([NUMBER] * 3), response)
+        status[position] = tuple(float(coordinate) for coordinate in match.groups()) if match else None
+    feed = re.search(r"\bFS?:" + NUMBER, response)
+    status['feed'] = float(feed.group(1)) if feed else None
+    buffer_fill = re.search(r"Bf:([0-9]+),([0-9]+)", response)
+    status['Bf'] = tuple(int(value) for value in buffer_fill.groups()) if buffer_fill else None
+    return status
+
+
+class GrblError(RuntimeError):
+    """
+    GRBL replied 'error:<code>' to a line.
+    """
+
+    def __init__(self, message, code=None, line=None):
+        super().__init__(message)
+        self.code = code
+        self.line = line
+
+
+class GrblAlarm(GrblError):
+    """
+    GRBL is in alarm: the G-code is locked out until the motors are unlocked or homed.
+    """
+
+
+class GrblCommand:
+    """
+    Line sent to GRBL, waiting for its reply.
+
+    Attributes:
+        line (str): Line without end of line.
+        size (int): Bytes taken in the RX buffer of GRBL (line and end of line).
+        messages (list): Informations sent by GRBL before the reply ('[GC:...]', '$110=10'...).
+        error (GrblError): Error replied by GRBL, None when GRBL replied 'ok'.
+    """
+
+    def __init__(self, line):
+        self.line = line
+        self.size = len(line) + 1
+        self.messages = []
+        self.error = None
+        self.done = threading.Event()
+
+    def wait(self, timeout=None):
+        """
+        Waits for the reply of GRBL.
+
+        Args:
+            timeout (float): Maximum waiting time in seconds (no limit by default).
+
+        Returns:
+            list: Informations sent by GRBL with the reply.
+
+        Raises:
+            GrblError: GRBL replied an error (GrblAlarm in alarm state).
+            TimeoutError: No reply before the timeout.
+        """
+        if not self.done.wait(timeout):
+            raise TimeoutError(f"No reply of GRBL to '{self.line}' after {timeout} s")
+        if self.error is not None:
+            raise self.error
+        return self.messages
+
+
+class GrblLink:
+    """
+    Streams G-code lines to GRBL and matches each reply to its line.
+
+    Attributes:
+        serial_port (serial.Serial): Serial port of the Arduino running GRBL.
+        rx_buffer_size (int): Size of the RX buffer of GRBL in bytes.
+        alarm (str): Code of the current alarm ('ALARM:1'...), None without alarm.
+        status (str): Last status report of GRBL.
+        machine_state (dict): Last status report parsed (see parse_status_report), with 
+            MPos and WPos completed from the last work offset.
+        status_poll_period (float): Period of the status requests of the poller in seconds 
+            (None: no polling).
+        planner_free_blocks (int): Most free planner blocks reported (Bf), i.e. the free blocks 
+            of an empty planner, None when GRBL does not report Bf.
+    """
+
+    links = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def for_port(cls, serial_port):
+        """
+        Returns the link of a serial port, created on first use: all the controllers
+        sharing a port share its link (a single reader of the replies).
+
+        Args:
+            serial_port (serial.Serial): Serial port of the Arduino running GRBL.
+
+        Returns:
+            GrblLink: Link of the port.
+        """
+        if serial_port not in cls.links:
+            cls.links[serial_port] = cls(serial_port)
+        return cls.links[serial_port]
+
+    def __init__(self, serial_port, rx_buffer_size=RX_BUFFER_SIZE):
+        """
+        Args:
+            serial_port (serial.Serial): Serial port of the Arduino running GRBL.
+            rx_buffer_size (int): Size of the RX buffer of GRBL in bytes.
+        """
+        self.serial_port = serial_port
+        self.rx_buffer_size = rx_buffer_size
+        self.condition = threading.Condition()
+        self.write_lock = threading.Lock()
+        self.pending = deque()  # lines sent, waiting for their reply
+        self.pending_bytes = 0
+        self.alarm = None
+        self.status = None
+        self.status_count = 0
+        self.machine_state = parse_status_report('')
+        self.startup_count = 0
+        self.version = None
+        self.event_callbacks = []
+        self.running = True
+        self.status_poll_period = None
+        self.poller = None
+        self.planner_free_blocks = None
+        # The reader thread must not block forever on the port to be stopped by close()
+        if self.serial_port.timeout is None:
+            self.serial_port.timeout = 0.1
+        self.reader = threading.Thread(target=self.read_replies, daemon=True)
+        self.reader.start()
+
+# Sending
+
+    def send(self, line, timeout=None):
+        """
+        Sends a line to GRBL as soon as it fits in the RX buffer, without waiting for its reply.
+
+        Args:
+            line (str): G-code line or '$' command (end of line optional).
+            timeout (float): Maximum waiting time for room in the RX buffer in seconds.
+
+        Returns:
+            GrblCommand: Command whose reply can be waited with wait().
+        """
+        command = GrblCommand(line.strip())
+        if command.size > self.rx_buffer_size:
+            raise ValueError(f"Line longer than the RX buffer of GRBL: '{command.line}'")
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.pending_bytes + command.size <= self.rx_buffer_size, timeout):
+                raise TimeoutError(f"The RX buffer of GRBL is still full after {timeout} s")
+            self.pending.append(command)
+            self.pending_bytes += command.size
+            with self.write_lock:
+                self.serial_port.write((command.line + '\n').encode())
+        return command
+
+    def execute(self, line, timeout=None):
+        """
+        Sends a line to GRBL and waits for its reply.
+
+        Args:
+            line (str): G-code line or '$' command.
+            timeout (float): Maximum waiting time in seconds.
+
+        Returns:
+            list: Informations sent by GRBL with the reply.
+        """
+        return self.send(line, timeout).wait(timeout)
+
+    def realtime(self, command):
+        """
+        Sends a realtime command, executed by GRBL at once (outside of the RX buffer).
+
+        Args:
+            command (str): '?', '!', '~', '\\x18' (reset) or '\\x85' (jog cancel).
+        """
+        if command not in REALTIME_COMMANDS:
+            raise ValueError(f"'{command}' is not a realtime command of GRBL")
+        with self.write_lock:
+            self.serial_port.write(command.encode('latin-1'))
+
+    def wait_all(self, timeout=None):
+        """
+        Waits until GRBL has replied to all the lines sent.
+
+        Args:
+            timeout (float): Maximum waiting time in seconds (no limit by default).
+
+        Raises:
+            TimeoutError: Lines are still waiting for their reply after the timeout.
+            GrblAlarm: GRBL went into alarm (until the motors are unlocked or homed).
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: not self.pending, timeout):
+                raise TimeoutError(f"{len(self.pending)} lines without reply of GRBL after {timeout} s")
+            if self.alarm is not None:
+                raise GrblAlarm(f"GRBL is in alarm ({self.alarm})", self.alarm)
+
+    def query_status(self, timeout=1.0):
+        """
+        Requests a status report with the realtime command '?'.
+
+        Args:
+            timeout (float): Maximum waiting time in seconds.
+
+        Returns:
+            str: Status report, e.g. <Idle|MPos:0.000,0.000,0.000|Bf:15,128|FS:0,0>.
+        """
+        with self.condition:
+            count = self.status_count
+            self.realtime('?')
+            if not self.condition.wait_for(lambda: self.status_count > count, timeout):
+                raise TimeoutError(f"No status report of GRBL after {timeout} s")
+            return self.status
+
+    def start_status_polling(self, period):
+        """
+        Starts (or changes the period of) the poller thread requesting a status report.
+
+        Args:
+            period (float): Period of the status requests in seconds (0.02 to 0.1 for 50 to 10 Hz).
+        """
+        self.status_poll_period = period
+        if self.poller is None:
+            self.poller = threading.Thread(target=self.poll_status, daemon=True)
+            self.poller.start()
+
+    def poll_status(self):
+        """
+        Poller thread: requests a status report every status_poll_period seconds.
+        """
+        while self.running:
+            self.realtime('?')
+            time.sleep(self.status_poll_period)
+
+    def get_machine_state(self):
+        """
+        Returns:
+            dict: Copy of the cached machine state (see parse_status_report).
+        """
+        with self.condition:
+            return dict(self.machine_state)
+
+    def wait_machine_state(self, predicate, timeout=None):
+        """
+        Waits for a status report received after the call whose machine state satisfies predicate.
+
+        Args:
+            predicate (callable): Function of the machine state (dict) returning True to stop waiting.
+            timeout (float): Maximum waiting time in seconds (no limit by default).
+
+        Returns:
+            dict: Copy of the machine state which satisfies predicate, None after the timeout.
+        """
+        with self.condition:
+            count = self.status_count
+            if not self.condition.wait_for(lambda: self.status_count > count and predicate(self.machine_state), timeout):
+                return None
+            return dict(self.machine_state)
+
+    def wait_startup(self, timeout):
+        """
+        Waits for the start message of GRBL ('Grbl 1.1h ...'), sent when the Arduino
+        resets on the opening of the port.
+
+        Args:
+            timeout (float): Maximum waiting time in seconds.
+
+        Returns:
+            bool: True when GRBL has started (now or before).
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: self.startup_count > 0, timeout)
+
+    def reset(self, timeout):
+        """
+        Soft reset of GRBL (0x18): the planned moves and the lines waiting for their reply
+        are discarded. Waits for the start message of GRBL.
+
+        Args:
+            timeout (float): Maximum waiting time in seconds.
+
+        Returns:
+            bool: True when GRBL has restarted.
+        """
+        with self.condition:
+            count = self.startup_count
+            self.realtime('\x18')
+            return self.condition.wait_for(lambda: self.startup_count > count, timeout)
+
+    def firmware_version(self, timeout=None):
+        """
+        Version of GRBL, from its start message or, when the link was opened without a
+        reset of the Arduino, from its build info ('$I').
+
+        Args:
+            timeout (float): Maximum waiting time of the build info in seconds.
+
+        Returns:
+            tuple: Major and minor version, e.g. (1, 1), None if unknown.
+        """
+        if self.version is None:
+            try:
+                for message in self.execute('$I', timeout):
+                    version = VERSION.search(message)
+                    if version:
+                        self.version = (int(version.group(1)), int(version.group(2)))
+            except (GrblError, TimeoutError):
+                return None
+        return self.version
+
+    def add_event_callback(self, callback):
+        """
+        Calls callback(event, response) from the reader thread on the events which lose
+        the position of the motors: 'alarm' (ALARM:<code>) and 'restart' (start or reset of GRBL).
+
+        Args:
+            callback (callable): Function called with the event and the line sent by GRBL.
+        """
+        with self.condition:
+            self.event_callbacks.append(callback)
+
+    def notify_event(self, event, response):
+        """
+        Calls the event callbacks.
+
+        Args:
+            event (str): 'alarm' or 'restart'.
+            response (str): Line sent by GRBL.
+        """
+        for callback in list(self.event_callbacks):
+            callback(event, response)
+
+    def close(self):
+        """
+        Stops the reader thread.
+        """
+        self.running = False
+        self.reader.join()
+        if self.poller is not None:
+            self.poller.join()
+        GrblLink.links.pop(self.serial_port, None)
+
+# Replies
+
+    def read_replies(self):
+        """
+        Reader thread: reads and dispatches the lines sent by GRBL.
+        """
+        while self.running:
+            response = self.serial_port.readline().decode(errors='ignore').strip()
+            if response:
+                self.dispatch(response)
+
+    def dispatch(self, response):
+        """
+        Handles a line sent by GRBL.
+
+        Args:
+            response (str): Line without end of line.
+        """
+        with self.condition:
+            if response.startswith('<'):
+                self.update_machine_state(response)
+            elif response == 'ok' or response.startswith('error'):
+                self.reply(response)
+            elif response.startswith('ALARM'):
+                self.alarm = response
+                print(f"GRBL {response}")
+                self.notify_event('alarm', response)
+            elif response.startswith('Grbl'):
+                self.restart(response)
+                self.notify_event('restart', response)
+            elif self.pending:
+                self.pending[0].messages.append(response)
+            self.condition.notify_all()
+
+    def update_machine_state(self, response):
+        """
+        Parses a status report into the cached machine state.
+
+        Args:
+            response (str): Status report.
+        """
+        status = parse_status_report(response)
+        # GRBL 1.1 reports the work offset only from time to time: the last one is kept
+        if status['WCO'] is None:
+            status['WCO'] = self.machine_state['WCO']
+        if status['WCO'] is not None:
+            if status['MPos'] is None and status['WPos'] is not None:
+                status['MPos'] = tuple(w + o for w, o in zip(status['WPos'], status['WCO']))
+            elif status['WPos'] is None and status['MPos'] is not None:
+                status['WPos'] = tuple(m - o for m, o in zip(status['MPos'], status['WCO']))
+        if status['Bf'] is not None:
+            self.planner_free_blocks = max(status['Bf'][0], self.planner_free_blocks or 0)
+        self.status = response
+        self.machine_state = status
+        self.status_count += 1
+
+    def planner_empty(self, status):
+        """
+        Args:
+            status (dict): Status report parsed (see parse_status_report).
+
+        Returns:
+            bool: True when the report shows an empty planner (Bf), None when GRBL does not 
+                report the buffer fill.
+        """
+        if status['Bf'] is None or self.planner_free_blocks is None:
+            return None
+        return status['Bf'][0] >= self.planner_free_blocks
+
+    def reply(self, response):
+        """
+        Matches an 'ok' or 'error:<code>' reply to the oldest line waiting for its reply.
+
+        Args:
+            response (str): Reply of GRBL.
+        """
+        if not self.pending:
+            return  # reply to a line sent before the link
+        command = self.pending.popleft()
+        self.pending_bytes -= command.size
+        if response.startswith('error'):
+            code = response.partition(':')[2].strip()
+            if code == '9':
+                command.error = GrblAlarm(f"GRBL is in alarm ({self.alarm}), '{command.line}' is locked out",
+                                          code, command.line)
+            else:
+                command.error = GrblError(f"GRBL error {code} on '{command.line}'", code, command.line)
+            print(command.error)
+        elif command.line.upper() in ('$X', '$H'):
+            self.alarm = None
+        command.done.set()
+
+    def restart(self, response):
+        """
+        Start or reset of GRBL: the RX buffer of GRBL is empty, the lines waiting for
+        their reply are lost.
+
+        Args:
+            response (str): Start message of GRBL.
+        """
+        self.startup_count += 1
+        version = VERSION.search(response)
+        if version:
+            self.version = (int(version.group(1)), int(version.group(2)))
+        while self.pending:
+            command = self.pending.popleft()
+            command.error = GrblError(f"GRBL restarted ({response}) before executing '{command.line}'",
+                                      line=command.line)
+            command.done.set()
+        self.pending_bytes = 0
@@ -0,0 +1,208 @@
+"""
+Machine state of the VARIAN 634 motors, kept between the acquisitions and saved on disk:
+homed axes, last machine position confirmed at rest, state of the sensors at this
+position, selected slit and cuvette of the mirror.
+
+The record is invalidated when the position of the motors is lost (alarm or reset of
+GRBL) or when the sensors disagree with it. An acquisition starts with a verification
+of the record (GRBL not in alarm, same machine position, same sensors) instead of a
+full homing of the motors.
+"""
+
+import json
+import os
+import threading
+import time
+import weakref
+
+
+AXES = ('X', 'Y', 'Z')
+
+
+class MachineState:
+    """
+    Authoritative record of the state of the motors.
+
+    Attributes:
+        path (str): JSON file of the record.
+        homed (dict): True for each axis ('X', 'Y', 'Z') whose origin has been found.
+        home_position (dict): Machine position of each axis at its origin.
+        position (list): Last machine position [X, Y, Z] confirmed at rest (None if unknown).
+        sensors (dict): State of each sensor pin at this position.
+        slit (str): Name of the slit in front of the beam (None if unknown).
+        slits_origin (float): Machine position Y of the 2nm slit (None if unknown).
+        mirror (str): Cuvette selected by the mirror (None if unknown).
+        position_tolerance (float): Tolerance of the position check in mm.
+    """
+
+    states = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def for_link(cls, grbl_link, path=None):
+        """
+        Returns the machine state of a GRBL link, created (and loaded from disk) on first
+        use: all the controllers of the motors share the record.
+
+        Args:
+            grbl_link (GrblLink): Link of the motors.
+            path (str): JSON file of the record (machine_state.json in the working directory
+                by default, used on creation).
+
+        Returns:
+            MachineState: Machine state of the motors.
+        """
+        if grbl_link not in cls.states:
+            cls.states[grbl_link] = cls(path)
+            grbl_link.add_event_callback(cls.states[grbl_link].on_grbl_event)
+        return cls.states[grbl_link]
+
+    def __init__(self, path=None):
+        """
+        Args:
+            path (str): JSON file of the record (machine_state.json in the working directory by default).
+        """
+        self.path = path if path is not None else os.path.join(os.getcwd(), 'machine_state.json')
+        self.lock = threading.Lock()
+        self.position_tolerance = 0.001
+        self.clear()
+        self.load()
+
+    def clear(self):
+        """
+        Forgets the whole record (nothing is known about the motors).
+        """
+        self.homed = {axis: False for axis in AXES}
+        self.home_position = {axis: None for axis in AXES}
+        self.position = None
+        self.sensors = {}
+        self.slit = None
+        self.slits_origin = None
+        self.mirror = None
+
+    def invalidate(self, reason):
+        """
+        Forgets the record and saves it: the motors have to be homed again.
+
+        Args:
+            reason (str): Cause of the invalidation, printed.
+        """
+        with self.lock:
+            if not any(self.homed.values()) and self.position is None:
+                return
+            print(f"Machine state invalidated: {reason}")
+            self.clear()
+        self.save()
+
+    def on_grbl_event(self, event, response):
+        """
+        Callback of the GRBL link: an alarm or a reset of GRBL loses the position of the motors.
+
+        Args:
+            event (str): 'alarm' or 'restart'.
+            response (str): Line sent by GRBL.
+        """
+        self.invalidate(f"GRBL {event} ({response})")
+
+    def set_homed(self, axis, home_position):
+        """
+        Records the origin of an axis.
+
+        Args:
+            axis (str): 'X', 'Y' or 'Z'.
+            home_position (float): Machine position of the axis at its origin.
+        """
+        with self.lock:
+            self.homed[axis] = True
+            self.home_position[axis] = home_position
+
+    def is_homed(self):
+        """
+        Returns:
+            bool: True when the origin of every axis is known.
+        """
+        return all(self.homed.values())
+
+    def confirm(self, position, sensors):
+        """
+        Records the machine position of the motors at rest and the state of the sensors.
+
+        Args:
+            position (tuple): Machine position (X, Y, Z).
+            sensors (dict): State of each sensor pin.
+        """
+        with self.lock:
+            self.position = list(position)
+            self.sensors = {int(pin): value for pin, value in sensors.items()}
+
+    def verify(self, machine_state, sensors):
+        """
+        Checks the record against GRBL and the sensors, and invalidates it on disagreement.
+
+        Args:
+            machine_state (dict): Last status report of GRBL (see parse_status_report).
+            sensors (dict): Current state of each sensor pin.
+
+        Returns:
+            bool: True when the record can be trusted (no homing needed).
+        """
+        with self.lock:
+            if not self.is_homed() or self.position is None or machine_state['MPos'] is None:
+                return False
+            if machine_state['state'] == 'Alarm':
+                reason = "GRBL is in alarm"
+            elif any(abs(current - recorded) > self.position_tolerance
+                     for current, recorded in zip(machine_state['MPos'], self.position)):
+                reason = f"machine position {machine_state['MPos']} instead of {tuple(self.position)}"
+            else:
+                reason = next((f"sensor {pin} is {sensors.get(pin)} instead of {value}"
+                               for pin, value in self.sensors.items() if sensors.get(pin) != value), None)
+        if reason is not None:
+            self.invalidate(reason)
+            return False
+        return True
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: The record, serializable in JSON.
+        """
+        with self.lock:
+            return {'homed': dict(self.homed), 'home_position': dict(self.home_position),
+                    'position': self.position, 'sensors': {str(pin): value for pin, value in self.sensors.items()},
+                    'slit': self.slit, 'slits_origin': self.slits_origin, 'mirror': self.mirror,
+                    'updated': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+    def save(self):
+        """
+        Writes the record in its JSON file (written in a temporary file first, so that
+        the file is never left half written).
+        """
+        data = self.to_dict()
+        temporary_path = self.path + '.tmp'
+        try:
+            with open(temporary_path, 'w', encoding='utf-8') as file:
+                json.dump(data, file, indent=4)
+            os.replace(temporary_path, self.path)
+        except OSError as error:
+            print(f"Machine state not saved: {error}")
+
+    def load(self):
+        """
+        Reads the record from its JSON file, if it exists and is valid.
+        """
+        try:
+            with open(self.path, encoding='utf-8') as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return
+        with self.lock:
+            try:
+                self.homed = {axis: bool(data['homed'][axis]) for axis in AXES}
+                self.home_position = {axis: data['home_position'][axis] for axis in AXES}
+                self.position = data['position']
+                self.sensors = {int(pin): value for pin, value in data['sensors'].items()}
+                self.slit = data['slit']
+                self.slits_origin = data['slits_origin']
+                self.mirror = data['mirror']
+            except (KeyError, TypeError, AttributeError):
+                self.clear()
@@ -3,11 +3,21 @@ This program controls all the motors present on the VARIAN 634.
 """
 
 import time
-import re
-from pyfirmata import util, INPUT, Arduino
+from pyfirmata import Arduino
 import serial
 from typing import List, Tuple, Union
 
+from core.kinematic_chains.grbl_link import GrblLink, parse_status_report
+from core.kinematic_chains.machine_state import MachineState
+from core.kinematic_chains.backlash import BacklashModel
+from core.electronics_controler.firmata_sensors import FirmataSensorService
+
+
+class StopRequested(Exception):
+    """
+    The acquisition was stopped on request (stop_event of GeneralMotorsController).
+    """
+
 # Constants
 MOTOR_AXIS = str
 G_CODE_SPEED = str
@@ -39,20 +49,55 @@ class GeneralMotorsController:
         # Arduino
         self.arduino_motors = arduino_motors_instance
         self.arduino_sensors = arduino_sensors_instance 
+        # Sensors read by a single thread per board (shared by the controllers of the same board)
+        self.sensors = FirmataSensorService.for_board(self.arduino_sensors)
+        self.sensor_timeout = 60  # s, maximum time for a motion to reach a sensor
+        # s, motion between two readings of a sensor without jogs (GRBL 0.9): one Firmata sampling period
+        self.sensor_step_time = 0.02
+        # G-code streaming and replies of GRBL (shared by the controllers of the same port)
+        self.grbl = GrblLink.for_port(self.arduino_motors)
+        self.startup_timeout = 2  # s, reset of the Arduino on the opening of the port
+        # Homed axes, positions, slit and mirror, kept between the acquisitions (shared with the link)
+        self.machine_state = MachineState.for_link(self.grbl)
         self.all_pin = [2, 3, 4, 5, 6]  # all digital pins used on the Arduino UNO with 
         # no CNC shield (Arduino sensor) 
         # Screw motor     
         self.screw_motor = ['X', '$110', 10] # Parameters of screw motor : [axis, g_code_speed, speed]        
         self.pin_limit_switch_screw = [2, 4] # pin = 2 (between limits)
+        # Shift of the screw positions reached towards -X (calibrated, see BacklashModel)
+        self.screw_backlash = BacklashModel()
         # Slits motor
         self.slits_motor = ['Y', '$111', 14]  # [axis, g_code_speed, speed]
         # pin = 5 in optical fork between slits variable
         self.pin_limit_switch_slits = [5, 6] # forche optique : 5 et 6 : limits switch  
         self.slits_position = [0, 0.065, 0.135, 0.22] # position of slits [2nm, 1nm, 0.5nm, 0.2nm]
         self.name_slits = ["Fente_2nm", "Fente_1nm", "Fente_0_5nm", "Fente_0_2nm"]
+        self.slits_travel = 0.5  # mm, maximum travel to the optical fork of the origin
+        # mm, pull-off out of the optical fork after the fast approach (ends below the 1nm slit)
+        self.slits_pull_off = 0.03
+        # mm, the slow approach of the origin goes past the stop of the fast approach by this margin 
+        # (more than between the optical fork and the 2nm slit)
+        self.slits_refine_margin = 0.03
+        self.slits_refine_travel = 0.05  # mm, maximum travel of the slow approach of a slit (less than between two slits)
+        self.slits_refine_rate = 1  # mm/min, feed rate of the slow approach of a slit
+        self.slits_approach = 0.005  # mm, a slit is approached from this distance below it
         # Mirror cuves motor
         self.mirror_cuves_motor = ['Z', '$112', 20]  # [axis, g_code_speed, speed]
         self.pin_limit_switch_mirror_cuves = [3] # pin = 3 (optical fork on mirror motor)
+        # Motion completion
+        self.status_poll_period = 0.02  # s, between two GRBL status reports
+        self.settle_time = 0.1  # s, mechanical settling after the end of a motion
+        # Time of the motions: the clock of the port when it has one (simulated GRBL)
+        self.clock = getattr(self.arduino_motors, 'clock', time)
+        # Stop of the acquisition (threading.Event): once set, wait_for_idle stops the motion
+        self.stop_event = None
+        self.stop_timeout = 5  # s, maximum time of the deceleration and of the reset of GRBL
+        self.stop_check_period = 0.1  # s, between two checks of stop_event in the waits of the homing and the sensors
+        if self.grbl.status_poll_period is None:
+            self.grbl.start_status_polling(self.status_poll_period)
+        else:
+            # Polling started by the first user of the link: its period is kept
+            self.status_poll_period = self.grbl.status_poll_period
 
 
     def initialize_arduino_motor(self):
@@ -60,9 +105,10 @@ class GeneralMotorsController:
         Code qui permet d'initialisé proprement l'arduino contenant le 
         programme grbl, c'est à dire s'assurer que les messages G-Code de l'opération 
         """
-        self.arduino_motors.write("\r\n\r\n".encode())  # encode to convert "\r\n\r\n"
-        time.sleep(2)  # Wait for initialization of GRBL
-        self.arduino_motors.flushInput()  # Clear the input buffer by discarding its current contents.
+        # Wait for initialization of GRBL (the Arduino resets when the port is opened)
+        self.grbl.wait_startup(self.startup_timeout)
+        # Empty line: GRBL replies 'ok' once it is ready to receive G-code
+        self.grbl.execute('', timeout=self.startup_timeout)
 
     def search_word(self, data, word):
         """
@@ -87,23 +133,19 @@ class GeneralMotorsController:
             motor_parameters (list): Motor parameters [axis, speed, movement type].
             speed (int): Motor translation speed.
         """
-        g_code = motor_parameters[1] + str(speed) + '\n'
-        self.execute_g_code(g_code)
-        time.sleep(0.5)
+        g_code = motor_parameters[1] + '=' + str(speed)
+        self.grbl.execute(g_code)
 
     def get_motor_state(self):
         """
-        Query and return the current state of the motor.
-        <Idle,MPos:0.000,0.000,0.00' b'0,WPos:0.000,0.000,0.000> 
-        The number of characters in the string is: 56
+        Return the current state of the motor.
+        <Idle,MPos:0.000,0.000,0.000,WPos:0.000,0.000,0.000> 
+
         Returns:
-            str: The current state of the motor (based on the motor's response).
+            str: The last status report of GRBL.
         """
-        self.execute_g_code('?')
-        s = str(self.arduino_motors.read(56)) 
-# or in one line
-        #result = s[s.index("\\r\\nok\\r\\n") + len("\\r\\nok\\r\\n"):]
-        return s  # Read the first 20 characters for state
+        self.get_status()
+        return self.grbl.status
     
 # G_CODE to control the kinematics of motors
 
@@ -111,76 +153,157 @@ class GeneralMotorsController:
         """
         Display the GRBL parameters of the motor.
         """
-        self.execute_g_code('$G')
-        print(self.arduino_motors.read(75))
+        print(self.grbl.execute('$G'))
 
     def stop_motors(self):
         """
         Immediately stop the motor.
         """
-        self.execute_g_code('!')
+        self.grbl.realtime('!')
 
     def resume_cycle(self):
         """
         Resume motor operation after a stop command.
         """
-        self.execute_g_code('~')
+        self.grbl.realtime('~')
 
-    def wait_for_idle(self):
+    def parse_status(self, response):
         """
-        Block execution until the motor is idle.
+        Parse a GRBL status report.
+        <Idle,MPos:0.000,0.000,0.000,WPos:0.000,0.000,0.000> (GRBL 0.9)
+        <Run|MPos:0.000,0.000,0.000|Bf:15,128|FS:0,0> (GRBL 1.1)
+
+        Args:
+            response (str): Status report line.
+
+        Returns:
+            dict: The machine state ('Idle', 'Run', 'Hold', 'Alarm'...) and the positions 
+            'MPos' and 'WPos' (tuple X, Y, Z or None when not reported), see parse_status_report.
         """
-        state = str(self.get_motor_state())
-        while 'Idle' not in state:
-            state = str(self.get_motor_state())
-            print(state)
-            time.sleep(0.1)
-        self.arduino_motors.flushInput()        
+        return parse_status_report(response)
 
-    def get_position_xyz(self):
+    def get_status(self):
         """
-        Get and return the current XYZ position of the motor.
+        Return the last status report of GRBL, polled in the background 
+        every status_poll_period seconds (no serial exchange).
 
         Returns:
-            list: A list [X, Y, Z] containing the current coordinates of the motor.
+            dict: See parse_status.
+        """
+        if self.grbl.status is None:
+            return self.parse_status(self.grbl.query_status())
+        return self.grbl.get_machine_state()
+
+    def wait_for_idle(self, settle_time=None, timeout=None):
+        """
+        Block execution until the motion is complete (GRBL reports 'Idle'), then wait 
+        for the mechanics to settle.
+
+        Args:
+            settle_time (float): Time in seconds to wait once the motor is idle 
+                (self.settle_time by default).
+            timeout (float): Maximum waiting time in seconds (no limit by default).
+
+        Raises:
+            StopRequested: A stop was requested during the motion (the motion is aborted).
+        """
+        settle_time = self.settle_time if settle_time is None else settle_time
+        start_time = time.time()
+        # The lines sent are in the planner of GRBL once they are acknowledged
+        self.grbl.wait_all(timeout)
+        remaining = None if timeout is None else max(timeout - (time.time() - start_time), 0)
+        # GRBL may still report Idle between the acknowledgement of a move and the start of the 
+        # cycle: Idle is trusted with an empty planner (Bf), otherwise not in the first report 
+        # after the acknowledgements
+        first_report = []
+
+        def motion_complete(status):
+            if not first_report:
+                first_report.append(self.grbl.status_count)
+            if status['state'] == 'Idle':
+                planner_empty = self.grbl.planner_empty(status)
+                return planner_empty if planner_empty is not None else self.grbl.status_count > first_report[0]
+            return status['state'] == 'Alarm' or self.stop_requested()
+
+        status = self.grbl.wait_machine_state(motion_complete, remaining)
+        if status is None:
+            raise TimeoutError(f"The motors are not idle after {timeout} s")
+        if status['state'] not in ('Idle', 'Alarm'):
+            self.check_stop_motion()
+        if status['state'] == 'Alarm':
+            raise RuntimeError("GRBL is in alarm state, the motion is aborted")
+        self.clock.sleep(settle_time)
+        self.machine_state.confirm(status['MPos'], self.read_sensors())
+
+    def stop_requested(self):
+        """
+        Returns:
+            bool: True when a stop of the acquisition is requested (see stop_event).
         """
-        self.execute_g_code("?" + '\n')
-        time.sleep(0.1)
+        return self.stop_event is not None and self.stop_event.is_set()
 
-        # Read and process the response
-        response = str(self.arduino_motors.readline())
-        print("Raw Response:", response)
-        while 'MPos' not in response:
-            response = str(self.arduino_motors.readline())
+    def check_stop_motion(self):
+        """
+        Aborts the motion (see abort_motion) when a stop of the acquisition is requested.
 
-        # Extract X, Y, and Z coordinates
-        match = re.search(r"MPos:([-+]?[0-9]*\.?[0-9]+),([-+]?[0-9]*\.?[0-9]+),([-+]?[0-9]*\.?[0-9]+)", response)
-        x_pos, y_pos, z_pos = [float(coordinate) for coordinate in match.groups()]
+        Raises:
+            StopRequested: A stop was requested (the motion is aborted).
+        """
+        if self.stop_requested():
+            self.abort_motion()
+            raise StopRequested("Acquisition stopped during a motion")
+
+    def abort_motion(self):
+        """
+        Aborts the current motion: feed hold (GRBL decelerates), then soft reset to discard 
+        the planned moves. The reset invalidates the machine state: the next acquisition 
+        homes the motors again.
+        """
+        self.stop_motors()
+        self.grbl.wait_machine_state(lambda status: status['state'] in ('Hold', 'Idle', 'Alarm'), self.stop_timeout)
+        if not self.grbl.reset(self.stop_timeout):
+            raise TimeoutError(f"GRBL did not restart after {self.stop_timeout} s")
+        if self.grbl.alarm is not None:
+            self.unlock_motors()
+        print("Motion aborted: the motors will be homed by the next acquisition")
+
+    def get_position_xyz(self):
+        """
+        Get and return the current XYZ position of the motor (last status report polled).
+
+        Returns:
+            list: A list [X, Y, Z] containing the current coordinates of the motor.
+        """
+        x_pos, y_pos, z_pos = self.get_status()['MPos']
         return x_pos, y_pos, z_pos
 
     def execute_g_code(self, g_code):
         """
-        Send a G-code command to the motor.
+        Send a G-code command to the motor, without waiting for its execution.
+        The line is queued as soon as it fits in the RX buffer of GRBL.
 
         Args:
             g_code (str): The G-code command to be sent to the motor.
+
+        Returns:
+            GrblCommand: The command sent, whose reply can be waited with wait().
         """
-        g_code = g_code + '\n'
-        self.arduino_motors.write(g_code.encode())
+        return self.grbl.send(g_code)
 
     def unlock_motors(self):
         """
         Unlock all the motors.
         """
-        g_code = '$X' + '\n'
-        self.execute_g_code(g_code)
+        self.grbl.execute('$X')
 
     def homing(self):
         """
-        Do the GRBL homing.
+        Do the GRBL homing. GRBL replies once the homing cycle is complete.
+
+        Returns:
+            GrblCommand: The homing command, whose reply can be waited with wait().
         """
-        g_code = '$H' + '\n'
-        self.arduino_motors.write(g_code.encode())
+        return self.grbl.send('$H')
 
     
     def relative_move(self):
@@ -199,7 +322,20 @@ class GeneralMotorsController:
             motor_parameters (list): Motor parameters [axis, speed, movement type].
             distance (float): Distance to move.
         """
-        gcode = "G0" + motor_parameters[0] + str(distance) + '\n'
+        gcode = "G0" + motor_parameters[0] + str(distance)
+        print(gcode)
+        self.execute_g_code(gcode)
+
+    def move_motor_linear(self, motor_parameters, distance, feed_rate):
+        """
+        Move the motor by a specified distance at a constant feed rate (G1).
+
+        Args:
+            motor_parameters (list): Motor parameters [axis, speed, movement type].
+            distance (float): Distance to move.
+            feed_rate (float): Feed rate of the movement in mm/min.
+        """
+        gcode = "G1" + motor_parameters[0] + str(distance) + "F" + str(feed_rate)
         print(gcode)
         self.execute_g_code(gcode)
 
@@ -221,12 +357,41 @@ class GeneralMotorsController:
         """
         self.move_motor(self.screw_motor, distance)
 
+    def move_screw_linear(self, distance, feed_rate):
+        """
+        Move the screw motor by a specified distance at a constant feed rate.
+
+        Args:
+            distance (float): Distance to move.
+            feed_rate (float): Feed rate of the movement in mm/min.
+        """
+        self.move_motor_linear(self.screw_motor, distance, feed_rate)
+
     def move_slits(self, distance):
         """
         Move the slits motor by a specified distance.
         """
         self.move_motor(self.slits_motor, distance)
 
+    def move_screw_to(self, screw_course, backlash_approach=0.0, direction=1):
+        """
+        Move the screw to a course from its origin (found by the homing), straight from 
+        its current position. The course is approached in the given direction: a course 
+        behind the current position is overshot by backlash_approach. Towards -X, the 
+        course is compensated for the backlash of the screw (see BacklashModel).
+
+        Args:
+            screw_course (float): Course of the screw from its origin.
+            backlash_approach (float): Overshoot when the screw goes back.
+            direction (int): Direction of the approach (+1: towards +X, -1: towards -X).
+        """
+        target = self.machine_state.home_position[SCREW_MOTOR_AXIS] + self.screw_backlash.compensate(screw_course, direction)
+        self.absolute_move()
+        if (target - self.get_position_xyz()[0]) * direction < 0:
+            self.move_screw(target - direction * backlash_approach)
+        self.move_screw(target)
+        self.relative_move()
+
     def reset_screw_position(self, screw_course):
         """
         Move the screw motor backward.
@@ -245,27 +410,71 @@ class GeneralMotorsController:
         Args:
             pin_list (list): Digital pins for the end stop sensors.
         """
-        for pin in pin_list:
-            self.arduino_sensors.digital[pin].mode = INPUT
-
-        # Create an Iterator instance to not miss incoming data
-        it = util.Iterator(self.arduino_sensors)
-        it.start()
-
-        # Allow the iterator to start
-        time.sleep(1)
+        # The sensors service reads the board: the pins only have to be reported
+        self.sensors.watch(pin_list)
 
     def read_sensor(self, sensor):
-        return self.arduino_sensors.digital[sensor].read()
+        return self.sensors.read(sensor)
+
+    def read_sensors(self):
+        """
+        Returns:
+            dict: State of each sensor pin (all_pin).
+        """
+        return {pin: self.read_sensor(pin) for pin in self.all_pin}
 
     def wait_sensor(self, digital_value, pin):
         """
         Attend que le capteur change d'état
         """
-        while digital_value is True:
-            digital_value = self.arduino_sensors.digital[pin].read()
+        if digital_value is True:
             print("The motor don't touch the : ", digital_value)
-            time.sleep(0.1)
+            self.wait_sensor_state(pin, False, self.sensor_timeout)
+
+    def wait_sensor_state(self, pin, value, timeout=None):
+        """
+        Block until a sensor has a value (see FirmataSensorService.wait_for_state), in slices 
+        of stop_check_period between which a stop of the acquisition is checked.
+
+        Args:
+            pin (int): Digital pin of the sensor.
+            value (bool): Value waited for.
+            timeout (float): Maximum waiting time in seconds (no limit by default).
+
+        Raises:
+            TimeoutError: The sensor does not have the value after the timeout.
+            StopRequested: A stop was requested during the wait (the motion is aborted).
+        """
+        start_time = time.time()
+        while True:
+            remaining = None if timeout is None else timeout - (time.time() - start_time)
+            try:
+                self.sensors.wait_for_state(pin, value, self.stop_check_period if remaining is None 
+                                            else max(min(self.stop_check_period, remaining), 0))
+                return
+            except TimeoutError:
+                if remaining is not None and remaining <= self.stop_check_period:
+                    raise TimeoutError(f"The sensor on pin {pin} is not {value} after {timeout} s") from None
+            self.check_stop_motion()
+
+    def wait_reply(self, command):
+        """
+        Block until GRBL replies to a command (e.g. the homing cycle), checking a stop of the 
+        acquisition every stop_check_period.
+
+        Args:
+            command (GrblCommand): Command sent.
+
+        Returns:
+            list: Informations sent by GRBL with the reply.
+
+        Raises:
+            GrblError: GRBL replied an error.
+            StopRequested: A stop was requested during the wait (the motion is aborted).
+        """
+        while not command.done.wait(self.stop_check_period):
+            self.check_stop_motion()
+        return command.wait()
 
 # Initialization of all motors 
 
@@ -278,146 +487,271 @@ class GeneralMotorsController:
         """
         pin = self.pin_limit_switch_mirror_cuves[0]        
         self.unlock_motors()
-        state = self.arduino_sensors.digital[pin].read()
+        state = self.read_sensor(pin)
 
         if state is False:
             self.relative_move()            
             self.move_mirror_motor(0.5)
-            time.sleep(0.5*60/20)
-            state = self.arduino_sensors.digital[pin].read()         
+            self.wait_for_idle()
+            state = self.read_sensor(pin)         
             self.absolute_move()   
-            time.sleep(1)
             self.move_mirror_motor(1) 
-            while state is True:
+            if state is True:
                 print("Cuvette 2 not reached because ", state)
-                state = self.arduino_sensors.digital[pin].read()
-                print(self.get_position_xyz())                
-                pos_y = self.get_position_xyz()[2]
-                self.move_mirror_motor(distance=pos_y)
-                print(pos_y)        
+                self.wait_sensor_state(pin, False, self.sensor_timeout)
+                print(self.get_position_xyz())        
 
             print("O.5")
         else :
             self.absolute_move()   
-            time.sleep(1)
             self.move_mirror_motor(1) 
-            while state is True:
+            if state is True:
                 print("Cuvette 2 not reached because ", state)
-                state = self.arduino_sensors.digital[pin].read()
-                print(self.get_position_xyz())                
-                pos_y = self.get_position_xyz()[2]
-                self.move_mirror_motor(distance=pos_y)
-                print(pos_y)
-        
+                self.wait_sensor_state(pin, False, self.sensor_timeout)
+                print(self.get_position_xyz())
+        self.wait_for_idle()
+        self.machine_state.set_homed(MIRROR_CUVES_MOTOR_AXIS, self.get_position_xyz()[2])
+        self.machine_state.mirror = 'cuvette 2'
 
     def move_slits_with_limits(self, direction, step, limit_sensor, limit_value, max_retries=5):
         retries = 0
         while (limit_value if direction > 0 else not limit_value) and retries < max_retries:
             self.unlock_motors()
             self.move_slits(step)
+            self.wait_for_idle()
             limit_value = self.read_sensor(limit_sensor)
             retries += 1
-            time.sleep(0.5)
+
+    def supports_jog(self):
+        """
+        Returns:
+            bool: True when GRBL has the jogs ($J=) and the jog cancel (GRBL 1.1 and later), 
+                False for GRBL 0.9 or an unknown version.
+        """
+        version = self.grbl.firmware_version(self.startup_timeout)
+        return version is not None and version >= (1, 1)
+
+    def jog(self, motor_parameters, distance, feed_rate):
+        """
+        Move a motor by a distance with a GRBL jog ($J=), which can be cancelled at any 
+        time (see cancel_jog) and does not change the G90/G91 mode. Without jogs (GRBL 0.9), 
+        a relative G1 move, which cannot be cancelled and leaves the relative mode (G91).
+
+        Args:
+            motor_parameters (list): Motor parameters [axis, speed, movement type].
+            distance (float): Distance to move.
+            feed_rate (float): Feed rate of the movement in mm/min.
+
+        Returns:
+            GrblCommand: The jog command.
+        """
+        if not self.supports_jog():
+            return self.grbl.send("G91G1" + motor_parameters[0] + str(distance) + "F" + str(feed_rate))
+        return self.grbl.send("$J=G91" + motor_parameters[0] + str(distance) + "F" + str(feed_rate))
+
+    def cancel_jog(self):
+        """
+        Stop the current jog at once and discard the queued jogs (realtime command 0x85).
+        """
+        self.grbl.realtime('\x85')
+
+    def jog_until_sensor(self, motor_parameters, distance, feed_rate, pin, value):
+        """
+        Jog a motor until a sensor takes a value. The jog is cancelled from the sensors 
+        thread on the report of the value, i.e. within a Firmata sampling period. Without 
+        jogs (GRBL 0.9), the motor moves by steps of a sampling period (see step_until_sensor).
+
+        Args:
+            motor_parameters (list): Motor parameters [axis, speed, movement type].
+            distance (float): Maximum distance to move.
+            feed_rate (float): Feed rate of the movement in mm/min.
+            pin (int): Digital pin of the sensor.
+            value (bool): Value of the sensor which stops the motor.
+
+        Raises:
+            TimeoutError: The sensor does not take the value over the distance.
+            StopRequested: A stop was requested (the motion is aborted).
+        """
+        if self.read_sensor(pin) == value:
+            return
+        if not self.supports_jog():
+            self.step_until_sensor(motor_parameters, distance, feed_rate, pin, value)
+            return
+
+        def stop_on_value(_, new_value):
+            if new_value == value:
+                self.cancel_jog()
+
+        self.sensors.add_callback(pin, stop_on_value)
+        try:
+            self.jog(motor_parameters, distance, feed_rate)
+            # Duration of the jog and a margin for the acceleration
+            self.wait_sensor_state(pin, value, abs(distance) * 60 / feed_rate + 2)
+        except StopRequested:
+            raise  # GRBL was reset (see check_stop_motion)
+        except BaseException:
+            self.cancel_jog()
+            self.wait_for_idle()
+            raise
+        finally:
+            self.sensors.remove_callback(pin, stop_on_value)
+        self.cancel_jog()
+        self.wait_for_idle()
+
+    def step_until_sensor(self, motor_parameters, distance, feed_rate, pin, value):
+        """
+        Move a motor by steps until a sensor takes a value, for GRBL without jog cancel 
+        (GRBL 0.9): each step lasts sensor_step_time at the feed rate and the sensor is read 
+        once the motor is idle, so the motor stops within a step of the sensor.
+
+        Args:
+            motor_parameters (list): Motor parameters [axis, speed, movement type].
+            distance (float): Maximum distance to move.
+            feed_rate (float): Feed rate of the movement in mm/min.
+            pin (int): Digital pin of the sensor.
+            value (bool): Value of the sensor which stops the motor.
+
+        Raises:
+            TimeoutError: The sensor does not take the value over the distance.
+            StopRequested: A stop was requested (the motion is aborted).
+        """
+        step = feed_rate * self.sensor_step_time / 60
+        number_of_steps = int(abs(distance) // step) + 1
+        self.relative_move()
+        for _ in range(number_of_steps):
+            if self.read_sensor(pin) == value:
+                return
+            self.check_stop_motion()
+            self.move_motor_linear(motor_parameters, step if distance > 0 else -step, feed_rate)
+            self.wait_for_idle()
+        if self.read_sensor(pin) != value:
+            raise TimeoutError(f"The sensor on pin {pin} is not {value} after {abs(distance)} mm")
 
     def initialisation_motor_slits(self, slit):
         """
         Initialize the motor that controls the 
-        variable slit system.
+        variable slit system, then select the slit.
+
+        The origin (2nm slit) is found in three phases: a fast jog towards the optical fork 
+        at the origin of the slits (pin 5), a pull-off of slits_pull_off (slow past it until 
+        the fork is cleared), then a slow jog until the switch of the 2nm slit (pin 6), always approached in the 
+        same direction for repeatability. The fast approach may stop past the 2nm slit 
+        (overtravel and latency of the cancel): the slow approach goes back to the stop of 
+        the fast approach and past it by slits_refine_margin.
         """
         # pin fourche optique
         pin_optical = self.pin_limit_switch_slits[0]
-        pin_optical_value = self.arduino_sensors.digital[pin_optical].read()
-        # pin interrupteur
-        pin_limit= self.pin_limit_switch_slits[1]
-        print(pin_limit)
-        pin_limit_value = self.arduino_sensors.digital[pin_limit].read() # False : pas fente / True : Fente
-        print(pin_limit_value)
-        time.sleep(1)
-        i = -0.005
-        print(pin_optical_value)
-        initial = True
-        # Mise au départ 
-        time.sleep(1)       
-        self.relative_move()
-        if pin_optical_value is False and initial:
-            while pin_optical_value is False:
-                self.move_slits(i)
-                pin_optical_value = self.arduino_sensors.digital[pin_optical].read()
-                i = -0.005  # Movement of 0.005 of the motor not optimal
-                time.sleep(0.10)
-            pin_limit_value = self.arduino_sensors.digital[pin_limit].read() # False : fente / True pas fente
-            time.sleep(1)
-            print("limit",pin_limit_value)
-
-            while pin_limit_value:
-                self.unlock_motors()
-                self.move_slits(i)
-                pin_limit_value = self.arduino_sensors.digital[pin_limit].read()
-                i = -0.001  # Movement of 0.005 of the motor not optimal
-                print(pin_limit_value)
-                time.sleep(0.5)
-            print("Variable slit motor has reached the start")
-            initial= False
-        else:
-            print("Variable slit motor has reached the start")
-        
-    
-        if slit !="Fente_2nm":
-            indice = self.search_word(self.name_slits, slit)
-            self.move_slits(self.slits_position[indice]-0.005)
-            self.wait_for_idle()
-            pin_limit_value = self.arduino_sensors.digital[pin_limit].read()
-
-            while pin_limit_value:
-                self.unlock_motors()
-                self.move_slits(i)
-                pin_limit_value = self.arduino_sensors.digital[pin_limit].read()
-                i = 0.001  # Movement of 0.005 of the motor not optimal
-                print(pin_limit_value)
-                time.sleep(0.5)
-            
-            print("Variable slit motor is ready for measurement")     
+        # pin interrupteur (False : fente / True : pas fente)
+        pin_limit = self.pin_limit_switch_slits[1]
+        self.unlock_motors()
+        # Fast approach of the optical fork
+        self.jog_until_sensor(self.slits_motor, -self.slits_travel, self.slits_motor[2], pin_optical, True)
+        fast_stop = self.get_position_xyz()[1]
+        # Pull-off by a fixed distance, then slowly out of the fork if the motor is still in it 
+        # (a fast jog would overshoot towards the 1nm slit)
+        self.jog(self.slits_motor, self.slits_pull_off, self.slits_motor[2])
+        self.wait_for_idle()
+        self.jog_until_sensor(self.slits_motor, self.slits_travel, self.slits_refine_rate, pin_optical, False)
+        # Slow approach of the 2nm slit, between the pull-off and the stop of the fast approach
+        refine_travel = self.get_position_xyz()[1] - fast_stop + self.slits_refine_margin
+        self.jog_until_sensor(self.slits_motor, -refine_travel, self.slits_refine_rate, pin_limit, False)
+        self.machine_state.slits_origin = self.get_position_xyz()[1]
+        self.machine_state.set_homed(SLITS_MOTOR_AXIS, self.machine_state.slits_origin)
+        self.machine_state.slit = self.name_slits[0]
+        print("Variable slit motor has reached the start")
+        self.select_slit(slit)
+
+    def select_slit(self, slit):
+        """
+        Move the variable slits to a slit. The slit is approached towards +Y from 
+        slits_approach below it and stops on the switch of the slit (pin 6).
+        The origin is searched first when it is unknown or for the 2nm slit.
 
-        else: 
-            print("Variable slit motor is ready for measurement")     
+        Args:
+            slit (str): Name of the slit (see name_slits).
+        """
+        if self.machine_state.homed[SLITS_MOTOR_AXIS] and slit == self.machine_state.slit:
+            print("Variable slit motor is ready for measurement")
+            return
+        if not self.machine_state.homed[SLITS_MOTOR_AXIS] or slit == self.name_slits[0]:
+            self.initialisation_motor_slits(slit)
+            return
+        pin_limit = self.pin_limit_switch_slits[1]
+        target = self.machine_state.slits_origin + self.slits_position[self.name_slits.index(slit)]
+        self.jog(self.slits_motor, target - self.slits_approach - self.get_position_xyz()[1], self.slits_motor[2])
+        self.wait_for_idle()
+        self.jog_until_sensor(self.slits_motor, self.slits_refine_travel, self.slits_refine_rate, pin_limit, False)
+        self.machine_state.slit = slit
+        print("Variable slit motor is ready for measurement")
 
 
     def initialisation_motor_screw(self):
         """
         Initialize the screw motor for the start of the experiment.
+
+        Raises:
+            StopRequested: A stop was requested during the homing (the homing is aborted).
         """
         # pin: limit switch between a mechanical stop of screw 
         # opposite at diffraction grating 
         # we initialize at this position? (question !!!)
         pin = self.pin_limit_switch_screw[0]
-        digital_value = self.arduino_sensors.digital[pin].read()
+        digital_value = self.read_sensor(pin)
         # we unlock motors because homing cycle is up ($22=1)
         # Why unlock motors in GRBL?
         self.unlock_motors()
         # What is the definition of homing in GRBL?
-        self.homing()
+        homing = self.homing()
         # Loop 
         self.wait_sensor(digital_value, pin)
             
         print("We are back to the start!")
-        time.sleep(6)
-        self.wait_sensor(digital_value, pin)
+        self.wait_reply(homing)  # GRBL replies at the end of the homing cycle
+        self.wait_for_idle()
+        self.machine_state.set_homed(SCREW_MOTOR_AXIS, self.get_position_xyz()[0])
 
         print("Diffraction grating is ready for acquisition!")
         # End-of-file (EOF)
 
+    def return_mirror_to_origin(self):
+        """
+        Moves the mirror to cuvette 2 (position of the last initialisation), as 
+        initialisation_motors without the search of the origins. The screw stays where 
+        it is: the start of the scan is reached with move_screw_to.
+        """
+        self.absolute_move()
+        self.move_mirror_motor(self.machine_state.home_position[MIRROR_CUVES_MOTOR_AXIS])
+        self.wait_for_idle()
+        self.machine_state.mirror = 'cuvette 2'
+
     def initialisation_motors(self, slip):
         """
         Initializes all motors to start an acquisition.
+
+        The motors are homed only when the machine state is unknown or does not match 
+        GRBL and the sensors (alarm, reset, motors moved by hand...): otherwise they 
+        go straight to their origins.
         """
         self.initialize_end_stop(self.all_pin)
-        time.sleep(1)
-        self.initialize_mirror_position()
-        self.wait_for_idle()
-        self.initialisation_motor_screw()
-        self.wait_for_idle()
-        self.initialisation_motor_slits(slip)
+        if self.machine_state.verify(self.get_status(), self.read_sensors()):
+            print("Machine state verified: the motors are not homed again")
+            self.return_mirror_to_origin()
+            self.select_slit(slip)
+        else:
+            self.initialize_mirror_position()
+            self.wait_for_idle()
+            self.initialisation_motor_screw()
+            self.wait_for_idle()
+            self.initialisation_motor_slits(slip)
         self.wait_for_idle()
+        self.save_machine_state()
+
+    def save_machine_state(self):
+        """
+        Saves the machine state on disk, to be verified by the next acquisition 
+        (possibly of another run of the server).
+        """
+        self.machine_state.save()
 
 
 if __name__ == "__main__":
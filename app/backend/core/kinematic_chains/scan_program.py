@@ -0,0 +1,200 @@
+"""
+G-code program of a whole step scan, compiled in advance and streamed to GRBL.
+
+For each point of the scan, the program moves the screw to the position and opens the
+acquisition window of the photodiode 2, moves the mirror to switch the cuvette and opens
+the window of the photodiode 1, then moves the mirror back together with the screw
+towards the next point. The moves are absolute (G90) so that the position of each
+window is known exactly.
+
+An acquisition window is a dwell (G4) for the mechanical settling followed by a program
+pause (M0): GRBL holds at the position of the window until the acquisition is done and
+the cycle is resumed ('~'). The settling is timed by GRBL, and an acquisition can last
+as long as needed (adaptive integration) without a margin on a fixed dwell.
+
+The program is sent by a thread through the character counting of GrblLink: GRBL always
+has the next lines, and the motions only depend on the planner of GRBL, not on the
+latency of Python.
+"""
+
+import threading
+
+
+class ScanProgram:
+    """
+    Compiles a step scan into G-code and synchronises the acquisitions with its execution.
+
+    Attributes:
+        grbl (GrblLink): Link of the motors.
+        lines (list): G-code lines of the program.
+        windows (list): Acquisition windows (point index, channel index, work position X, Y, Z)
+            in the order of the program.
+        commands (list): Commands sent (GrblCommand).
+        position_tolerance (float): Tolerance on the position of a window in mm.
+        window_timeout (float): Maximum waiting time of a window in seconds.
+        stop_event (threading.Event): Stop of the acquisition: once set, the waits of the
+            windows return at once (the caller then aborts the program).
+    """
+
+    def __init__(self, grbl, screw_axis='X', mirror_axis='Z', mirror_move=0.33334, backlash_approach=0.05,
+                 stop_event=None):
+        """
+        Args:
+            grbl (GrblLink): Link of the motors.
+            screw_axis (str): Axis of the screw of the diffraction grating.
+            mirror_axis (str): Axis of the mirror switching the cuvettes.
+            mirror_move (float): Move of the mirror from the photodiode 2 to the photodiode 1.
+            backlash_approach (float): Overshoot when the screw goes back to a position.
+            stop_event (threading.Event): Stop of the acquisition.
+        """
+        self.grbl = grbl
+        self.screw_axis = screw_axis
+        self.mirror_axis = mirror_axis
+        self.mirror_move = mirror_move
+        self.backlash_approach = backlash_approach
+        self.lines = []
+        self.windows = []
+        self.commands = []
+        self.position_tolerance = 0.002
+        self.window_timeout = 60
+        self.stop_event = stop_event
+        self.sender = None
+        self.aborted = False
+
+    def compile(self, positions, current_position, start_position, settle_time, direction=1):
+        """
+        Compiles the program of a scan. The modal state left by the program is G91
+        (relative moves), as the scans of Varian634AcquisitionMode expect.
+
+        Args:
+            positions (array): Screw positions to measure, in the order of the scan.
+            current_position (float): Screw position at the start.
+            start_position (tuple): Work position (X, Y, Z) of the machine at the start.
+            settle_time (float): Dwell for the mechanical settling before each acquisition in seconds.
+            direction (int): Direction in which each position is approached (+1: towards +X, 
+                -1: towards -X).
+
+        Returns:
+            list: The G-code lines.
+        """
+        axes = {'X': 0, 'Y': 1, 'Z': 2}
+        screw, mirror = axes[self.screw_axis], axes[self.mirror_axis]
+        origin = start_position[screw] - current_position
+        mirror_rest = start_position[mirror]
+        target = list(start_position)
+
+        def move(screw_target, mirror_target):
+            words = ""
+            if abs(screw_target - target[screw]) > 1e-6:
+                words += f"{self.screw_axis}{screw_target:.4f}"
+            if abs(mirror_target - target[mirror]) > 1e-6:
+                words += f"{self.mirror_axis}{mirror_target:.4f}"
+            if words:
+                self.lines.append("G0" + words)
+            target[screw], target[mirror] = screw_target, mirror_target
+
+        def window(point, channel):
+            self.lines += [f"G4P{settle_time:.3f}", "M0"]
+            self.windows.append((point, channel, tuple(target)))
+
+        self.lines = ["G90"]
+        self.windows = []
+        for i, position in enumerate(positions):
+            screw_target = origin + position
+            if (screw_target - target[screw]) * direction < 0:
+                # Backlash: the position is approached in the scan direction
+                move(screw_target - direction * self.backlash_approach, mirror_rest)
+            move(screw_target, mirror_rest)
+            window(i, 0)
+            move(screw_target, mirror_rest + self.mirror_move)
+            window(i, 1)
+        move(target[screw], mirror_rest)
+        self.lines.append("G91")
+        return self.lines
+
+    def start(self):
+        """
+        Starts the sending of the program. The sender thread blocks while the RX buffer
+        of GRBL is full (e.g. during a pause).
+        """
+        self.commands = []
+        self.aborted = False
+        self.sender = threading.Thread(target=self.send_lines, daemon=True)
+        self.sender.start()
+
+    def send_lines(self):
+        """
+        Sender thread: sends the lines of the program.
+        """
+        for line in self.lines:
+            if self.aborted:
+                break
+            self.commands.append(self.grbl.send(line))
+
+    def at_window(self, machine_state, window):
+        """
+        Args:
+            machine_state (dict): Status report parsed (see parse_status_report).
+            window (tuple): Acquisition window (see windows).
+
+        Returns:
+            bool: True when GRBL holds at the position of the window.
+        """
+        position = machine_state['WPos'] if machine_state['WPos'] is not None else machine_state['MPos']
+        if position is None or machine_state['state'] != 'Hold':
+            return False
+        return all(abs(current - target) <= self.position_tolerance for current, target in zip(position, window[2]))
+
+    def wait_window(self, window):
+        """
+        Waits for GRBL to hold at the position of an acquisition window (settled), or for
+        a stop of the acquisition.
+
+        Args:
+            window (tuple): Acquisition window (see windows).
+
+        Raises:
+            TimeoutError: The window is not reached after window_timeout seconds.
+        """
+        def reached(status):
+            return self.at_window(status, window) or (self.stop_event is not None and self.stop_event.is_set())
+
+        if self.grbl.wait_machine_state(reached, self.window_timeout) is None:
+            raise TimeoutError(f"Acquisition window {window} not reached after {self.window_timeout} s")
+
+    def resume(self):
+        """
+        Ends the current acquisition window: GRBL resumes the program (cycle start).
+        """
+        self.grbl.realtime('~')
+
+    def finish(self, timeout=None):
+        """
+        Waits for the end of the sending and for the replies of all the lines.
+
+        Args:
+            timeout (float): Maximum waiting time of each reply in seconds.
+
+        Raises:
+            GrblError: GRBL replied an error to a line of the program.
+        """
+        self.sender.join()
+        for command in self.commands:
+            command.wait(timeout)
+
+    def abort(self):
+        """
+        Stops the sending of the program, runs the lines already sent without holding
+        in their windows, and restores the relative moves (G91).
+        """
+        self.aborted = True
+        # While GRBL holds at a window, the sender waits for room in the RX buffer behind
+        # the pause: GRBL is resumed until the sender sees the abort
+        while self.sender is not None and self.sender.is_alive():
+            self.resume()
+            self.sender.join(0.1)
+        for command in self.commands:
+            while not command.done.wait(0.1):
+                self.resume()
+        self.resume()  # GRBL replies to a pause (M0) once it holds
+        self.grbl.send("G91")
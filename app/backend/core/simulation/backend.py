@@ -0,0 +1,104 @@
+"""
+Simulated hardware backend of the VARIAN 634: GRBL board of the motors, Arduino of the
+sensors and NI-PCI 6221, all sharing the same physical model and clock.
+
+    arduino_motors, arduino_sensors, daq = create_simulated_backend(speedup=20)
+    acquisition = Varian634AcquisitionMode(arduino_motors, arduino_sensors, socketio,
+                                           sample_name, cuvette_choice, slot_size, daq=daq)
+
+Run this file to time a short scan on the simulated hardware:
+
+    python -m core.simulation.backend --speedup 50 --scan-mode precision
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from core.electronics_controler.firmata_sensors import FirmataSensorService
+from core.kinematic_chains.grbl_link import GrblLink
+from core.simulation.instrument import SimulationClock, SimulatedVarian634
+from core.simulation.grbl_simulator import SimulatedGrblSerial
+from core.simulation.firmata_simulator import SimulatedArduino
+from core.simulation.daq_simulator import SimulatedElectronicVarian634
+
+
+def create_simulated_backend(speedup=1.0, sample_cuvette='cuvette 1'):
+    """
+    Creates the simulated hardware of a VARIAN 634.
+
+    Args:
+        speedup (float): Ratio between the simulated time and the real time (motions, dwells
+            and acquisitions last speedup times less).
+        sample_cuvette (str): Cuvette holding the sample ('cuvette 1' or 'cuvette 2').
+
+    Returns:
+        tuple: (arduino_motors, arduino_sensors, daq) to use in place of the serial.Serial port
+        of GRBL, the pyfirmata Arduino of the sensors and ElectronicVarian634.
+    """
+    instrument = SimulatedVarian634(SimulationClock(speedup), sample_cuvette)
+    arduino_motors = SimulatedGrblSerial(instrument)
+    arduino_sensors = SimulatedArduino(instrument)
+    # The sensors are sampled every 19 ms of simulated time, as the StandardFirmata default
+    FirmataSensorService.for_board(arduino_sensors, sampling_interval=19 / speedup)
+    # GRBL status reports every 20 ms of simulated time (at most 500 requests per real second)
+    GrblLink.for_port(arduino_motors).start_status_polling(max(0.02 / speedup, 0.002))
+    daq = SimulatedElectronicVarian634(instrument)
+    return arduino_motors, arduino_sensors, daq
+
+
+class RecordingSocketIO:
+    """
+    Stand-in for flask_socketio.SocketIO which records the emitted events.
+    """
+
+    def __init__(self):
+        self.events = []
+
+    def emit(self, event, data=None, **kwargs):
+        """
+        Records an event.
+
+        Args:
+            event (str): Name of the event.
+            data (dict): Data of the event.
+        """
+        self.events.append((event, data))
+
+
+if __name__ == "__main__":
+    from core.acquisition_mode import Varian634AcquisitionMode
+
+    parser = argparse.ArgumentParser(description="Scan on the simulated VARIAN 634")
+    parser.add_argument('--speedup', type=float, default=50.0)
+    parser.add_argument('--scan-mode', default='precision', choices=['precision', 'fly', 'adaptive'])
+    parser.add_argument('--wavelength-min', type=float, default=500.0)
+    parser.add_argument('--wavelength-max', type=float, default=600.0)
+    parser.add_argument('--wavelength-step', type=float, default=10.0)
+    parser.add_argument('--runs', type=int, default=1, help="back-to-back scans of the same sample")
+    parser.add_argument('--zigzag', action='store_true', help="alternate the wavelength order of the runs")
+    parser.add_argument('--calibrate-backlash', action='store_true', help="calibrate the backlash of the screw first")
+    arguments = parser.parse_args()
+
+    ARDUINO_MOTORS, ARDUINO_SENSORS, DAQ = create_simulated_backend(arguments.speedup)
+    SOCKETIO = RecordingSocketIO()
+    os.chdir(tempfile.mkdtemp())  # raw data of the benchmark
+    ACQUISITION = Varian634AcquisitionMode(ARDUINO_MOTORS, ARDUINO_SENSORS, SOCKETIO, "simulation",
+                                           "cuvette 1", "Fente_2nm", daq=DAQ)
+    if arguments.calibrate_backlash:
+        ACQUISITION.backlash_calibration(arguments.wavelength_min, arguments.wavelength_max,
+                                         arguments.wavelength_step)
+    for RUN in range(arguments.runs):
+        START_REAL, START_SIMULATED = time.monotonic(), ARDUINO_MOTORS.clock.time()
+        SOCKETIO.events.clear()
+        ACQUISITION.acquisition("scanning", arguments.wavelength_min, arguments.wavelength_max,
+                                arguments.wavelength_step, scan_mode=arguments.scan_mode,
+                                wavelength_order="ascending" if arguments.zigzag and RUN % 2 else "descending")
+        REAL_DURATION = time.monotonic() - START_REAL
+        SIMULATED_DURATION = ARDUINO_MOTORS.clock.time() - START_SIMULATED
+        NUMBER_OF_POINTS = len([event for event in SOCKETIO.events if event[0] == 'update_data'])
+        print(f"{arguments.scan_mode} scan {RUN + 1}/{arguments.runs} : {NUMBER_OF_POINTS} points in "
+              f"{SIMULATED_DURATION:.1f} s of simulated time ({REAL_DURATION:.1f} s real), "
+              f"{SIMULATED_DURATION / max(NUMBER_OF_POINTS, 1):.2f} s per point")
+    print(f"raw data : {os.getcwd()}")
@@ -0,0 +1,221 @@
+"""
+Simulated NI-PCI 6221: the acquisitions of ElectronicVarian634 read the photodiode
+signal of signal_simulation.photodiode_signal_simu instead of the card. The amplitude of
+the pulses is given by the physical model for the current position of the axes, and
+each acquisition lasts its number of samples / sample_rate on the simulation clock.
+
+The lamp pulse folding, lock-in, adaptive integration and fly scan reductions are the
+ones of ElectronicVarian634.
+"""
+
+import numpy as np
+
+from core.electronics_controler.ni_pci_6221 import ElectronicVarian634
+from core.electronics_controler.signal_simulation import photodiode_signal_simu
+from core.simulation.instrument import SimulatedVarian634
+
+
+RAW_FULL_SCALE = 10.0  # V for the int16 full scale of the raw samples
+
+
+class SimulatedElectronicVarian634(ElectronicVarian634):
+    """
+    ElectronicVarian634 reading simulated photodiodes.
+
+    Attributes:
+        instrument (SimulatedVarian634): Physical model giving the light on each photodiode.
+        noise_standard_deviation (float): Standard deviation of the photodiode noise in volts.
+    """
+
+    def __init__(self, instrument=None):
+        """
+        Args:
+            instrument (SimulatedVarian634): Physical model of the spectrophotometer.
+        """
+        super().__init__()
+        self.instrument = instrument if instrument is not None else SimulatedVarian634()
+        self.noise_standard_deviation = 0.0058
+
+    def simulate_voltages(self, physical_channel, number_of_samples, amplitudes=None):
+        """
+        Simulated samples of a photodiode. The pulses start at lamp_pulse_phase when the
+        acquisition is triggered on the lamp, at a random phase otherwise.
+
+        Parameters:
+        - physical_channel (str) : Analog input physical_channel (e.g., 'Dev1/ai0').
+        - number_of_samples (int) : Number of samples.
+        - amplitudes (array float) : Amplitude of the pulses of each lamp period (amplitude of
+        the model at the current position by default).
+
+        Returns:
+        - voltages (array float) : Voltages in volts, clipped to the range of the channel.
+        """
+        samples_per_period = int(round(self.sample_rate / self.frequency[0]))
+        pulse_width = int(round(self.duty_cycle[0] * samples_per_period))
+        if self.trigger_on_lamp:
+            phase = int(round(self.lamp_pulse_phase * samples_per_period))
+        else:
+            phase = np.random.randint(samples_per_period)
+        voltages = photodiode_signal_simu(1.0, number_of_samples, samples_per_period, pulse_width, phase, 0.0)
+        if amplitudes is None:
+            voltages *= self.instrument.photodiode_amplitude(physical_channel)
+        else:
+            period = np.minimum(np.arange(number_of_samples) // samples_per_period, len(amplitudes) - 1)
+            voltages *= amplitudes[period]
+        voltages += np.random.normal(0, self.noise_standard_deviation, number_of_samples)
+        return np.clip(voltages, -10.0, 5.0)
+
+    def open_session(self, physical_channels):
+        """
+        Opens a simulated session on the photodiode channels (see ElectronicVarian634.open_session).
+
+        Parameters:
+        - physical_channels (list str) : Analog input channels of the photodiodes (e.g., ['Dev1/ai0', 'Dev1/ai1']).
+        """
+        if self.session_tasks:
+            return
+        self.session_tasks = dict.fromkeys(physical_channels, 'simulated')
+        self.session_channels = list(physical_channels)
+
+    def close_session(self):
+        """
+        Closes the simulated session.
+        """
+        self.session_tasks = {}
+        self.session_channels = []
+
+    def read_session(self, physical_channel):
+        """
+        Simulated finite acquisition of number_of_samples() samples.
+
+        Parameters:
+        - physical_channel (str) : Analog input physical_channel to return (e.g., 'Dev1/ai0').
+
+        Returns:
+        - voltages (array float) : Voltages of physical_channel.
+        """
+        clock = self.instrument.clock
+        start_time = clock.time()
+        number_of_samples = self.number_of_samples()
+        voltages = self.simulate_voltages(physical_channel, number_of_samples)
+        # The acquisition lasts its duration, whatever the time taken by the simulation
+        clock.sleep(number_of_samples / self.sample_rate - (clock.time() - start_time))
+        return voltages
+
+    def read_session_raw(self, physical_channel):
+        """
+        Simulated finite acquisition of number_of_samples() raw int16 samples.
+
+        Parameters:
+        - physical_channel (str) : Analog input physical_channel to return (e.g., 'Dev1/ai0').
+
+        Returns:
+        - raw_values (array int16) : Raw samples of physical_channel.
+        """
+        voltages = self.read_session(physical_channel)
+        return np.round(voltages * 32767 / RAW_FULL_SCALE).astype(np.int16)
+
+    def scale_raw(self, task, channel_index, raw_values):
+        """
+        Converts simulated raw samples into volts.
+
+        Parameters:
+        - task : Unused (the scaling of the simulated raw samples is linear).
+        - channel_index (int) : Unused.
+        - raw_values (array int16 or float) : Raw samples, or a reduction of them (min, mean...).
+
+        Returns:
+        - voltages (array float) : Voltages in volts.
+        """
+        return np.asarray(raw_values, dtype=np.float64) * RAW_FULL_SCALE / 32767
+
+    def acquire_lamp_pulses(self, physical_channel):
+        """
+        Acquires and folds the lamp pulses (see ElectronicVarian634.acquire_lamp_pulses),
+        with a session opened for this acquisition only when none is open.
+
+        Parameters:
+        - physical_channel (str) : Analog input physical_channel to measure (e.g., 'Dev1/ai0').
+
+        Returns:
+        - on_means (array float) : Mean of the pulse samples of each period in volts.
+        - off_means (array float) : Mean of the other samples of each period in volts.
+        """
+        if physical_channel in self.session_channels:
+            return super().acquire_lamp_pulses(physical_channel)
+        with self.session([physical_channel]):
+            return super().acquire_lamp_pulses(physical_channel)
+
+    def voltage_acquisition_chemical_kinetics(self, physical_channel, time_acquisition, delay_between_measurements):
+        """
+        Simulated kinetics: one lock-in amplitude every delay_between_measurements seconds
+        (see ElectronicVarian634.voltage_acquisition_chemical_kinetics).
+
+        Parameters:
+        - time_acquisition (float) : Acquisition duration in seconds.
+        - delay_between_measurements (float): Delay between consecutive measurements in seconds.
+        - physical_channel (str) : Analog input physical_channel to configure (e.g., 'Dev1/ai0').
+
+        Returns:
+        - moment (list float) : List of time instants.
+        - voltages (list float) : List of mean amplitudes of the lamp pulses.
+        """
+        clock = self.instrument.clock
+        mean_voltages = []
+        moment = []
+        start_time = clock.time()
+        while clock.time() - start_time < time_acquisition + 1:
+            start_time_temp = clock.time()
+            mean_voltage, _ = self.voltage_acquisition_lock_in(physical_channel)
+            moment.append(start_time_temp - start_time)
+            mean_voltages.append(mean_voltage)
+            clock.sleep(delay_between_measurements - (clock.time() - start_time_temp))
+        return moment, mean_voltages
+
+    def voltage_acquisition_fly_scan(self, physical_channel, time_acquisition, start_motion, stop_event=None):
+        """
+        Simulated continuous acquisition during a motion (see
+        ElectronicVarian634.voltage_acquisition_fly_scan). The amplitude of the pulses
+        follows the model while the axes move, interpolated between two reads. The pulses
+        are dated on the simulation clock, which keeps the pulses and the positions consistent
+        when the simulation runs late on an accelerated clock.
+
+        Parameters:
+        - physical_channel (str) : Analog input physical_channel to measure (e.g., 'Dev1/ai0').
+        - time_acquisition (float) : Acquisition duration in seconds.
+        - start_motion (callable) : Function sending the motion to GRBL, called once
+        the acquisition is running.
+        - stop_event (threading.Event) : Stop of the acquisition: once set, the acquisition 
+        ends after the current read (pulses acquired so far).
+
+        Returns:
+        - moment (array float) : Instant of each lamp pulse in seconds, from the start of the motion.
+        - pulse_voltages (array float) : Amplitude of each lamp pulse.
+        """
+        clock = self.instrument.clock
+        samples_per_period = int(self.sample_rate / self.frequency[0])
+        periods_per_read = self.fly_scan_periods_per_read
+        number_of_reads = int(np.ceil(time_acquisition * self.frequency[0] / periods_per_read))
+        pulse_voltages = np.empty(number_of_reads * periods_per_read)
+        moment = np.empty(number_of_reads * periods_per_read)
+
+        start_motion()
+        read_start = clock.time()
+        motion_start = read_start
+        amplitude_start = self.instrument.photodiode_amplitude(physical_channel)
+        for i in range(number_of_reads):
+            if stop_event is not None and stop_event.is_set():
+                moment, pulse_voltages = moment[:i*periods_per_read], pulse_voltages[:i*periods_per_read]
+                break
+            clock.sleep(periods_per_read / self.frequency[0])
+            read_end = clock.time()
+            amplitude_end = self.instrument.photodiode_amplitude(physical_channel)
+            pulses = (np.arange(periods_per_read) + 0.5) / periods_per_read
+            amplitudes = amplitude_start + (amplitude_end - amplitude_start) * pulses
+            voltages = self.simulate_voltages(physical_channel, periods_per_read*samples_per_period, amplitudes)
+            on_means, off_means = self.fold_lamp_pulses(voltages)
+            pulse_voltages[i*periods_per_read:(i+1)*periods_per_read] = on_means - off_means
+            moment[i*periods_per_read:(i+1)*periods_per_read] = read_start + (read_end - read_start) * pulses - motion_start
+            read_start, amplitude_start = read_end, amplitude_end
+
+        return moment, pulse_voltages
@@ -0,0 +1,108 @@
+"""
+Simulated Arduino UNO running StandardFirmata, with the interface of pyfirmata.Arduino
+used for the sensors of the VARIAN 634 (board.digital[pin].read(), util.Iterator...).
+
+The state of each sensor is computed from the true position of the axes of the
+physical model when it is read.
+"""
+
+from core.simulation.instrument import SimulatedVarian634
+
+
+INPUT = 0  # pyfirmata.INPUT
+
+
+class SimulatedDigitalPin:
+    """
+    Digital pin of the simulated Arduino, as pyfirmata.Pin.
+    """
+
+    def __init__(self, board, pin_number):
+        """
+        Args:
+            board (SimulatedArduino): Board of the pin.
+            pin_number (int): Digital pin number.
+        """
+        self.board = board
+        self.pin_number = pin_number
+        self.reporting = False
+        self._mode = None
+
+    @property
+    def mode(self):
+        return self._mode
+
+    @mode.setter
+    def mode(self, mode):
+        # As pyfirmata, an input pin reports its value
+        self._mode = mode
+        if mode == INPUT:
+            self.enable_reporting()
+
+    def enable_reporting(self):
+        """
+        Starts the report of the pin value.
+        """
+        self.reporting = True
+
+    def disable_reporting(self):
+        """
+        Stops the report of the pin value.
+        """
+        self.reporting = False
+
+    def read(self):
+        """
+        Returns:
+            bool: State of the sensor wired on the pin (None while the pin is not reported, as pyfirmata).
+        """
+        if not self.reporting:
+            return None
+        return self.board.instrument.sensor_state(self.pin_number)
+
+
+class SimulatedArduino:
+    """
+    Arduino UNO of the sensors of a simulated VARIAN 634.
+
+    Attributes:
+        instrument (SimulatedVarian634): Physical model read by the sensors.
+        digital (list): Digital pins 0 to 13.
+    """
+
+    def __init__(self, instrument=None):
+        """
+        Args:
+            instrument (SimulatedVarian634): Physical model of the spectrophotometer.
+        """
+        self.instrument = instrument if instrument is not None else SimulatedVarian634()
+        self.digital = [SimulatedDigitalPin(self, pin) for pin in range(14)]
+        self.sampling_interval = 19  # ms, StandardFirmata default
+
+    def bytes_available(self):
+        """
+        Returns:
+            int: Bytes waiting on the serial port: always 0, the pins are read directly on the model.
+        """
+        return 0
+
+    def iterate(self):
+        """
+        Reads and handles the Firmata messages: nothing to do with the simulated board.
+        """
+
+    def samplingOn(self, sample_interval=19):
+        """
+        Sets the sampling interval of the board in ms.
+
+        Args:
+            sample_interval (int): Sampling interval in ms.
+        """
+        self.sampling_interval = sample_interval
+
+    def exit(self):
+        """
+        Stops the report of all the pins.
+        """
+        for pin in self.digital:
+            pin.disable_reporting()
@@ -0,0 +1,586 @@
+"""
+Simulated Arduino running GRBL 1.1, with the interface of the serial.Serial port used
+by GeneralMotorsController (write, readline, read, in_waiting, flushInput...).
+
+The simulator interprets the G-code sent by the application and plans the motions with
+the GRBL timing: trapezoidal velocity profile limited by the maximum rate ($110-$112)
+and the acceleration ($120-$122) of each axis. The timeline is evaluated lazily from
+the simulation clock: the position, the state of the status reports and the deferred
+'ok' replies ($H, G4, full planner) are computed when they are read.
+
+Supported commands:
+- G90/G91, G0/G1 with X, Y, Z and F words, G4 P (dwell), M0 (program pause, resumed by '~')
+- $X (unlock), $H (homing of X), $J= (jog), $$ and $G, $<n>=<value>
+- realtime commands: '?' (status report), '!' (feed hold), '~' (cycle start),
+  0x18 (soft reset), 0x85 (jog cancel)
+"""
+
+import re
+import time
+import threading
+import numpy as np
+
+from core.simulation.instrument import SimulatedVarian634
+
+
+AXES = 'XYZ'
+PLANNER_BLOCKS = 15
+RX_BUFFER_SIZE = 128
+WELCOME_MESSAGE = "Grbl 1.1h ['$' for help]"
+
+
+class SimulatedGrblSerial:
+    """
+    Serial port of a simulated GRBL board driving the motors of the VARIAN 634.
+
+    Attributes:
+        instrument (SimulatedVarian634): Physical model moved by the simulated motors.
+        timeout (float): Read timeout in real seconds (None: blocking read), as serial.Serial.
+        settings (dict): GRBL settings ('$110': maximum rate of X in mm/min...).
+    """
+
+    def __init__(self, instrument=None, timeout=None):
+        """
+        Args:
+            instrument (SimulatedVarian634): Physical model of the spectrophotometer.
+            timeout (float): Read timeout in real seconds (None: blocking read).
+        """
+        self.instrument = instrument if instrument is not None else SimulatedVarian634()
+        self.instrument.machine_position = self.machine_position
+        self.clock = self.instrument.clock
+        self.timeout = timeout
+        self.is_open = True
+        self.settings = {'$22': 1,  # homing cycle enabled: GRBL boots in alarm
+                         '$25': 10.0,  # homing seek rate (mm/min)
+                         '$110': 10.0, '$111': 14.0, '$112': 20.0,  # maximum rates (mm/min)
+                         '$120': 10.0, '$121': 10.0, '$122': 10.0}  # accelerations (mm/s^2)
+
+        self.condition = threading.Condition(threading.RLock())
+        self.line_buffer = bytearray()
+        self.output = bytearray()  # replies sent by GRBL, not read yet
+        self.pending_replies = []  # [(planner time, reply)] replies not sent yet
+        self.last_reply_time = 0.0
+
+        # Planner: motions in the planner time (simulation time without the feed holds)
+        self.position = np.zeros(3)  # machine position at the end of the retired blocks
+        self.blocks = []
+        self.hold_start = None
+        self.hold_duration = 0.0
+        self.pauses = []  # planner times of the program pauses (M0) not reached yet
+        self.alarm = self.settings['$22'] == 1
+        # Modal state
+        self.relative = False
+        self.motion_mode = 'G0'
+        self.feed_rate = 0.0
+
+        self.output += f"\r\n{WELCOME_MESSAGE}\r\n".encode()
+        if self.alarm:
+            self.output += b"[MSG:'$H'|'$X' to unlock]\r\n"
+
+# Serial port interface
+
+    @property
+    def in_waiting(self):
+        """
+        Returns:
+            int: Number of bytes sent by GRBL and not read yet.
+        """
+        with self.condition:
+            self.release_replies()
+            return len(self.output)
+
+    def write(self, data):
+        """
+        Sends bytes to GRBL. Realtime commands are executed at once, the other characters
+        are executed line by line.
+
+        Args:
+            data (bytes): Characters sent to GRBL.
+
+        Returns:
+            int: Number of bytes written.
+        """
+        with self.condition:
+            for character in bytes(data):
+                if character in (ord('?'), ord('!'), ord('~'), 0x18, 0x85):
+                    self.realtime_command(character)
+                elif character == ord('\n'):
+                    self.execute_line(self.line_buffer.decode(errors='ignore'))
+                    self.line_buffer.clear()
+                elif character != ord('\r'):
+                    self.line_buffer.append(character)
+            self.condition.notify_all()
+        return len(data)
+
+    def readline(self):
+        """
+        Reads a line sent by GRBL, waiting for it until the timeout.
+
+        Returns:
+            bytes: Line terminated by b'\\n' (or the bytes received before the timeout).
+        """
+        return self.read_until(lambda output: output.find(b'\n') + 1)
+
+    def read(self, size=1):
+        """
+        Reads size bytes sent by GRBL, waiting for them until the timeout. Without timeout,
+        stops when GRBL has nothing more to send.
+
+        Args:
+            size (int): Number of bytes to read.
+
+        Returns:
+            bytes: Bytes received.
+        """
+        return self.read_until(lambda output: size if len(output) >= size else 0, stop_when_idle=True)
+
+    def flushInput(self):
+        """
+        Discards the bytes sent by GRBL and not read yet.
+        """
+        self.reset_input_buffer()
+
+    def reset_input_buffer(self):
+        """
+        Discards the bytes sent by GRBL and not read yet.
+        """
+        with self.condition:
+            self.release_replies()
+            self.output.clear()
+
+    def close(self):
+        """
+        Closes the port.
+        """
+        self.is_open = False
+
+    def read_until(self, complete, stop_when_idle=False):
+        """
+        Waits for the bytes sent by GRBL until complete(output) gives the number of bytes
+        to return.
+
+        Args:
+            complete (callable): Number of bytes to return from the output, 0 to keep waiting.
+            stop_when_idle (bool): Return the available bytes when no reply is pending.
+
+        Returns:
+            bytes: Bytes read.
+        """
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        with self.condition:
+            while True:
+                self.release_replies()
+                size = complete(self.output)
+                if size:
+                    break
+                if stop_when_idle and not self.pending_replies:
+                    size = len(self.output)
+                    break
+                wait = None
+                if self.pending_replies and self.hold_start is None:
+                    wait = max(self.pending_replies[0][0] - self.planner_time(), 0.0) / self.clock.speedup
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        size = len(self.output)
+                        break
+                    wait = remaining if wait is None else min(wait, remaining)
+                self.condition.wait(wait)
+            data = bytes(self.output[:size])
+            del self.output[:size]
+        return data
+
+# Replies
+
+    def planner_time(self):
+        """
+        Returns:
+            float: Simulation time without the feed holds, time base of the planner.
+        """
+        now = self.clock.time()
+        if self.hold_start is None and self.pauses and self.pauses[0] <= now - self.hold_duration:
+            # Program pause reached: feed hold from the time of the pause
+            self.hold_start = self.pauses.pop(0) + self.hold_duration
+        hold = now - self.hold_start if self.hold_start is not None else 0.0
+        return now - self.hold_duration - hold
+
+    def reply(self, message, delay_until=None):
+        """
+        Queues a reply of GRBL. The replies are sent in the order of the commands, a reply
+        is never sent before the reply of the previous command.
+
+        Args:
+            message (str): Reply ('ok', 'error:9'...).
+            delay_until (float): Planner time at which the reply is sent (at once by default).
+        """
+        release_time = max(self.planner_time(), self.last_reply_time, delay_until or 0.0)
+        self.last_reply_time = release_time
+        self.pending_replies.append((release_time, (message + "\r\n").encode()))
+
+    def release_replies(self):
+        """
+        Moves the replies whose time has come to the output.
+        """
+        now = self.planner_time()
+        while self.pending_replies and self.pending_replies[0][0] <= now:
+            self.output += self.pending_replies.pop(0)[1]
+
+    def parse_time(self):
+        """
+        Returns:
+            float: Planner time at which GRBL parses the next line: after the reply of the previous one.
+        """
+        return max(self.planner_time(), self.last_reply_time)
+
+# Motion planning
+
+    def retire_blocks(self, now):
+        """
+        Removes the blocks finished at planner time now and applies their end position.
+
+        Args:
+            now (float): Planner time.
+        """
+        while self.blocks and self.blocks[0]['start'] + self.blocks[0]['duration'] <= now:
+            block = self.blocks.pop(0)
+            self.position = block['target'].copy()
+            self.instrument.update_screw_play(self.position[0])
+
+    def machine_position(self):
+        """
+        Returns:
+            tuple: Machine position (X, Y, Z) in mm at the current time (MPos).
+        """
+        with self.condition:
+            now = self.planner_time()
+            self.retire_blocks(now)
+            if not self.blocks or self.blocks[0]['start'] > now:
+                return tuple(self.position)
+            block = self.blocks[0]
+            return tuple(self.block_position(block, now - block['start']))
+
+    def block_position(self, block, elapsed):
+        """
+        Position along a block with a trapezoidal velocity profile.
+
+        Args:
+            block (dict): Planned block.
+            elapsed (float): Time since the start of the block in seconds.
+
+        Returns:
+            array: Machine position (X, Y, Z) in mm.
+        """
+        length, acceleration, peak_rate = block['length'], block['acceleration'], block['peak_rate']
+        if length == 0:
+            return block['target'].copy()
+        acceleration_time = peak_rate / acceleration
+        deceleration_start = block['duration'] - acceleration_time
+        if elapsed < acceleration_time:
+            travel = 0.5 * acceleration * elapsed**2
+        elif elapsed < deceleration_start:
+            travel = 0.5 * acceleration * acceleration_time**2 + peak_rate * (elapsed - acceleration_time)
+        else:
+            travel = length - 0.5 * acceleration * max(block['duration'] - elapsed, 0.0)**2
+        return block['origin'] + (block['target'] - block['origin']) * min(travel / length, 1.0)
+
+    def plan_block(self, kind, target, feed_rate=None, duration=None):
+        """
+        Adds a block to the planner, after the previous one.
+
+        Args:
+            kind (str): 'motion', 'jog', 'home' or 'dwell'.
+            target (array): Machine position at the end of the block.
+            feed_rate (float): Feed rate in mm/min (None: maximum rates, as G0).
+            duration (float): Duration of a dwell in seconds.
+
+        Returns:
+            dict: Planned block.
+        """
+        origin = self.blocks[-1]['target'] if self.blocks else self.position
+        start = self.parse_time()
+        if self.blocks:
+            start = max(start, self.blocks[-1]['start'] + self.blocks[-1]['duration'])
+        block = {'kind': kind, 'origin': origin.copy(), 'target': np.array(target, dtype=float),
+                 'start': start, 'length': 0.0, 'acceleration': 1.0, 'peak_rate': 0.0,
+                 'duration': duration or 0.0}
+        displacement = np.abs(block['target'] - block['origin'])
+        length = float(np.linalg.norm(displacement))
+        if length > 0:
+            moving = displacement > 0
+            max_rates = np.array([self.settings[f'$11{i}'] for i in range(3)]) / 60  # mm/s
+            accelerations = np.array([self.settings[f'$12{i}'] for i in range(3)])
+            # Rate and acceleration along the path limited by each axis
+            rate = np.min(max_rates[moving] * length / displacement[moving])
+            if feed_rate:
+                rate = min(rate, feed_rate / 60)
+            acceleration = np.min(accelerations[moving] * length / displacement[moving])
+            acceleration_time = min(rate / acceleration, np.sqrt(length / acceleration))
+            peak_rate = acceleration * acceleration_time
+            block.update(length=length, acceleration=acceleration, peak_rate=peak_rate,
+                         duration=2 * acceleration_time + (length - peak_rate * acceleration_time) / peak_rate)
+        self.blocks.append(block)
+        return block
+
+    def planner_free_time(self):
+        """
+        Returns:
+            float: Planner time at which a planner slot is free for a new block.
+        """
+        busy = [block for block in self.blocks if block['start'] + block['duration'] > self.parse_time()]
+        if len(busy) < PLANNER_BLOCKS:
+            return None
+        oldest = busy[len(busy) - PLANNER_BLOCKS]
+        return oldest['start'] + oldest['duration']
+
+    def is_idle(self, now=None):
+        """
+        Args:
+            now (float): Planner time (parse time of the next line by default).
+
+        Returns:
+            bool: True when all the planned blocks are finished.
+        """
+        now = self.parse_time() if now is None else now
+        return not self.blocks or self.blocks[-1]['start'] + self.blocks[-1]['duration'] <= now
+
+# Commands
+
+    def execute_line(self, line):
+        """
+        Executes a line of G-code or a '$' system command.
+
+        Args:
+            line (str): Line received, without end of line.
+        """
+        line = line.replace(' ', '').upper()
+        if not line:
+            self.reply('ok')
+        elif line.startswith('$'):
+            self.system_command(line)
+        elif self.alarm:
+            self.reply('error:9')  # G-code locked out during alarm
+        else:
+            self.gcode_command(line)
+
+    def parse_words(self, line):
+        """
+        Args:
+            line (str): G-code line.
+
+        Returns:
+            list: Words (letter, value) of the line, None if the line is not valid G-code.
+        """
+        words = re.findall(r"([A-Z])([-+]?[0-9]*\.?[0-9]+)", line)
+        if ''.join(letter + value for letter, value in words) != line:
+            return None
+        return [(letter, float(value)) for letter, value in words]
+
+    def gcode_command(self, line, jog=False):
+        """
+        Executes a G-code line (or the G-code of a jog).
+
+        Args:
+            line (str): G-code line.
+            jog (bool): True for the G-code of a $J= command.
+        """
+        words = self.parse_words(line)
+        if words is None:
+            self.reply('error:2')  # Bad number format
+            return
+        relative, motion_mode, feed_rate = self.relative, self.motion_mode, self.feed_rate
+        dwell = None
+        pause = False
+        target_words = {}
+        for letter, value in words:
+            if letter == 'G' and value in (90, 91):
+                relative = value == 91
+            elif letter == 'G' and value in (0, 1):
+                motion_mode = f'G{int(value)}'
+            elif letter == 'G' and value == 4:
+                dwell = 0.0
+            elif letter == 'F':
+                feed_rate = value
+            elif letter == 'P' and dwell is not None:
+                dwell = value
+            elif letter == 'M' and value == 0:
+                pause = True
+            elif letter in AXES:
+                target_words[AXES.index(letter)] = value
+            elif letter != 'G' or value not in (17, 21, 54, 94):
+                self.reply('error:20')  # Unsupported command
+                return
+
+        if jog:
+            if not target_words or not feed_rate:
+                self.reply('error:3')
+                return
+            motion_mode = 'G1'
+        else:
+            self.relative, self.motion_mode, self.feed_rate = relative, motion_mode, feed_rate
+
+        if pause:
+            # The motions before the pause are finished, then GRBL holds until '~'
+            block = self.plan_block('dwell', self.blocks[-1]['target'] if self.blocks else self.position)
+            self.pauses.append(block['start'])
+            self.reply('ok', delay_until=block['start'])
+            return
+        if dwell is not None:
+            block = self.plan_block('dwell', self.blocks[-1]['target'] if self.blocks else self.position,
+                                    duration=dwell)
+            self.reply('ok', delay_until=block['start'] + block['duration'])
+            return
+        if not target_words:
+            self.reply('ok')
+            return
+        if motion_mode == 'G1' and not feed_rate:
+            self.reply('error:22')  # Undefined feed rate
+            return
+        free_time = self.planner_free_time()
+        target = (self.blocks[-1]['target'] if self.blocks else self.position).copy()
+        for index, value in target_words.items():
+            target[index] = target[index] + value if relative else value
+        self.plan_block('jog' if jog else 'motion', target, feed_rate if motion_mode == 'G1' else None)
+        self.reply('ok', delay_until=free_time)
+
+    def system_command(self, line):
+        """
+        Executes a '$' system command.
+
+        Args:
+            line (str): Command line.
+        """
+        if line == '$X':
+            self.alarm = False
+            self.reply('[MSG:Caution: Unlocked]')
+            self.reply('ok')
+        elif line == '$H':
+            if not self.is_idle():
+                self.reply('error:8')  # Not idle
+                return
+            self.home()
+        elif line.startswith('$J='):
+            if self.alarm:
+                self.reply('error:9')
+            else:
+                self.gcode_command(line[3:], jog=True)
+        elif line == '$$':
+            for key, value in sorted(self.settings.items(), key=lambda item: int(item[0][1:])):
+                self.reply(f"{key}={value:g}")
+            self.reply('ok')
+        elif line == '$G':
+            self.reply(f"[GC:{self.motion_mode} G54 G17 G21 {'G91' if self.relative else 'G90'} G94 M5 M9 T0 F{self.feed_rate:g} S0]")
+            self.reply('ok')
+        elif re.fullmatch(r"\$[0-9]+=[-+]?[0-9]*\.?[0-9]+", line):
+            key, value = line.split('=')
+            self.settings[key] = float(value)
+            self.reply('ok')
+        else:
+            self.reply('error:3')  # Invalid '$' statement
+
+    def home(self):
+        """
+        Homing cycle of the screw (X): the screw goes to its limit switch at the homing seek
+        rate, then GRBL sets the machine position of X to 0. The 'ok' is sent at the end of the cycle.
+        """
+        start = self.parse_time()
+        self.retire_blocks(start)
+        # The machine position of X is rebased at once: the cycle goes to the machine position 0
+        self.position[0] += self.instrument.position_offset['X']
+        self.instrument.home_axis('X')
+        target = self.position.copy()
+        target[0] = 0.0
+        block = self.plan_block('home', target, self.settings['$25'])
+        self.alarm = False
+        self.reply('ok', delay_until=block['start'] + block['duration'])
+
+    def realtime_command(self, character):
+        """
+        Executes a realtime command, without waiting for the end of the current line.
+
+        Args:
+            character (int): '?', '!', '~', 0x18 or 0x85.
+        """
+        now = self.planner_time()
+        self.retire_blocks(now)
+        if character == ord('?'):
+            self.release_replies()
+            self.output += (self.status_report() + "\r\n").encode()
+        elif character == ord('!') and self.hold_start is None and not self.is_idle(now):
+            self.hold_start = self.clock.time()
+        elif character == ord('~') and self.hold_start is not None:
+            self.hold_duration += self.clock.time() - self.hold_start
+            self.hold_start = None
+        elif character == 0x85:
+            self.cancel_jog(now)
+        elif character == 0x18:
+            self.soft_reset(now)
+
+    def cancel_jog(self, now):
+        """
+        Jog cancel: the current jog stops where it is and the queued jogs are discarded.
+
+        Args:
+            now (float): Planner time.
+        """
+        if not self.blocks or self.blocks[0]['kind'] != 'jog':
+            return
+        self.position = np.array(self.machine_position())
+        self.instrument.update_screw_play(self.position[0])
+        while self.blocks and self.blocks[0]['kind'] == 'jog':
+            self.blocks.pop(0)
+        if self.blocks:
+            self.blocks[0]['origin'] = self.position.copy()
+            self.blocks[0]['start'] = min(self.blocks[0]['start'], now)
+
+    def soft_reset(self, now):
+        """
+        Soft reset: the planner and the replies are discarded. A reset during a motion
+        loses the position: GRBL goes into alarm.
+
+        Args:
+            now (float): Planner time.
+        """
+        moving = not self.is_idle(now) or self.hold_start is not None
+        self.position = np.array(self.machine_position())
+        self.instrument.update_screw_play(self.position[0])
+        self.blocks.clear()
+        self.pauses.clear()
+        self.pending_replies.clear()
+        self.line_buffer.clear()
+        if self.hold_start is not None:
+            self.hold_duration += self.clock.time() - self.hold_start
+            self.hold_start = None
+        self.last_reply_time = self.planner_time()
+        self.relative, self.motion_mode, self.feed_rate = False, 'G0', 0.0
+        if moving:
+            self.alarm = True
+            self.output += b"ALARM:3\r\n"
+        self.output += f"\r\n{WELCOME_MESSAGE}\r\n".encode()
+        if self.alarm:
+            self.output += b"[MSG:'$H'|'$X' to unlock]\r\n"
+
+    def status_report(self):
+        """
+        Returns:
+            str: Status report of GRBL 1.1, e.g. <Idle|MPos:0.000,0.000,0.000|Bf:15,128|FS:0,0>.
+        """
+        now = self.planner_time()
+        active = [block for block in self.blocks if block['start'] <= now]
+        if self.alarm:
+            state = 'Alarm'
+        elif self.hold_start is not None:
+            state = 'Hold:0'
+        elif active and active[0]['kind'] == 'home':
+            state = 'Home'
+        elif active and active[0]['kind'] == 'jog':
+            state = 'Jog'
+        elif self.blocks:
+            state = 'Run'
+        else:
+            state = 'Idle'
+        feed_rate = 0.0
+        if active and active[0]['length'] > 0 and self.hold_start is None:
+            feed_rate = active[0]['peak_rate'] * 60
+        position = ','.join(f"{coordinate:.3f}" for coordinate in self.machine_position())
+        free_blocks = PLANNER_BLOCKS - min(len(self.blocks), PLANNER_BLOCKS)
+        return f"<{state}|MPos:{position}|Bf:{free_blocks},{RX_BUFFER_SIZE}|FS:{feed_rate:.0f},0>"
@@ -0,0 +1,87 @@
+"""
+Check of a stop of the acquisition during the initialisation of the motors on the simulated
+hardware: the stop is requested while GRBL homes the screw, while the screw leaves its limit
+switch, or while the slits search their origin. The acquisition must end with StopRequested
+soon after the stop, and the next scan must complete (the motors are homed again).
+The exit status is 1 when it does not.
+
+Usage (from app/backend):
+    python -m core.simulation.homing_stop_check --speedup 20
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from core.acquisition_mode import Varian634AcquisitionMode
+from core.simulation.backend import create_simulated_backend, RecordingSocketIO
+from core.simulation.scan_abort_check import run_scan
+
+
+def stop_after_call(acquisition, method_name, delay):
+    """
+    Requests a stop of the acquisition delay seconds after the first call of a method of
+    the motors controller.
+
+    Args:
+        acquisition (Varian634AcquisitionMode): Acquisition on the simulated hardware.
+        method_name (str): Method of GeneralMotorsController (e.g. 'homing').
+        delay (float): Real time between the call and the stop in seconds.
+
+    Returns:
+        list: Real time of the stop (empty until it is requested).
+    """
+    controller = acquisition.motors_controller
+    method = getattr(controller, method_name)
+    stop_time = []
+
+    def request_stop():
+        stop_time.append(time.monotonic())
+        acquisition.stop_event.set()
+
+    def call(*args, **kwargs):
+        setattr(controller, method_name, method)  # first call only
+        threading.Timer(delay, request_stop).start()
+        return method(*args, **kwargs)
+
+    setattr(controller, method_name, call)
+    return stop_time
+
+
+def check_stop(method_name, delay, speedup, deadline, reaction):
+    """
+    Stops an acquisition during the initialisation of the motors, then runs a short scan on
+    the same hardware.
+
+    Returns:
+        bool: True when the acquisition ended with StopRequested within reaction seconds of
+            the stop and the next scan completed.
+    """
+    arduino_motors, arduino_sensors, daq = create_simulated_backend(speedup)
+    acquisition = Varian634AcquisitionMode(arduino_motors, arduino_sensors, RecordingSocketIO(), "simulation",
+                                           "cuvette 1", "Fente_2nm", daq=daq)
+    stop_time = stop_after_call(acquisition, method_name, delay)
+    interrupted = run_scan(acquisition, (500.0, 520.0, 10.0), deadline)
+    reaction_time = time.monotonic() - stop_time[0] if stop_time else float('nan')
+    acquisition.stop_event.clear()
+    following = run_scan(acquisition, (500.0, 520.0, 10.0), deadline) if interrupted != 'hung' else 'not run'
+    print(f"stop {delay} s after {method_name} : acquisition ended by {interrupted} {reaction_time:.2f} s "
+          f"after the stop, next scan {following}")
+    return interrupted == 'StopRequested' and reaction_time <= reaction and following == 'done'
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stop during the homing on the simulated hardware")
+    parser.add_argument('--speedup', type=float, default=20.0)
+    parser.add_argument('--deadline', type=float, default=120.0, help="maximum real duration of a scan in seconds")
+    parser.add_argument('--reaction', type=float, default=0.3, help="maximum real time between the stop and the end")
+    arguments = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp())  # raw data of the check
+    RESULTS = [check_stop(method_name, delay, arguments.speedup, arguments.deadline, arguments.reaction)
+               for method_name, delay in [('homing', 0.2), ('wait_sensor', 0.05), ('initialisation_motor_slits', 0.1)]]
+    sys.stdout.flush()
+    os._exit(0 if all(RESULTS) else 1)  # a hung acquisition thread would keep the process alive
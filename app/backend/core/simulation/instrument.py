@@ -0,0 +1,217 @@
+"""
+Physical model of the VARIAN 634 shared by the simulated GRBL board, Firmata board
+and NI-PCI 6221 card.
+
+The model holds the true position of the three axes (the motion itself is planned by
+the simulated GRBL), converts it into the state of the sensors and into the light
+received by each photodiode:
+
+- X (screw) : wavelength selected by the diffraction grating (calibration of
+  SignalProcessingVarian634.calculate_wavelength).
+- Y (variable slits) : slit in front of the beam, which sets the light throughput.
+- Z (mirror) : cuvette, and therefore photodiode, lit by the beam.
+"""
+
+import time
+import numpy as np
+
+
+class SimulationClock:
+    """
+    Clock of the simulated hardware, optionally running faster than real time.
+
+    With speedup = 10, a 60 s motion of the simulated motors lasts 6 s.
+    """
+
+    def __init__(self, speedup=1.0):
+        """
+        Args:
+            speedup (float): Ratio between the simulated time and the real time.
+        """
+        self.speedup = speedup
+        self.real_start = time.monotonic()
+
+    def time(self):
+        """
+        Returns:
+            float: Simulated time in seconds since the creation of the clock.
+        """
+        return (time.monotonic() - self.real_start) * self.speedup
+
+    def sleep(self, duration):
+        """
+        Waits for a duration of simulated time.
+
+        Args:
+            duration (float): Simulated duration in seconds.
+        """
+        if duration > 0:
+            time.sleep(duration / self.speedup)
+
+
+class SimulatedVarian634:
+    """
+    Optical and mechanical state of a simulated VARIAN 634.
+
+    Attributes:
+        clock (SimulationClock): Clock shared by all the simulated hardware.
+        position_offset (dict): True position of each axis minus the GRBL machine position.
+        sample_cuvette (str): Cuvette holding the sample ('cuvette 1' or 'cuvette 2').
+    """
+
+    def __init__(self, clock=None, sample_cuvette='cuvette 1'):
+        """
+        Args:
+            clock (SimulationClock): Clock of the simulation (real time by default).
+            sample_cuvette (str): Cuvette holding the sample ('cuvette 1' or 'cuvette 2').
+        """
+        self.clock = clock if clock is not None else SimulationClock()
+        # Position of the axes when GRBL starts (machine position 0): screw away from
+        # its limit switch, slits between two slits
+        self.position_offset = {'X': 5.0, 'Y': 0.1013, 'Z': 0.0}
+        # Function returning the GRBL machine position (X, Y, Z), set by the simulated GRBL
+        self.machine_position = lambda: (0.0, 0.0, 0.0)
+        self.sample_cuvette = sample_cuvette
+        # Play of the lead screw (X): the carriage stays between the machine position minus
+        # screw_backlash and the machine position, and lags by screw_backlash when moving towards +X
+        self.screw_backlash = 0.02
+        self.screw_carriage = 0.0  # machine position of the carriage at the last vertex of the motion
+
+        # Slits [2nm, 1nm, 0.5nm, 0.2nm]: position of the slit (mm) and relative throughput
+        self.slits_position = np.array([0, 0.065, 0.135, 0.22])
+        self.slits_throughput = np.array([1.0, 0.5, 0.25, 0.1])
+        self.slits_origin_fork = 0.012
+        self.slit_switch_tolerance = 0.0015
+        # Mirror: cuvette 2 (photodiode 2, Dev1/ai0) at Z = 1, cuvette 1 (photodiode 1, Dev1/ai1) at Z = 1.333
+        self.mirror_cuvette_2 = 1.0
+        self.mirror_cuvette_1 = 1.33334
+        # Photodiodes: amplitude with the 2nm slit and no absorbance (V), gap between the two photodiodes
+        self.full_scale = 8.0
+        self.photodiode_gain = {'Dev1/ai0': 1.0, 'Dev1/ai1': 1.1}
+        # Absorption band of the sample (bromophenol blue like)
+        self.band_wavelength = 590.0
+        self.band_width = 25.0
+        self.band_absorbance = 0.8
+
+    def true_position(self):
+        """
+        Returns:
+            tuple: True position (X, Y, Z) of the axes in mm.
+        """
+        machine_position = list(self.machine_position())
+        machine_position[0] = self.screw_carriage_position(machine_position[0])
+        return tuple(machine_position[i] + self.position_offset[axis] for i, axis in enumerate('XYZ'))
+
+    def screw_carriage_position(self, machine_x):
+        """
+        Args:
+            machine_x (float): Machine position of the screw motor (X).
+
+        Returns:
+            float: Machine position of the carriage, with the play of the screw.
+        """
+        return min(max(self.screw_carriage, machine_x - self.screw_backlash), machine_x)
+
+    def update_screw_play(self, machine_x):
+        """
+        Applies a vertex of the motion of the screw (end of a block, jog cancel...) to the
+        play of the screw. Between two vertices the motion is monotonic.
+
+        Args:
+            machine_x (float): Machine position of the screw motor (X) at the vertex.
+        """
+        self.screw_carriage = self.screw_carriage_position(machine_x)
+
+    def home_axis(self, axis):
+        """
+        Homing of an axis: GRBL sets the machine position of the limit switch (true position 0) to 0.
+
+        Args:
+            axis (str): 'X', 'Y' or 'Z'.
+        """
+        if axis == 'X':
+            self.screw_carriage += self.position_offset[axis]  # machine position rebased
+        self.position_offset[axis] = 0.0
+
+    def wavelength(self, position_x):
+        """
+        Args:
+            position_x (float): True position of the screw in mm.
+
+        Returns:
+            float: Wavelength selected by the diffraction grating in nm.
+        """
+        return -32.02 * position_x + 886.13
+
+    def lamp_spectrum(self, wavelength):
+        """
+        Relative intensity of the xenon arc lamp seen by the photodiodes.
+
+        Args:
+            wavelength (float): Wavelength in nm.
+
+        Returns:
+            float: Relative intensity between 0 and 1.
+        """
+        return 0.05 + 0.95 * np.exp(-0.5 * ((wavelength - 550.0) / 150.0)**2)
+
+    def sample_absorbance(self, wavelength):
+        """
+        Args:
+            wavelength (float): Wavelength in nm.
+
+        Returns:
+            float: Absorbance of the sample.
+        """
+        return self.band_absorbance * np.exp(-0.5 * ((wavelength - self.band_wavelength) / self.band_width)**2)
+
+    def sensor_state(self, pin):
+        """
+        Digital state of the sensors wired on the Arduino sensors board.
+
+        Args:
+            pin (int): Digital pin of the sensor.
+
+        Returns:
+            bool: State read on the pin.
+        """
+        position_x, position_y, position_z = self.true_position()
+        if pin in (2, 4):
+            # Screw limit switch: released away from the limit
+            return bool(position_x > 0.001)
+        if pin == 3:
+            # Optical fork of the mirror: cut between the rest position and cuvette 2
+            return bool(0.2 <= position_z < self.mirror_cuvette_2 - 0.05)
+        if pin == 5:
+            # Optical fork at the origin of the variable slits, cut just before the 2nm slit
+            return bool(position_y <= self.slits_origin_fork)
+        if pin == 6:
+            # Slit switch: False when a slit is in front of the beam
+            return bool(np.min(np.abs(self.slits_position - position_y)) >= self.slit_switch_tolerance)
+        return False
+
+    def photodiode_amplitude(self, physical_channel):
+        """
+        Amplitude of the lamp pulses on a photodiode for the current position of the axes.
+
+        Args:
+            physical_channel (str): Channel of the photodiode ('Dev1/ai0' or 'Dev1/ai1').
+
+        Returns:
+            float: Amplitude in volts (positive, the signal of the photodiode is negative).
+        """
+        position_x, position_y, position_z = self.true_position()
+        cuvette_1_lit = position_z > (self.mirror_cuvette_2 + self.mirror_cuvette_1) / 2
+        lit_channel = 'Dev1/ai1' if cuvette_1_lit else 'Dev1/ai0'
+        if physical_channel != lit_channel:
+            return 0.0
+        slit = np.argmin(np.abs(self.slits_position - position_y))
+        if abs(self.slits_position[slit] - position_y) > 0.01:
+            return 0.0  # Beam stopped between two slits
+        wavelength = self.wavelength(position_x)
+        amplitude = self.full_scale * self.slits_throughput[slit] * self.lamp_spectrum(wavelength)
+        amplitude *= self.photodiode_gain[physical_channel]
+        cuvette = 'cuvette 1' if cuvette_1_lit else 'cuvette 2'
+        if cuvette == self.sample_cuvette:
+            amplitude *= 10**(-self.sample_absorbance(wavelength))
+        return amplitude
@@ -0,0 +1,83 @@
+"""
+Check of the lock-in amplitude of the lamp pulses on the simulated NI-PCI 6221, without the
+trigger on the lamp (phase of the pulses found on the samples). The amplitude of the pulses
+is swept across the contrast below which the pulse window is not found on the mean profile
+(min_pulse_contrast): the ratio of the estimated amplitude to the true one must stay the
+same on both sides (the ratio of a bright signal: mean fluctuation of the simulated lamp),
+without bias on a dark signal. The exit status is 1 when it does not.
+
+Usage (from app/backend):
+    python -m core.simulation.lock_in_check --reads 200
+"""
+
+import argparse
+import sys
+import numpy as np
+
+from core.simulation.daq_simulator import SimulatedElectronicVarian634
+
+
+def measure(daq, amplitude, reads):
+    """
+    Lock-in amplitudes of simulated reads of pulses of a given amplitude.
+
+    Args:
+        daq (SimulatedElectronicVarian634): Simulated card.
+        amplitude (float): Amplitude of the pulses in volts (negative, as the photodiode signal).
+        reads (int): Number of reads.
+
+    Returns:
+        tuple: Mean of the estimated amplitudes, standard error of this mean, and fraction of
+            the reads whose pulses were not found on the mean profile.
+    """
+    number_of_samples = daq.number_of_samples()
+    samples_per_period = int(round(daq.sample_rate / daq.frequency[0]))
+    number_of_periods = number_of_samples // samples_per_period
+    estimates, low_contrast = [], 0
+    for _ in range(reads):
+        voltages = daq.simulate_voltages('Dev1/ai0', number_of_samples, np.full(number_of_periods, amplitude))
+        pulses = np.reshape(voltages[:number_of_periods*samples_per_period], (number_of_periods, samples_per_period))
+        profile = np.mean(pulses, axis=0)
+        lamp_on = profile < (np.min(profile) + np.max(profile)) / 2
+        low_contrast += daq.pulse_contrast(pulses, lamp_on) < daq.min_pulse_contrast
+        estimates.append(daq.lock_in_amplitude(*daq.fold_lamp_pulses(voltages))[0])
+    return np.mean(estimates), np.std(estimates, ddof=1) / np.sqrt(reads), low_contrast / reads
+
+
+def check_lock_in(reads):
+    """
+    Sweeps the amplitude of the pulses across the contrast threshold.
+
+    Returns:
+        bool: True when the ratio of each amplitude estimated to the true one is within 2 % 
+            (or 4 standard errors) of the ratio of a bright signal, and when the amplitude 
+            estimated without pulse is within 4 standard errors of zero.
+    """
+    daq = SimulatedElectronicVarian634()
+    # Amplitude at the contrast threshold: min_pulse_contrast standard errors of the mean profile
+    number_of_periods = daq.number_of_samples() // int(round(daq.sample_rate / daq.frequency[0]))
+    threshold = daq.min_pulse_contrast * daq.noise_standard_deviation / np.sqrt(number_of_periods)
+    reference, _, _ = measure(daq, -10 * threshold, reads)
+    gain = reference / (-10 * threshold)
+    print(f"10 x threshold : {gain:.3f} x the amplitude ({-10 * threshold * 1e3:.2f} mV)")
+    success = True
+    for ratio in [0.0, 0.25, 0.5, 0.75, 0.9, 1.0, 1.1, 1.25, 1.5, 2.0, 4.0]:
+        amplitude = -ratio * threshold
+        estimate, standard_error, low_contrast = measure(daq, amplitude, reads)
+        if amplitude == 0:
+            valid = abs(estimate) <= 4 * standard_error
+            print(f"no pulse : {estimate*1e3:+.4f} mV (standard error {standard_error*1e3:.4f} mV), "
+                  f"{low_contrast:.0%} of low contrast")
+        else:
+            valid = abs(estimate - gain * amplitude) <= max(0.02 * abs(gain * amplitude), 4 * standard_error)
+            print(f"{ratio:.2f} x threshold : {estimate / amplitude:.3f} x the amplitude "
+                  f"({amplitude*1e3:.2f} mV), {low_contrast:.0%} of low contrast")
+        success = success and valid
+    return success
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lock-in amplitude across the contrast threshold")
+    parser.add_argument('--reads', type=int, default=200)
+    arguments = parser.parse_args()
+    sys.exit(0 if check_lock_in(arguments.reads) else 1)
@@ -0,0 +1,120 @@
+"""
+Check of the abort of a step scan on the simulated hardware: the scan is interrupted while
+GRBL holds at (or moves to) an acquisition window, by an error of the DAQ or by a stop of
+the acquisition. The scan must end within a deadline, and the next scan must complete.
+The exit status is 1 when a scan hangs or fails.
+
+Usage (from app/backend):
+    python -m core.simulation.scan_abort_check --speedup 20
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from core.acquisition_mode import Varian634AcquisitionMode
+from core.kinematic_chains.motors_varian_634 import StopRequested
+from core.simulation.backend import create_simulated_backend, RecordingSocketIO
+
+
+class FaultyDaq:
+    """
+    Simulated NI-PCI 6221 whose n-th voltage acquisition fails (DAQ error) or requests a
+    stop of the acquisition.
+
+    Attributes:
+        daq (SimulatedElectronicVarian634): Simulated card.
+        fault_read (int): Number of the failing acquisition (from 1).
+        fault (str): 'error' (OSError raised during the acquisition, GRBL holds at the
+            window) or 'stop' (stop requested, GRBL moves to the next window).
+        stop_event (threading.Event): Stop of the acquisition.
+        reads (int): Number of acquisitions done.
+    """
+
+    def __init__(self, daq, fault_read, fault, stop_event):
+        self.daq = daq
+        self.fault_read = fault_read
+        self.fault = fault
+        self.stop_event = stop_event
+        self.reads = 0
+
+    def voltage_acquisition(self, *args, **kwargs):
+        """
+        Voltage acquisition of the simulated card, failing at the fault_read-th call.
+        """
+        self.reads += 1
+        if self.reads == self.fault_read:
+            if self.fault == 'error':
+                raise OSError("Simulated DAQ error")
+            self.stop_event.set()
+        return self.daq.voltage_acquisition(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.daq, name)
+
+
+def run_scan(acquisition, wavelength_range, deadline):
+    """
+    Runs a precision scan in a thread.
+
+    Args:
+        acquisition (Varian634AcquisitionMode): Acquisition on the simulated hardware.
+        wavelength_range (tuple): Minimum, maximum wavelength and step.
+        deadline (float): Maximum real duration of the scan in seconds.
+
+    Returns:
+        str: 'done', the name of the exception raised, or 'hung' after the deadline.
+    """
+    result = ['hung']
+
+    def scan():
+        try:
+            acquisition.acquisition("scanning", *wavelength_range)
+            result[0] = 'done'
+        except (OSError, StopRequested) as error:
+            result[0] = type(error).__name__
+
+    thread = threading.Thread(target=scan, daemon=True)
+    thread.start()
+    thread.join(deadline)
+    return result[0]
+
+
+def check_abort(fault, fault_read, speedup, deadline):
+    """
+    Interrupts a scan with a fault, then runs a short scan on the same hardware.
+
+    Returns:
+        bool: True when the interrupted scan ended with the expected exception and the
+            next scan completed.
+    """
+    arduino_motors, arduino_sensors, daq = create_simulated_backend(speedup)
+    acquisition = Varian634AcquisitionMode(arduino_motors, arduino_sensors, RecordingSocketIO(), "simulation",
+                                           "cuvette 1", "Fente_2nm", daq=daq)
+    acquisition.daq = FaultyDaq(daq, fault_read, fault, acquisition.stop_event)
+    start = time.monotonic()
+    interrupted = run_scan(acquisition, (500.0, 600.0, 10.0), deadline)
+    duration = time.monotonic() - start
+    acquisition.stop_event.clear()
+    acquisition.daq = daq
+    following = run_scan(acquisition, (500.0, 520.0, 10.0), deadline) if interrupted != 'hung' else 'not run'
+    expected = 'OSError' if fault == 'error' else 'StopRequested'
+    print(f"{fault} at acquisition {fault_read} : scan ended by {interrupted} in {duration:.1f} s, "
+          f"next scan {following}")
+    return interrupted == expected and following == 'done'
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Abort of a step scan on the simulated hardware")
+    parser.add_argument('--speedup', type=float, default=20.0)
+    parser.add_argument('--deadline', type=float, default=120.0, help="maximum real duration of a scan in seconds")
+    arguments = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp())  # raw data of the check
+    RESULTS = [check_abort(fault, fault_read, arguments.speedup, arguments.deadline)
+               for fault, fault_read in [('error', 9), ('error', 10), ('stop', 9)]]
+    sys.stdout.flush()
+    os._exit(0 if all(RESULTS) else 1)  # a hung scan thread would keep the process alive
@@ -0,0 +1,64 @@
+"""
+Benchmark of the cold start of the server (import of server.py with the simulated hardware),
+with a budget: the exit status is 1 when the median start time exceeds the budget or when
+a heavy package that the server loads on first use (see core/utils/lazy_import.py) is
+imported at start.
+
+Usage (from app/backend):
+    python -m core.simulation.startup_benchmark --runs 5 --budget 1.0
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+
+HEAVY_PACKAGES = ['matplotlib', 'pandas', 'scipy', 'pybaselines', 'nidaqmx']
+
+# Run in a fresh interpreter: start of the server, then the heavy packages already imported
+STARTUP_SCRIPT = f"""
+import json, sys, time
+start = time.perf_counter()
+import server
+duration = time.perf_counter() - start
+print(json.dumps({{'duration': duration, 'heavy': [name for name in {HEAVY_PACKAGES!r} if name in sys.modules]}}))
+sys.stdout.flush()
+"""
+
+
+def measure_startup(speedup=20.0):
+    """
+    Starts the server in a new Python process with the simulated hardware.
+
+    Args:
+        speedup (float): Speedup of the simulated hardware.
+
+    Returns:
+        dict: Start time of the server in seconds ('duration') and heavy packages imported ('heavy').
+    """
+    backend_directory = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    environment = dict(os.environ, VARIAN634_SIMULATION='1', VARIAN634_SIMULATION_SPEEDUP=str(speedup),
+                       PYTHONPATH=backend_directory)
+    result = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], cwd=backend_directory, env=environment,
+                            capture_output=True, text=True, timeout=120, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cold start of the server of the VARIAN 634")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=1.0, help="maximum median start time in seconds")
+    arguments = parser.parse_args()
+
+    MEASURES = [measure_startup() for _ in range(arguments.runs)]
+    DURATIONS = [measure['duration'] for measure in MEASURES]
+    HEAVY = sorted({name for measure in MEASURES for name in measure['heavy']})
+    MEDIAN = statistics.median(DURATIONS)
+    print(f"server start : median {MEDIAN:.3f} s (min {min(DURATIONS):.3f} s, max {max(DURATIONS):.3f} s) "
+          f"over {arguments.runs} runs, budget {arguments.budget:.3f} s")
+    if HEAVY:
+        print(f"heavy packages imported at start : {', '.join(HEAVY)}")
+    sys.exit(0 if MEDIAN <= arguments.budget and not HEAVY else 1)
@@ -0,0 +1,425 @@
+"""
+Headless reprocessing of the archive of spectra (experiments/ and raw_data/).
+
+The archive follows the layout of ExperimentManager.creation_directory_date_slot:
+experiments_YYYY/experiments_MM_YYYY/experiments_DD_MM_YYYY/<slit>/*.csv. Each spectrum
+(CSV or spectrum store: wavelength and absorbance, or voltages of the photodiodes) goes through a configurable
+pipeline of SignalProcessingVarian634 tools (baseline of the slit, Savitzky-Golay
+smoothing) on a pool of processes, and the result is written in a mirror of the tree.
+
+A manifest (manifest.json in the output directory) records the size, modification time
+and SHA-256 of each source and the pipeline of its result: the files already up to date
+are skipped, a file touched without change is only hashed. With a catalog (--catalog), the
+spectra are also recorded in the SQLite catalog of the experiments (see ExperimentCatalog).
+
+Usage (from app/backend):
+    python -m core.utils.archive_processing ../../experiments ../../raw_data --output ../../processed_data
+    python -m core.utils.archive_processing ../../experiments --output ../../processed_data --catalog echantillons.db
+"""
+
+import os
+os.environ.setdefault('MPLBACKEND', 'Agg')  # No window: the processing runs without display
+
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import re
+import time
+import numpy as np
+import pandas as pd
+from scipy.signal import savgol_filter
+from pybaselines import Baseline
+
+from core.utils.calibration import normalize_slit
+from core.utils.baseline_library import BaselineLibrary
+from core.utils.spectrum_store import SpectrumStore, EXTENSION
+from core.utils.experiment_catalog import ExperimentCatalog
+
+
+DAY_DIRECTORY = re.compile(r'experiments_(?P<date>\d{2}_\d{2}_\d{4})$')
+SLIT_DIRECTORY = re.compile(r'fente_', re.IGNORECASE)
+WAVELENGTH_COLUMN = "Longueur d'onde (nm)"
+TITLE_PROCESSED = [WAVELENGTH_COLUMN, "Absorbance", "Absorbance traitee"]
+MANIFEST = 'manifest.json'
+SAMPLE_NAME = re.compile(r'fente_[0-9_]*[nm]m_(?P<sample>.+)$', re.IGNORECASE)
+MODES = ['baseline', 'scanning']
+
+
+def file_hash(path):
+    """
+    Args:
+        path (str): File.
+
+    Returns:
+        str: SHA-256 of the content of the file.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_spectrum(path):
+    """
+    Reads the spectrum of a CSV file (or spectrum store) of the archive: absorbance column, 
+    or voltages of the photodiodes (absorbance log10(V2/V1)).
+
+    Args:
+        path (str): CSV or .v634 file.
+
+    Returns:
+        tuple: Wavelengths and absorbance (arrays), None if the file is not a spectrum.
+    """
+    if path.endswith(EXTENSION):
+        data = pd.DataFrame({name: pd.Series(values) for name, values in SpectrumStore.read(path).columns.items()})
+    else:
+        data = pd.read_csv(path, encoding='ISO-8859-1')
+    if WAVELENGTH_COLUMN not in data.columns:
+        return None
+    absorbance_columns = [column for column in data.columns if re.match(r'Absorba[n]?ce( \(|$)', column)]
+    if absorbance_columns:
+        absorbance = data[absorbance_columns[0]]
+    elif {"Tension photodiode 1 (Volt)", "Tension photodiode 2 (Volt)"} <= set(data.columns):
+        absorbance = np.log10(data["Tension photodiode 2 (Volt)"] / data["Tension photodiode 1 (Volt)"])
+    else:
+        return None
+    spectrum = pd.DataFrame({'wavelength': pd.to_numeric(data[WAVELENGTH_COLUMN], errors='coerce'),
+                             'absorbance': pd.to_numeric(absorbance, errors='coerce')}).dropna()
+    spectrum = spectrum[np.isfinite(spectrum['absorbance'])]
+    if spectrum.empty:
+        return None
+    return spectrum['wavelength'].to_numpy(), spectrum['absorbance'].to_numpy()
+
+
+def describe_run(path, slit, date, wavelength, absorbance):
+    """
+    Run of the catalog of a spectrum of the archive. Sample, mode and cuvette come from the
+    metadata of a spectrum store; for the older files, the sample is the end of the file name
+    after the slit (raw_data_19_03_2024_Fente_1nm_Test.csv -> Test), the whole name otherwise.
+
+    Args:
+        path (str): CSV or .v634 file.
+        slit (str): Slit of the directory.
+        date (str): Date of the directory (DD_MM_YYYY).
+        wavelength (numpy.ndarray): Wavelengths of the spectrum.
+        absorbance (numpy.ndarray): Absorbance of the spectrum.
+
+    Returns:
+        dict: Run with its points (see ExperimentCatalog.add_runs).
+    """
+    metadata = SpectrumStore.read(path).metadata if path.endswith(EXTENSION) else {}
+    name = os.path.basename(path)
+    name = name[:-len(EXTENSION)] if name.endswith(EXTENSION) else os.path.splitext(name)[0]
+    match = SAMPLE_NAME.search(name)
+    mode = metadata.get('mode', next((mode for mode in MODES if f'_{mode}_' in f'_{name}_'), None))
+    return {'sample': metadata.get('sample', match['sample'] if match else name), 'slit': slit,
+            'cuvette': metadata.get('cuvette'), 'date': date, 'mode': mode,
+            'wavelength_min': float(np.min(wavelength)), 'wavelength_max': float(np.max(wavelength)),
+            'wavelength_step': float(np.median(np.abs(np.diff(wavelength)))) if len(wavelength) > 1 else None,
+            'path': path, 'metadata': metadata, 'wavelength': wavelength, 'absorbance': absorbance}
+
+
+class SpectrumPipeline:
+    """
+    Processing of a spectrum of the archive: baseline subtraction then Savitzky-Golay smoothing
+    (as baseline_correction_polyfit and baseline_correction_aspls of SignalProcessingVarian634).
+
+    Attributes:
+        baseline (str): 'library' (baseline of the slit at the date, see BaselineLibrary),
+            'aspls' (baseline_correction_aspls) or 'none'.
+        window_length (int): Window of the Savitzky-Golay filter (0: no smoothing).
+        polyorder (int): Order of the Savitzky-Golay filter.
+    """
+
+    def __init__(self, baseline='library', window_length=35, polyorder=2, baseline_directory=None):
+        """
+        Args:
+            baseline (str): 'library', 'aspls' or 'none'.
+            window_length (int): Window of the Savitzky-Golay filter (0: no smoothing).
+            polyorder (int): Order of the Savitzky-Golay filter.
+            baseline_directory (str): Directory of the baseline library (experiments/calibrage by default).
+        """
+        self.baseline = baseline
+        self.window_length = window_length
+        self.polyorder = polyorder
+        self.baseline_directory = baseline_directory
+        self.baseline_library = None
+
+    def config(self):
+        """
+        Returns:
+            dict: Parameters of the pipeline (a change reprocesses the whole archive).
+        """
+        return {'baseline': self.baseline, 'window_length': self.window_length, 'polyorder': self.polyorder,
+                'baseline_directory': self.baseline_directory}
+
+    def __call__(self, wavelength, absorbance, slit, date):
+        """
+        Args:
+            wavelength (array): Wavelengths of the spectrum.
+            absorbance (array): Absorbance of the spectrum.
+            slit (str): Slit of the experiment.
+            date (str): Date of the experiment (DD_MM_YYYY).
+
+        Returns:
+            array: Processed absorbance.
+        """
+        processed = np.asarray(absorbance, dtype=float)
+        if self.baseline == 'library':
+            if self.baseline_library is None:
+                self.baseline_library = (BaselineLibrary() if self.baseline_directory is None
+                                         else BaselineLibrary(self.baseline_directory))
+            processed = processed - self.baseline_library.baseline(slit, wavelength, date)
+        elif self.baseline == 'aspls':
+            processed = processed - Baseline(wavelength, check_finite=False).aspls(processed, 1e6)[0]
+        window_length = min(self.window_length, len(processed) - (len(processed) + 1) % 2)
+        if window_length > self.polyorder:
+            processed = savgol_filter(processed, window_length=window_length, polyorder=self.polyorder, deriv=0)
+        return processed
+
+
+# State of each worker process of the pool
+worker_pipeline = None
+
+
+def init_worker(config):
+    """
+    Initialisation of a worker process: one pipeline (and baseline library) per process.
+
+    Args:
+        config (dict): Parameters of the pipeline (SpectrumPipeline.config).
+    """
+    global worker_pipeline
+    worker_pipeline = SpectrumPipeline(**config)
+
+
+def process_task(task):
+    """
+    Processes a file of the archive in a worker process and writes its result.
+
+    Args:
+        task (dict): relative path, source, output, slit, date, size, mtime, the
+            SHA-256 recorded in the manifest (None if unknown) and whether the file is to be
+            recorded in the catalog.
+
+    Returns:
+        dict: The task with its status ('processed', 'unchanged', 'skipped' or 'failed'),
+            its SHA-256, an error message and its run for the catalog.
+    """
+    result = dict(task)
+    try:
+        result['sha256'] = file_hash(task['source'])
+        unchanged = result['sha256'] == task['recorded_sha256']
+        if unchanged and not task['catalog']:
+            result['status'] = 'unchanged'
+            return result
+        spectrum = read_spectrum(task['source'])
+        if spectrum is None:
+            result['status'] = 'skipped'
+            return result
+        wavelength, absorbance = spectrum
+        if task['catalog']:
+            result['run'] = describe_run(task['source'], task['slit'], task['date'], wavelength, absorbance)
+            result['run']['metadata']['processed'] = task['output']
+        if unchanged:
+            result['status'] = 'unchanged'
+            return result
+        processed = worker_pipeline(wavelength, absorbance, task['slit'], task['date'])
+        os.makedirs(os.path.dirname(task['output']), exist_ok=True)
+        temporary_path = task['output'] + '.tmp'
+        pd.DataFrame(np.column_stack([wavelength, absorbance, processed]), columns=TITLE_PROCESSED).to_csv(
+            temporary_path, index=False, encoding='ISO-8859-1')
+        os.replace(temporary_path, task['output'])
+        result['status'] = 'processed'
+    except Exception as error:  # The other files of the archive are still processed
+        result['status'] = 'failed'
+        result['error'] = f"{type(error).__name__}: {error}"
+    return result
+
+
+class ArchiveProcessor:
+    """
+    Reprocesses the archive of spectra on a pool of processes.
+
+    Attributes:
+        roots (list): Directories of the archive (experiments/, raw_data/...).
+        output (str): Directory of the results (mirror of the archive, one directory per root).
+        pipeline (SpectrumPipeline): Processing of each spectrum.
+        manifest (dict): State of each source processed (relative path -> record).
+        workers (int): Number of processes (CPU count by default).
+        save_every (int): Number of results between two saves of the manifest (and of the
+            runs recorded in the catalog).
+        catalog (ExperimentCatalog): Catalog of the experiments to fill (None: no catalog).
+    """
+
+    def __init__(self, roots, output, pipeline, workers=None, save_every=20, catalog=None):
+        """
+        Args:
+            roots (list): Directories of the archive.
+            output (str): Directory of the results.
+            pipeline (SpectrumPipeline): Processing of each spectrum.
+            workers (int): Number of processes.
+            save_every (int): Number of results between two saves of the manifest.
+            catalog (ExperimentCatalog): Catalog of the experiments to fill.
+        """
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.output = os.path.abspath(output)
+        self.pipeline = pipeline
+        self.workers = workers
+        self.save_every = save_every
+        self.catalog = catalog
+        self.manifest = {}
+        self.load_manifest()
+
+    def load_manifest(self):
+        """
+        Reads the manifest of the output directory, if it exists.
+        """
+        try:
+            with open(os.path.join(self.output, MANIFEST), encoding='utf-8') as file:
+                self.manifest = json.load(file)
+        except (OSError, ValueError):
+            self.manifest = {}
+
+    def save_manifest(self):
+        """
+        Writes the manifest (in a temporary file first, so that it is never left half written).
+        """
+        os.makedirs(self.output, exist_ok=True)
+        path = os.path.join(self.output, MANIFEST)
+        with open(path + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump(self.manifest, file, indent=1)
+        os.replace(path + '.tmp', path)
+
+    def save_runs(self, runs):
+        """
+        Records the pending runs in the catalog, in one transaction, and empties the list.
+
+        Args:
+            runs (list): Runs (see describe_run).
+        """
+        if self.catalog is not None and runs:
+            self.catalog.add_runs(runs)
+        runs.clear()
+
+    def discover(self):
+        """
+        Walks the archive for the CSV files and spectrum stores of the slit directories.
+
+        Returns:
+            list: Files (dict with relative path, source, output, slit and date).
+        """
+        files = []
+        for root in self.roots:
+            for directory, directories, file_names in os.walk(root):
+                directories.sort()
+                if os.path.abspath(directory).startswith(self.output):
+                    directories[:] = []
+                    continue
+                parts = os.path.relpath(directory, root).split(os.sep)
+                days = [i for i, part in enumerate(parts) if DAY_DIRECTORY.match(part)]
+                if not days or days[-1] + 1 >= len(parts) or not SLIT_DIRECTORY.match(parts[days[-1] + 1]):
+                    continue
+                date = DAY_DIRECTORY.match(parts[days[-1]])['date']
+                slit = normalize_slit(parts[days[-1] + 1])
+                for file_name in sorted(file_names):
+                    if not file_name.lower().endswith(('.csv', EXTENSION)):
+                        continue
+                    # Result in CSV (x.v634 -> x.v634.csv, no collision with an export x.csv)
+                    relative_path = os.path.join(os.path.basename(root), os.path.relpath(directory, root),
+                                                 file_name if file_name.lower().endswith('.csv') else file_name + '.csv')
+                    files.append({'relative_path': relative_path, 'source': os.path.join(directory, file_name),
+                                  'output': os.path.join(self.output, relative_path), 'slit': slit, 'date': date})
+        return files
+
+    def tasks(self, files, check='mtime'):
+        """
+        Selects the files to process: the files whose record in the manifest does not match
+        (other pipeline, size or modification time, output missing) and, with a catalog, the
+        files not recorded in it yet. With check='hash', the files with the same modification
+        time are hashed too.
+
+        Args:
+            files (list): Files of the archive (see discover).
+            check (str): 'mtime' or 'hash'.
+
+        Returns:
+            tuple: Tasks for process_task, number of files up to date.
+        """
+        config = self.pipeline.config()
+        catalogued = self.catalog.paths() if self.catalog is not None else None
+        tasks, up_to_date = [], 0
+        for file in files:
+            status = os.stat(file['source'])
+            record = self.manifest.get(file['relative_path'])
+            same_pipeline = record is not None and record['config'] == config
+            catalog = catalogued is not None and file['source'] not in catalogued and (record is None 
+                                                                                        or record['status'] != 'skipped')
+            if (same_pipeline and check == 'mtime' and not catalog and record['size'] == status.st_size
+                    and record['mtime'] == status.st_mtime and (record['status'] == 'skipped' or os.path.exists(file['output']))):
+                up_to_date += 1
+                continue
+            recorded_sha256 = record['sha256'] if same_pipeline and (record['status'] == 'skipped'
+                                                                     or os.path.exists(file['output'])) else None
+            tasks.append(dict(file, size=status.st_size, mtime=status.st_mtime, recorded_sha256=recorded_sha256,
+                              catalog=self.catalog is not None))
+        return tasks, up_to_date
+
+    def run(self, check='mtime'):
+        """
+        Processes the archive. The results are written as they are produced and the manifest
+        is saved regularly: an interrupted run resumes where it stopped.
+
+        Args:
+            check (str): 'mtime' or 'hash' (see tasks).
+
+        Returns:
+            dict: Number of files of each status.
+        """
+        tasks, up_to_date = self.tasks(self.discover(), check)
+        counts = {'up to date': up_to_date, 'processed': 0, 'unchanged': 0, 'skipped': 0, 'failed': 0}
+        config = self.pipeline.config()
+        runs = []
+        start = time.monotonic()
+        with concurrent.futures.ProcessPoolExecutor(self.workers, initializer=init_worker, initargs=(config,)) as pool:
+            futures = [pool.submit(process_task, task) for task in tasks]
+            for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                result = future.result()
+                counts[result['status']] += 1
+                if result['status'] == 'failed':
+                    print(f"{result['relative_path']} : {result['error']}")
+                else:
+                    self.manifest[result['relative_path']] = {'size': result['size'], 'mtime': result['mtime'],
+                                                              'sha256': result['sha256'], 'status': result['status'],
+                                                              'config': config}
+                    if 'run' in result:
+                        runs.append(result['run'])
+                if done % self.save_every == 0:
+                    self.save_runs(runs)
+                    self.save_manifest()
+        self.save_runs(runs)
+        self.save_manifest()
+        print(f"{len(tasks)} files examined in {time.monotonic() - start:.1f} s : {counts}")
+        return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reprocessing of the archive of spectra of the VARIAN 634")
+    parser.add_argument('roots', nargs='+', help="directories of the archive (experiments/, raw_data/...)")
+    parser.add_argument('--output', required=True, help="directory of the results and of the manifest")
+    parser.add_argument('--baseline', default='library', choices=['library', 'aspls', 'none'])
+    parser.add_argument('--baseline-directory', default=None, help="baseline files (experiments/calibrage by default)")
+    parser.add_argument('--window-length', type=int, default=35, help="Savitzky-Golay window (0: no smoothing)")
+    parser.add_argument('--polyorder', type=int, default=2)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--check', default='mtime', choices=['mtime', 'hash'],
+                        help="hash: also hash the files whose modification time is unchanged")
+    parser.add_argument('--catalog', default=None, help="SQLite catalog of the experiments to fill (echantillons.db)")
+    arguments = parser.parse_args()
+
+    PIPELINE = SpectrumPipeline(arguments.baseline, arguments.window_length, arguments.polyorder,
+                                arguments.baseline_directory)
+    CATALOG = ExperimentCatalog(arguments.catalog) if arguments.catalog else None
+    ArchiveProcessor(arguments.roots, arguments.output, PIPELINE, arguments.workers, catalog=CATALOG).run(arguments.check)
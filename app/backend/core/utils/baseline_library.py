@@ -0,0 +1,168 @@
+"""
+Library of the baselines of the VARIAN 634 (experiments/calibrage/ligne_de_base_DD_MM_YYYY_fente_X.csv):
+absorbance measured without cuvette for each slit, fitted by a polynomial (best_polyfit).
+
+The files are indexed by slit and date once. Each baseline is read and fitted once, and
+its evaluations on the wavelength grids of the scans are kept in an LRU cache: correcting
+a spectrum only costs the subtraction of a ready-made baseline vector.
+"""
+
+import functools
+import os
+import re
+import numpy as np
+
+from core.utils.calibration import parse_date, normalize_slit
+from core.utils.digital_signal_processing import SignalProcessingVarian634
+from core.utils.lazy_import import LazyImport
+
+# Heavy packages imported on first use (fast start of the server)
+pd = LazyImport('pandas')
+savgol_filter = LazyImport('scipy.signal', 'savgol_filter')
+
+
+BASELINE_DIRECTORY = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', '..', 'experiments', 'calibrage'))
+BASELINE_FILE = re.compile(r'ligne_de_base_(?P<date>\d{2}_\d{2}_\d{4})_(?P<slit>fente_[0-9_]+nm)(?:_(?P<variant>.+))?\.csv$')
+
+
+class BaselineLibrary:
+    """
+    Baselines of the slits, indexed by slit and date.
+
+    Attributes:
+        directory (str): Directory of the baseline files.
+        entries (list): Baseline files (dict with path, date, slit and variant, e.g. 'no_UV').
+        signal_processing (SignalProcessingVarian634): Polynomial fits.
+    """
+
+    def __init__(self, directory=BASELINE_DIRECTORY, cache_size=256):
+        """
+        Args:
+            directory (str): Directory of the baseline files (experiments/calibrage by default).
+            cache_size (int): Number of (baseline, wavelength grid) evaluations kept in cache.
+        """
+        self.directory = directory
+        self.signal_processing = SignalProcessingVarian634()
+        self.entries = []
+        self.model = functools.lru_cache(maxsize=None)(self.fit_model)
+        self.evaluation = functools.lru_cache(maxsize=cache_size)(self.evaluate_model)
+        self.index()
+
+    def index(self):
+        """
+        Indexes the baseline files of the directory (and clears the caches).
+        """
+        self.entries = []
+        if os.path.isdir(self.directory):
+            for file_name in sorted(os.listdir(self.directory)):
+                match = BASELINE_FILE.match(file_name)
+                if match:
+                    self.entries.append({'path': os.path.join(self.directory, file_name),
+                                         'date': parse_date(match['date']), 'slit': normalize_slit(match['slit']),
+                                         'variant': match['variant']})
+        self.model.cache_clear()
+        self.evaluation.cache_clear()
+
+    def find(self, slit, date=None, variant=None):
+        """
+        Baseline of an experiment: the most recent baseline of its slit measured before its date.
+
+        Args:
+            slit (str): Slit of the experiment ('Fente_2nm', 'fente_0_2nm'...).
+            date (str or datetime.date): Date of the experiment (no limit by default).
+            variant (str): Variant of the baseline (e.g. 'no_UV', None for the standard one).
+
+        Returns:
+            str: Path of the baseline file.
+
+        Raises:
+            LookupError: No baseline of the slit before the date.
+        """
+        slit, date = normalize_slit(slit), parse_date(date)
+        candidates = [entry for entry in self.entries if entry['slit'] == slit and entry['variant'] == variant
+                      and (date is None or entry['date'] <= date)]
+        if not candidates:
+            raise LookupError(f"No baseline of the slit {slit} before {date} in {self.directory}")
+        return max(candidates, key=lambda entry: entry['date'])['path']
+
+    def load(self, path):
+        """
+        Reads a baseline file: wavelengths (first column) and absorbance column, or voltages 
+        of the photodiodes (absorbance log10(V2/V1)).
+
+        Args:
+            path (str): Baseline file.
+
+        Returns:
+            tuple: Wavelengths and absorbance of the baseline (arrays).
+        """
+        data = pd.read_csv(path, encoding='ISO-8859-1')
+        absorbance_columns = [column for column in data.columns if column.startswith('Absorbance')]
+        if absorbance_columns:
+            return data.iloc[:, 0].to_numpy(dtype=float), data[absorbance_columns[0]].to_numpy(dtype=float)
+        absorbance = np.log10(data["Tension photodiode 2 (Volt)"].to_numpy(dtype=float)
+                              / data["Tension photodiode 1 (Volt)"].to_numpy(dtype=float))
+        return data.iloc[:, 0].to_numpy(dtype=float), absorbance
+
+    def fit_model(self, path):
+        """
+        Fits a baseline (cached by the attribute model).
+
+        Args:
+            path (str): Baseline file.
+
+        Returns:
+            array: Coefficients of the baseline, highest degree first.
+        """
+        wavelength, absorbance = self.load(path)
+        valid = np.isfinite(absorbance)
+        return self.signal_processing.best_polyfit(wavelength[valid], absorbance[valid])
+
+    def evaluate_model(self, path, grid_bytes):
+        """
+        Evaluates a baseline on a wavelength grid (cached by the attribute evaluation).
+
+        Args:
+            path (str): Baseline file.
+            grid_bytes (bytes): Wavelength grid (float64 array as bytes, hashable).
+
+        Returns:
+            array: Baseline on the grid (read only, shared by the cache).
+        """
+        baseline = np.polyval(self.model(path), np.frombuffer(grid_bytes, dtype=float))
+        baseline.setflags(write=False)
+        return baseline
+
+    def baseline(self, slit, wavelength, date=None, variant=None):
+        """
+        Args:
+            slit (str): Slit of the experiment.
+            wavelength (array): Wavelength grid of the scan.
+            date (str or datetime.date): Date of the experiment.
+            variant (str): Variant of the baseline.
+
+        Returns:
+            array: Baseline absorbance on the grid (read only).
+        """
+        grid = np.ascontiguousarray(wavelength, dtype=float)
+        return self.evaluation(self.find(slit, date, variant), grid.tobytes())
+
+    def correct(self, slit, wavelength, absorbances, date=None, variant=None, window_length=35, polyorder=2):
+        """
+        Subtracts the baseline of the slit from spectra on a wavelength grid and smooths
+        them (Savitzky-Golay), as baseline_correction_polyfit.
+
+        Args:
+            slit (str): Slit of the experiment.
+            wavelength (array): Wavelength grid of the spectra (n_points).
+            absorbances (array): Absorbance of the spectra (n_points or n_spectra x n_points).
+            date (str or datetime.date): Date of the experiment.
+            variant (str): Variant of the baseline.
+            window_length (int): Window of the Savitzky-Golay filter.
+            polyorder (int): Order of the Savitzky-Golay filter.
+
+        Returns:
+            array: Corrected absorbance, same shape as absorbances.
+        """
+        corrected = np.asarray(absorbances, dtype=float) - self.baseline(slit, wavelength, date, variant)
+        return savgol_filter(corrected, window_length=window_length, polyorder=polyorder, deriv=0, delta=0.01, axis=-1)
@@ -0,0 +1,283 @@
+"""
+Wavelength calibration of the VARIAN 634: relation between the course of the screw of the
+diffraction grating (mm from its origin) and the wavelength selected (nm).
+
+A calibration is a polynomial (linear for the calibration of the instrument) with the
+standard deviation of each coefficient (see ecart_type.py). The calibrations are kept in
+a registry by date and slit: an experiment uses the most recent calibration made before
+its date, for its slit if there is one.
+
+The evaluations work on whole numpy arrays. The inverse relation (course of a wavelength)
+is a lookup table computed once per calibration and interpolated.
+
+The calibrations measured on the instrument are read from experiments/calibrage/calibrations.json
+(see CalibrationRegistry.save) when the file exists, in addition to DEFAULT_CALIBRATION.
+"""
+
+import datetime
+import json
+import os
+import numpy as np
+
+
+DATE_FORMAT = '%d_%m_%Y'  # Format of the dates of the experiments (experiments_DD_MM_YYYY)
+CALIBRATION_FILE = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', '..', 'experiments', 'calibrage', 'calibrations.json'))
+
+
+def parse_date(date):
+    """
+    Args:
+        date (str, datetime.date or None): Date, as a string DD_MM_YYYY or YYYY-MM-DD.
+
+    Returns:
+        datetime.date: The date (None if date is None).
+    """
+    if date is None or isinstance(date, datetime.date):
+        return date
+    for date_format in (DATE_FORMAT, '%Y-%m-%d'):
+        try:
+            return datetime.datetime.strptime(date, date_format).date()
+        except ValueError:
+            pass
+    raise ValueError(f"Date {date} is not in the format DD_MM_YYYY or YYYY-MM-DD")
+
+
+def normalize_slit(slit):
+    """
+    Args:
+        slit (str or None): Name of the slit ('Fente_2nm', 'fente_0_2nm', '0.2nm', '1nm'...).
+
+    Returns:
+        str: Name of the slit in lower case with the 'fente_' prefix ('fente_2nm', 'fente_0_2nm'), 
+            None if slit is None.
+    """
+    if slit is None:
+        return None
+    slit = slit.strip().lower().replace('.', '_')
+    return slit if not slit or slit.startswith('fente_') else 'fente_' + slit
+
+
+class WavelengthCalibration:
+    """
+    Calibration wavelength = polynomial(course of the screw).
+
+    Attributes:
+        coefficients (array): Coefficients of the polynomial, highest degree first (np.polyval).
+        coefficients_std (array): Standard deviation of each coefficient.
+        date (datetime.date): Date of the calibration (None: valid since always).
+        slit (str): Slit of the calibration (None: valid for every slit).
+        course_range (tuple): Range of the course of the screw in mm (tables of the inverse relation).
+        table_resolution (float): Step of the tables of the inverse relation in mm.
+        inverse_tables (list): Table of the inverse relation on each monotonic branch of the 
+            polynomial over course_range (a single one for a monotonic calibration), None until 
+            first use.
+    """
+
+    def __init__(self, coefficients, coefficients_std=None, date=None, slit=None, course_range=(0.0, 26.0),
+                 table_resolution=1e-4):
+        """
+        Args:
+            coefficients (list): Coefficients of the polynomial, highest degree first.
+            coefficients_std (list): Standard deviation of each coefficient (0 by default).
+            date (str or datetime.date): Date of the calibration.
+            slit (str): Slit of the calibration.
+            course_range (tuple): Range of the course of the screw in mm (26 mm: course maxi).
+            table_resolution (float): Step of the table of the inverse relation in mm.
+        """
+        self.coefficients = np.asarray(coefficients, dtype=float)
+        self.coefficients_std = (np.zeros_like(self.coefficients) if coefficients_std is None
+                                 else np.asarray(coefficients_std, dtype=float))
+        self.date = parse_date(date)
+        self.slit = normalize_slit(slit)
+        self.course_range = course_range
+        self.table_resolution = table_resolution
+        self.inverse_tables = None
+
+    def wavelength(self, course):
+        """
+        Args:
+            course (float or array): Course of the screw in mm.
+
+        Returns:
+            float or array: Wavelength in nm.
+        """
+        return np.polyval(self.coefficients, np.asarray(course, dtype=float))
+
+    def wavelength_std(self, course):
+        """
+        Standard deviation of the wavelength due to the uncertainty of the coefficients
+        (independent): std(y)^2 = sum((x^k)^2 * std(c_k)^2).
+
+        Args:
+            course (float or array): Course of the screw in mm.
+
+        Returns:
+            float or array: Standard deviation of the wavelength in nm.
+        """
+        course = np.asarray(course, dtype=float)
+        powers = np.arange(len(self.coefficients) - 1, -1, -1)
+        variance = sum((course**power * std)**2 for power, std in zip(powers, self.coefficients_std))
+        return np.sqrt(variance)
+
+    def tables(self):
+        """
+        Tables of the inverse relation on the monotonic branches of the polynomial over the 
+        course range, computed on first use.
+
+        Returns:
+            list: Wavelengths (increasing) and courses of the table of each branch.
+        """
+        if self.inverse_tables is None:
+            courses = np.arange(self.course_range[0], self.course_range[1] + self.table_resolution / 2,
+                                self.table_resolution)
+            wavelengths = self.wavelength(courses)
+            increasing = np.diff(wavelengths) > 0
+            # A branch ends where the slope changes sign (end sample shared with the next branch)
+            ends = np.concatenate(([0], np.flatnonzero(increasing[1:] != increasing[:-1]) + 1, [len(increasing)]))
+            self.inverse_tables = []
+            for start, end in zip(ends[:-1], ends[1:]):
+                branch_courses, branch_wavelengths = courses[start:end + 1], wavelengths[start:end + 1]
+                if not increasing[start]:
+                    branch_courses, branch_wavelengths = branch_courses[::-1], branch_wavelengths[::-1]
+                self.inverse_tables.append((branch_wavelengths, branch_courses))
+        return self.inverse_tables
+
+    def table(self, wavelength=None):
+        """
+        Table of the inverse relation of the monotonic branch which holds the wavelengths 
+        (the longest one when several do). The calibration only needs to be monotonic over 
+        the wavelengths used.
+
+        Args:
+            wavelength (float or array): Wavelengths in nm (longest branch by default).
+
+        Returns:
+            tuple: Wavelengths (increasing) and courses of the table.
+
+        Raises:
+            ValueError: No monotonic branch of the calibration holds all the wavelengths.
+        """
+        tables = self.tables()
+        if wavelength is not None and len(tables) > 1:
+            lowest, highest = np.min(wavelength), np.max(wavelength)
+            tables = [table for table in tables if table[0][0] <= lowest and highest <= table[0][-1]]
+            if not tables:
+                raise ValueError(f"The wavelength calibration is not monotonic between {lowest} and {highest} nm")
+        return max(tables, key=lambda table: len(table[1]))
+
+    def course(self, wavelength):
+        """
+        Course of the screw selecting a wavelength (interpolated in the table of the
+        inverse relation, extrapolated linearly outside of it). A calibration which is not 
+        monotonic over the course range is inverted on the branch holding the wavelengths.
+
+        Args:
+            wavelength (float or array): Wavelength in nm.
+
+        Returns:
+            float or array: Course of the screw in mm.
+        """
+        wavelength = np.asarray(wavelength, dtype=float)
+        wavelengths, courses = self.table(wavelength)
+        course = np.interp(wavelength, wavelengths, courses)
+        # Linear extrapolation with the slope at each end of the table
+        below, above = wavelength < wavelengths[0], wavelength > wavelengths[-1]
+        if np.any(below) or np.any(above):
+            slope_start = (courses[1] - courses[0]) / (wavelengths[1] - wavelengths[0])
+            slope_end = (courses[-1] - courses[-2]) / (wavelengths[-1] - wavelengths[-2])
+            course = np.where(below, courses[0] + (wavelength - wavelengths[0]) * slope_start, course)
+            course = np.where(above, courses[-1] + (wavelength - wavelengths[-1]) * slope_end, course)
+        return course if course.ndim else float(course)
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: The calibration, serializable in JSON.
+        """
+        return {'coefficients': self.coefficients.tolist(), 'coefficients_std': self.coefficients_std.tolist(),
+                'date': None if self.date is None else self.date.strftime(DATE_FORMAT), 'slit': self.slit}
+
+
+class CalibrationRegistry:
+    """
+    Wavelength calibrations by date and slit.
+
+    Attributes:
+        calibrations (list): Registered calibrations (WavelengthCalibration).
+    """
+
+    def __init__(self, calibrations=()):
+        """
+        Args:
+            calibrations (list): Initial calibrations (WavelengthCalibration).
+        """
+        self.calibrations = list(calibrations)
+
+    def register(self, calibration):
+        """
+        Args:
+            calibration (WavelengthCalibration): Calibration to add.
+        """
+        self.calibrations.append(calibration)
+
+    def get(self, date=None, slit=None):
+        """
+        Calibration of an experiment: the most recent calibration made before its date,
+        for its slit if there is one at this date, valid for every slit otherwise.
+
+        Args:
+            date (str or datetime.date): Date of the experiment (today by default).
+            slit (str): Slit of the experiment.
+
+        Returns:
+            WavelengthCalibration: The calibration.
+
+        Raises:
+            LookupError: No calibration is valid for the experiment.
+        """
+        date = parse_date(date) or datetime.date.today()
+        slit = normalize_slit(slit)
+        candidates = [calibration for calibration in self.calibrations
+                      if (calibration.date is None or calibration.date <= date)
+                      and (calibration.slit is None or calibration.slit == slit)]
+        if not candidates:
+            raise LookupError(f"No wavelength calibration for the date {date} and the slit {slit}")
+        return max(candidates, key=lambda calibration: (calibration.date or datetime.date.min,
+                                                        calibration.slit is not None))
+
+    def load(self, path):
+        """
+        Registers the calibrations of a JSON file (list of WavelengthCalibration.to_dict), 
+        except those already registered.
+
+        Args:
+            path (str): JSON file of calibrations.
+        """
+        registered = [calibration.to_dict() for calibration in self.calibrations]
+        with open(path, encoding='utf-8') as file:
+            for data in json.load(file):
+                calibration = WavelengthCalibration(data['coefficients'], data.get('coefficients_std'),
+                                                    data.get('date'), data.get('slit'))
+                if calibration.to_dict() not in registered:
+                    self.register(calibration)
+                    registered.append(calibration.to_dict())
+
+    def save(self, path):
+        """
+        Writes the calibrations in a JSON file, except DEFAULT_CALIBRATION (registered at 
+        the import of the module).
+
+        Args:
+            path (str): JSON file of calibrations.
+        """
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump([calibration.to_dict() for calibration in self.calibrations 
+                       if calibration is not DEFAULT_CALIBRATION], file, indent=4)
+
+
+# Calibration of the instrument (see ecart_type.py): wavelength = a * course + b
+DEFAULT_CALIBRATION = WavelengthCalibration([-32.02, 886.13], [0.26, 2.70])
+
+CALIBRATIONS = CalibrationRegistry([DEFAULT_CALIBRATION])
+if os.path.exists(CALIBRATION_FILE):
+    CALIBRATIONS.load(CALIBRATION_FILE)
@@ -3,11 +3,18 @@ This program will reduce the noise from the photodiode
 """
 
 import numpy as np
-from scipy.interpolate import UnivariateSpline
-import matplotlib.pyplot as plt
-import pandas as pd
-from scipy.signal import hilbert, savgol_filter, find_peaks
-from pybaselines import Baseline
+
+from core.utils.calibration import CALIBRATIONS
+from core.utils.lazy_import import LazyImport
+
+# Heavy packages imported on first use (fast start of the server)
+UnivariateSpline = LazyImport('scipy.interpolate', 'UnivariateSpline')
+plt = LazyImport('matplotlib.pyplot')
+pd = LazyImport('pandas')
+hilbert = LazyImport('scipy.signal', 'hilbert')
+savgol_filter = LazyImport('scipy.signal', 'savgol_filter')
+find_peaks = LazyImport('scipy.signal', 'find_peaks')
+Baseline = LazyImport('pybaselines', 'Baseline')
 
 
 
@@ -17,24 +24,99 @@ class SignalProcessingVarian634:
 
     """
 
-    def __init__(self):
-        pass
+    def __init__(self, calibration=None):
+        """
+        Parameters:
+            calibration (WavelengthCalibration): Wavelength calibration (calibration of the 
+                instrument by default, see CalibrationRegistry).
+        """
+        self.calibration = calibration if calibration is not None else CALIBRATIONS.get()
 
 # Tools Signal processing
     def calculate_wavelength(self, position):
         """
-        Calculates the wavelength based on the position.
+        Calculates the wavelength based on the position (float or array).
         Formule déterminé grâce au calibrage
         """
-        return -32.02 * position + 886.13
+        return self.calibration.wavelength(position)
     
     def calculate_course(self, wavelength):
         """
-        Calculates the wavelength based on the position.
+        Calculates the course of the screw based on the wavelength (float or array).
         abs pour que GBRL est des valeurs positive de position cela 
         évite l'initialisé dans le sens inverse
         """
-        return np.abs((wavelength - 884.13)/-32.02)
+        return np.abs(self.calibration.course(wavelength))
+
+    def resample_on_grid(self, data_x, data_y, grid, return_standard_error=False):
+        """
+        Averages the points (data_x, data_y) in bins centred on a regular grid.
+
+        Grid points without any data in their bin are linearly interpolated.
+
+        Parameters:
+            data_x (array): x-axis data (e.g. screw position of each lamp pulse).
+            data_y (array): y-axis data (e.g. voltage of each lamp pulse).
+            grid (array): Regular and increasing grid on which the data are averaged.
+            return_standard_error (bool): Also return the standard error of each mean 
+                (NaN for the bins with less than two points).
+
+        Returns:
+            array: Mean of data_y in each bin of the grid (and the standard errors).
+        """
+        data_x = np.asarray(data_x)
+        data_y = np.asarray(data_y)
+        grid = np.asarray(grid)
+        half_step = (grid[1] - grid[0]) / 2
+        edges = np.append(grid - half_step, grid[-1] + half_step)
+        index = np.digitize(data_x, edges) - 1
+        inside = (index >= 0) & (index < len(grid))
+        counts = np.bincount(index[inside], minlength=len(grid))
+        sums = np.bincount(index[inside], weights=data_y[inside], minlength=len(grid))
+        filled = counts > 0
+        resampled = np.empty(len(grid))
+        resampled[filled] = sums[filled] / counts[filled]
+        resampled[~filled] = np.interp(grid[~filled], grid[filled], resampled[filled])
+        if not return_standard_error:
+            return resampled
+        sums_squares = np.bincount(index[inside], weights=data_y[inside]**2, minlength=len(grid))
+        standard_error = np.full(len(grid), np.nan)
+        several = counts > 1
+        variance = (sums_squares[several] - counts[several] * resampled[several]**2) / (counts[several] - 1)
+        standard_error[several] = np.sqrt(np.maximum(variance, 0) / counts[several])
+        return resampled, standard_error
+
+    def regions_of_interest(self, wavelength, absorbance, prominence=0.02, threshold=3):
+        """
+        Finds the points of a coarse spectrum around which a fine scan is worthwhile.
+
+        A point is of interest if it is an absorbance peak (find_peaks with the given 
+        prominence) or if the gradient or the curvature of the absorbance exceed 
+        `threshold` times their median value over the spectrum.
+
+        Parameters:
+            wavelength (array): Wavelengths of the coarse spectrum.
+            absorbance (array): Absorbance of the coarse spectrum.
+            prominence (float): Minimum prominence of the absorbance peaks.
+            threshold (float): Factor applied to the median gradient and curvature.
+
+        Returns:
+            array: Boolean mask of the points of interest.
+        """
+        wavelength = np.asarray(wavelength)
+        absorbance = np.asarray(absorbance)
+        interest = np.zeros(len(absorbance), dtype=bool)
+        if len(absorbance) < 3:
+            interest[:] = True
+            return interest
+
+        peaks, _ = find_peaks(absorbance, prominence=prominence)
+        interest[peaks] = True
+        gradient = np.abs(np.gradient(absorbance, wavelength))
+        curvature = np.abs(np.gradient(np.gradient(absorbance, wavelength), wavelength))
+        interest |= gradient > threshold * np.median(gradient)
+        interest |= curvature > threshold * np.median(curvature)
+        return interest
 
     def graph_digital_processing(self, data_x, datas_y, title_graph, titles_data_y):
         """
@@ -63,33 +145,92 @@ class SignalProcessingVarian634:
 
 # Mathematical tools
         
+    def polyfit_batch(self, x, spectra, max_degree=2):
+        """
+        Least squares polynomial fits of degree 0 to max_degree of several spectra sampled 
+        on the same x, from a single QR factorisation of the Vandermonde matrix.
+
+        The columns of Q span the polynomials of increasing degree: the fits of all the 
+        degrees are the leading blocks of the same triangular system, and their residuals 
+        follow from the projections Q^T y.
+
+        Parameters:
+            x (array): Shared x-axis data (n_points).
+            spectra (array): y-axis data (n_spectra x n_points, or n_points for one spectrum).
+            max_degree (int): Highest degree of the fits.
+
+        Returns:
+            tuple: Coefficients (n_degrees x n_spectra x (max_degree + 1), highest degree first 
+                as np.polyval, zero-padded) and R^2 of the fits (n_degrees x n_spectra, NaN for 
+                a constant spectrum).
+        """
+        x = np.asarray(x, dtype=float)
+        spectra = np.atleast_2d(np.asarray(spectra, dtype=float))
+        vandermonde = np.vander(x, max_degree + 1, increasing=True)
+        # Scaling of the columns for the conditioning of the factorisation
+        scale = np.linalg.norm(vandermonde, axis=0)
+        scale[scale == 0] = 1
+        q, r = np.linalg.qr(vandermonde / scale)
+        projections = q.T @ spectra.T  # (max_degree + 1) x n_spectra
+
+        ss_tot = np.sum((spectra - spectra.mean(axis=1, keepdims=True))**2, axis=1)
+        ss_y = np.sum(spectra**2, axis=1)
+        coefficients = np.zeros((max_degree + 1, len(spectra), max_degree + 1))
+        r2 = np.empty((max_degree + 1, len(spectra)))
+        for degree in range(max_degree + 1):
+            size = degree + 1
+            solution = np.linalg.solve(r[:size, :size], projections[:size]) / scale[:size, None]
+            coefficients[degree, :, max_degree - degree:] = solution[::-1].T
+            ss_res = np.maximum(ss_y - np.sum(projections[:size]**2, axis=0), 0)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                r2[degree] = np.where(ss_tot > 0, 1 - ss_res / ss_tot, np.nan)
+        return coefficients, r2
+
+    def best_polyfit_batch(self, x, spectra, max_degree=2):
+        """
+        Polynomial fit of degree 0 to max_degree with the best R^2 for each spectrum 
+        (degree 0 for a constant spectrum).
+
+        Parameters:
+            x (array): Shared x-axis data (n_points).
+            spectra (array): y-axis data (n_spectra x n_points).
+            max_degree (int): Highest degree of the fits.
+
+        Returns:
+            array: Coefficients of each spectrum (n_spectra x (max_degree + 1), highest degree first).
+        """
+        coefficients, r2 = self.polyfit_batch(x, spectra, max_degree)
+        best_degree = np.argmax(np.nan_to_num(r2, nan=-np.inf), axis=0)
+        return coefficients[best_degree, np.arange(coefficients.shape[1])]
+
+    def polyval_batch(self, coefficients, x):
+        """
+        Evaluates several polynomials on the same x.
+
+        Parameters:
+            coefficients (array): Coefficients (n_spectra x (degree + 1), highest degree first).
+            x (array): x-axis data (n_points).
+
+        Returns:
+            array: Values (n_spectra x n_points).
+        """
+        coefficients = np.atleast_2d(coefficients)
+        return (np.vander(np.asarray(x, dtype=float), coefficients.shape[1]) @ coefficients.T).T
+
     def best_polyfit(self, x, y):
-        best_r2 = -np.inf
-        best_coefficients = None
-        x = np.array(x)
-        y = np.array(y)
-        
-        for degree in range(3):
-            coefficients = np.polyfit(x, y, degree)
-            # Ensure coefficients are array-like
-            coefficients = np.atleast_1d(coefficients)
-            
-            fitted_values = np.polyval(coefficients, x)
-            residuals = y - fitted_values
-            ss_res = np.sum(residuals ** 2)
-            ss_tot = np.sum((y - np.mean(y)) ** 2)
-            
-            # Handle case where ss_tot is zero
-            if ss_tot == 0:
-                r2 = float('nan')  # or some other value indicating an undefined R^2
-            else:
-                r2 = 1 - (ss_res / ss_tot)
-            
-            if r2 > best_r2:
-                best_r2 = r2
-                best_coefficients = coefficients
-        
-        return best_coefficients
+        """
+        Polynomial fit of degree 0 to 2 with the best R^2 (see best_polyfit_batch).
+
+        Parameters:
+            x (array): x-axis data.
+            y (array): y-axis data.
+
+        Returns:
+            array: Coefficients, highest degree first.
+        """
+        coefficients, r2 = self.polyfit_batch(x, y)
+        best_degree = int(np.argmax(np.nan_to_num(r2[:, 0], nan=-np.inf)))
+        return coefficients[best_degree, 0, len(r2) - 1 - best_degree:]
     
     def fourier_transform(self, signal):
         """
@@ -202,39 +343,63 @@ class SignalProcessingVarian634:
         Returns:
         - list: La liste d'absorbance ajustée.
         """
-        # Vérifie si baseline et absorbance ont la même longueur
-        
-        baseline_fitter = Baseline(wavelength, check_finite=False)
-        baseline = baseline_fitter.aspls(list(absorbance), 1e6)[0]
-        if len(baseline) != len(absorbance):
+        return self.baseline_correction_aspls_batch(wavelength, [absorbance])[0]
+
+    def baseline_correction_aspls_batch(self, wavelength, absorbances, window_length=11, polyorder=3):
+        """
+        Retire la baseline (aspls) de plusieurs spectres sur la même grille de longueurs 
+        d'onde puis les lisse (Savitzky-Golay). Le même ajusteur pybaselines sert à tous 
+        les spectres.
+
+        Parameters:
+        - wavelength (array): Grille de longueurs d'onde commune (n_points).
+        - absorbances (array): Absorbances (n_spectres x n_points).
+        - window_length (int): Fenêtre du filtre de Savitzky-Golay.
+        - polyorder (int): Ordre du filtre de Savitzky-Golay.
+
+        Returns:
+        - array: Absorbances ajustées (n_spectres x n_points).
+        """
+        absorbances = np.atleast_2d(np.asarray(absorbances, dtype=float))
+        if absorbances.shape[1] != len(wavelength):
             raise ValueError("baseline et absorbance doivent avoir la même longueur")
-        
-        # Ajuste l'absorbance en fonction de la valeur de baseline
-        adjusted_absorbance = []
-        for base, abs_val in zip(baseline, absorbance):            
-                adjusted_absorbance.append(abs_val - base)
-            
-        absorbance_fit = savgol_filter(adjusted_absorbance, window_length=11, polyorder=3, deriv=0, delta=0.01)
-
-        return absorbance_fit
-    
+        baseline_fitter = Baseline(wavelength, check_finite=False)
+        baselines = np.array([baseline_fitter.aspls(absorbance, 1e6)[0] for absorbance in absorbances])
+        return savgol_filter(absorbances - baselines, window_length=window_length, polyorder=polyorder, 
+                             deriv=0, delta=0.01, axis=1)
 
     def baseline_correction_polyfit(self, wavelength_baseline, absorbance_baseline, wavelenght, absorbance):
         """
-        
+        Retire la baseline (meilleur ajustement polynomial de la ligne de base) d'un spectre 
+        puis le lisse (voir baseline_correction_polyfit_batch).
+        """
+        return self.baseline_correction_polyfit_batch(wavelength_baseline, absorbance_baseline, 
+                                                      wavelenght, [absorbance])[0]
+
+    def baseline_correction_polyfit_batch(self, wavelength_baseline, absorbance_baselines, wavelength, absorbances, 
+                                          window_length=35, polyorder=2):
         """
-        wavelenght_baseline = np.array(wavelength_baseline)
-        absorbance_baseline = np.array(absorbance_baseline)
-        wavelenght = np.array(wavelenght)
-        absorbance = np.array(absorbance)
-        coefficients = self.best_polyfit(wavelenght_baseline, absorbance_baseline)
-        baseline = np.polyval(coefficients, wavelenght)
-        adjusted_absorbance = []
-        for base, abs_val in zip(baseline, absorbance):            
-                adjusted_absorbance.append(abs_val - base)
+        Retire la baseline de plusieurs spectres sur la même grille de longueurs d'onde puis 
+        les lisse (Savitzky-Golay). La baseline est le meilleur ajustement polynomial (degré 0 
+        à 2) d'une ligne de base commune ou d'une ligne de base par spectre.
 
-        absorbance_fit = savgol_filter(adjusted_absorbance, window_length=35, polyorder=2, deriv=0, delta=0.01)
-        return absorbance_fit
+        Parameters:
+        - wavelength_baseline (array): Longueurs d'onde des lignes de base (n_points_base).
+        - absorbance_baselines (array): Absorbance de la ligne de base (n_points_base) ou des 
+          lignes de base de chaque spectre (n_spectres x n_points_base).
+        - wavelength (array): Grille de longueurs d'onde commune des spectres (n_points).
+        - absorbances (array): Absorbances (n_spectres x n_points).
+        - window_length (int): Fenêtre du filtre de Savitzky-Golay.
+        - polyorder (int): Ordre du filtre de Savitzky-Golay.
+
+        Returns:
+        - array: Absorbances ajustées (n_spectres x n_points).
+        """
+        absorbances = np.atleast_2d(np.asarray(absorbances, dtype=float))
+        coefficients = self.best_polyfit_batch(wavelength_baseline, absorbance_baselines)
+        baselines = self.polyval_batch(coefficients, wavelength)
+        return savgol_filter(absorbances - baselines, window_length=window_length, polyorder=polyorder, 
+                             deriv=0, delta=0.01, axis=1)
 
 
 
@@ -278,26 +443,23 @@ if __name__ == "__main__":
 # Sélection de la colonne et conversion en liste
     
     screw_raw = data["pas de vis (mm)"]
-    WAVELENGTH = np.array([signal_processing.calculate_wavelength(p+ 7.062148657089319)  for p in screw_raw]) 
+    WAVELENGTH = signal_processing.calculate_wavelength(np.asarray(screw_raw) + 7.062148657089319)
     absorbance_no_baseline = data["Absorbance"]
     WAVELENGTH_spectro = df[colonne_wave].tolist()
     absorbance_spectro = df[colonne_abs].tolist()
     print(WAVELENGTH)
 
-    file_baseline = "C:\\Users\\admin\\Desktop\\GitHub\\varian-634-app\\experiments\\calibrage\\ligne_de_base_23_02_2024_fente_1nm.csv" 
-    data_baseline = pd.read_csv(file_baseline, encoding='ISO-8859-1')
-    voltage_1_base = data_baseline["Tension photodiode 1 (Volt)"]
-    voltage_2_base = data_baseline["Tension photodiode 2 (Volt)"]
-    ABSORBANCE_BASELINE = np.log10(np.array(voltage_2_base)/np.array(voltage_1_base))
-    screw = data_baseline["pas de vis (mm)"]
-    WAVELENGTH_BASELINE = np.array([signal_processing.calculate_wavelength(p)  for p in screw]) 
+    from core.utils.baseline_library import BaselineLibrary
+    baseline_library = BaselineLibrary()
+    file_baseline = baseline_library.find("fente_1nm", "23_02_2024")
+    WAVELENGTH_BASELINE, ABSORBANCE_BASELINE = baseline_library.load(file_baseline)
         # Seuil de hauteur pour la détection des pics
     hauteur_seuil = 0.1
-    absor_fit = signal_processing.baseline_correction_polyfit(WAVELENGTH_BASELINE, ABSORBANCE_BASELINE, WAVELENGTH, absorbance_no_baseline)
+    absor_fit = baseline_library.correct("fente_1nm", WAVELENGTH, absorbance_no_baseline, "23_02_2024")
     # Trouver les indices et les propriétés des pics
     indices_pics, proprietes_pics = find_peaks(absor_fit, height=hauteur_seuil)
     indices_pics_spectro, proprietes_pics_spectro = find_peaks(absorbance_spectro, height=hauteur_seuil)
-    coefficients = signal_processing.best_polyfit(WAVELENGTH_BASELINE, ABSORBANCE_BASELINE)
+    coefficients = baseline_library.model(file_baseline)
     print("coefficients", coefficients)
     plt.plot(WAVELENGTH_BASELINE, ABSORBANCE_BASELINE, label='Absorbance ligne de base')
     plt.plot(WAVELENGTH_BASELINE, np.polyval(coefficients, WAVELENGTH_BASELINE), label='Régression')
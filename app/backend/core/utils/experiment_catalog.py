@@ -0,0 +1,212 @@
+"""
+SQLite catalog of the experiments of the VARIAN 634: one row per run (sample, slit, cuvette,
+date, mode, wavelength range, location of the file) and, optionally, its points.
+
+The database is in WAL mode (the server writes while the tools read), the points are
+inserted in bulk (executemany) and the runs are indexed by sample, slit and date, the
+points by run and wavelength: "all the Bromophenol scans at Fente_1nm in March" is a
+query instead of a walk of the directories.
+"""
+
+import json
+import os
+import sqlite3
+from contextlib import closing, contextmanager
+import numpy as np
+
+from core.utils.calibration import parse_date, normalize_slit
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    sample TEXT COLLATE NOCASE,
+    slit TEXT,
+    cuvette TEXT,
+    date TEXT,
+    mode TEXT,
+    wavelength_min REAL,
+    wavelength_max REAL,
+    wavelength_step REAL,
+    path TEXT UNIQUE,
+    points INTEGER,
+    metadata TEXT
+);
+CREATE TABLE IF NOT EXISTS points (
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    wavelength REAL,
+    absorbance REAL,
+    screw_position REAL
+);
+CREATE INDEX IF NOT EXISTS runs_sample_slit_date ON runs(sample, slit, date);
+CREATE INDEX IF NOT EXISTS runs_slit_date ON runs(slit, date);
+CREATE INDEX IF NOT EXISTS runs_date ON runs(date);
+CREATE INDEX IF NOT EXISTS points_run_wavelength ON points(run_id, wavelength);
+"""
+
+RUN_COLUMNS = ['sample', 'slit', 'cuvette', 'date', 'mode', 'wavelength_min', 'wavelength_max', 'wavelength_step',
+               'path', 'points', 'metadata']
+
+
+class ExperimentCatalog:
+    """
+    Catalog of the runs and their points.
+
+    Attributes:
+        path (str): SQLite database.
+    """
+
+    def __init__(self, path=None):
+        """
+        Creates the tables and indexes if needed.
+
+        Args:
+            path (str): SQLite database (echantillons.db in the working directory by default).
+        """
+        self.path = path if path is not None else os.path.join(os.getcwd(), 'echantillons.db')
+        with self.connection() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+
+    @contextmanager
+    def connection(self):
+        """
+        Connection for one transaction (committed at the end, rolled back on error). A
+        connection per transaction: the catalog is used from several threads and processes.
+
+        Yields:
+            sqlite3.Connection: The connection.
+        """
+        with closing(sqlite3.connect(self.path, timeout=30)) as connection:
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA foreign_keys=ON")
+            connection.execute("PRAGMA synchronous=NORMAL")  # Safe in WAL mode
+            with connection:
+                yield connection
+
+    @staticmethod
+    def run_row(run):
+        """
+        Args:
+            run (dict): Run (keys of RUN_COLUMNS, metadata as a dict, date as DD_MM_YYYY,
+                YYYY-MM-DD or datetime.date).
+
+        Returns:
+            tuple: Values of the columns of the table runs.
+        """
+        row = dict.fromkeys(RUN_COLUMNS)
+        row.update({key: value for key, value in run.items() if key in row})
+        row['slit'] = normalize_slit(row['slit'])
+        date = parse_date(row['date'])
+        row['date'] = None if date is None else date.isoformat()
+        row['path'] = None if row['path'] is None else os.path.abspath(row['path'])
+        row['metadata'] = json.dumps(row['metadata'] or {}, ensure_ascii=False, default=str)
+        return tuple(row[column] for column in RUN_COLUMNS)
+
+    @staticmethod
+    def point_rows(run_id, wavelength, absorbance, screw_position=None):
+        """
+        Returns:
+            iterator: Rows of the table points of a run.
+        """
+        wavelength = np.asarray(wavelength, dtype=float)
+        if screw_position is None:
+            screw_position = [None] * len(wavelength)
+        else:
+            screw_position = np.asarray(screw_position, dtype=float).astype(object)
+            screw_position[np.isnan(screw_position.astype(float))] = None  # NULL when unknown
+            screw_position = screw_position.tolist()
+        return zip([run_id] * len(wavelength), wavelength.tolist(), np.asarray(absorbance, dtype=float).tolist(),
+                   screw_position)
+
+    def add_runs(self, runs):
+        """
+        Records runs in one transaction. A run of a file already in the catalog replaces it
+        (and its points).
+
+        Args:
+            runs (list): Runs (dict, see run_row), with their points in the optional keys
+                'wavelength', 'absorbance' and 'screw_position' (arrays).
+
+        Returns:
+            list: Identifiers of the runs.
+        """
+        identifiers = []
+        with self.connection() as connection:
+            for run in runs:
+                row = self.run_row(dict(run, points=len(run['wavelength']) if 'wavelength' in run else run.get('points')))
+                if row[RUN_COLUMNS.index('path')] is not None:
+                    connection.execute("DELETE FROM runs WHERE path = ?", (row[RUN_COLUMNS.index('path')],))
+                cursor = connection.execute(f"INSERT INTO runs ({', '.join(RUN_COLUMNS)}) "
+                                            f"VALUES ({', '.join('?' * len(RUN_COLUMNS))})", row)
+                identifiers.append(cursor.lastrowid)
+                if 'wavelength' in run:
+                    connection.executemany("INSERT INTO points VALUES (?, ?, ?, ?)",
+                                           self.point_rows(cursor.lastrowid, run['wavelength'], run['absorbance'],
+                                                           run.get('screw_position')))
+        return identifiers
+
+    def add_run(self, **run):
+        """
+        Records a run (see add_runs).
+
+        Returns:
+            int: Identifier of the run.
+        """
+        return self.add_runs([run])[0]
+
+    def paths(self):
+        """
+        Returns:
+            set: Files of the runs of the catalog.
+        """
+        with self.connection() as connection:
+            return {row[0] for row in connection.execute("SELECT path FROM runs WHERE path IS NOT NULL")}
+
+    def find_runs(self, sample=None, slit=None, date_from=None, date_to=None, mode=None):
+        """
+        Runs matching all the given criteria (sample without case), by date.
+
+        Args:
+            sample (str): Sample.
+            slit (str): Slit ('Fente_1nm'...).
+            date_from (str or datetime.date): First date (included).
+            date_to (str or datetime.date): Last date (included).
+            mode (str): Mode of acquisition.
+
+        Returns:
+            list: Runs (dict, metadata decoded).
+        """
+        conditions, parameters = [], []
+        for condition, value in (("sample = ?", sample), ("slit = ?", normalize_slit(slit)),
+                                 ("date >= ?", parse_date(date_from)), ("date <= ?", parse_date(date_to)),
+                                 ("mode = ?", mode)):
+            if value is not None:
+                conditions.append(condition)
+                parameters.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+        query = "SELECT * FROM runs" + (" WHERE " + " AND ".join(conditions) if conditions else "") + " ORDER BY date, id"
+        with self.connection() as connection:
+            runs = [dict(row) for row in connection.execute(query, parameters)]
+        for run in runs:
+            run['metadata'] = json.loads(run['metadata'])
+        return runs
+
+    def points(self, run_id, wavelength_min=None, wavelength_max=None):
+        """
+        Points of a run, by wavelength.
+
+        Args:
+            run_id (int): Identifier of the run.
+            wavelength_min (float): Minimum wavelength (included).
+            wavelength_max (float): Maximum wavelength (included).
+
+        Returns:
+            tuple: Wavelengths, absorbance and screw positions (arrays, NaN when unknown).
+        """
+        with self.connection() as connection:
+            rows = connection.execute("SELECT wavelength, absorbance, screw_position FROM points "
+                                      "WHERE run_id = ? AND wavelength BETWEEN ? AND ? ORDER BY wavelength",
+                                      (run_id, -np.inf if wavelength_min is None else wavelength_min,
+                                       np.inf if wavelength_max is None else wavelength_max)).fetchall()
+        data = np.array(rows, dtype=float).reshape(-1, 3)
+        return data[:, 0], data[:, 1], data[:, 2]
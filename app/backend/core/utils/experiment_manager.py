@@ -13,10 +13,76 @@ import csv
 import itertools
 import time
 
-import matplotlib.pyplot as plt
 import numpy as np
-from scipy.signal import find_peaks
-import pandas as pd
+
+from core.utils.lazy_import import LazyImport
+from core.utils.spectrum_store import SpectrumStore, EXTENSION
+
+# Heavy packages imported on first use (fast start of the server)
+plt = LazyImport('matplotlib.pyplot')
+find_peaks = LazyImport('scipy.signal', 'find_peaks')
+pd = LazyImport('pandas')
+
+
+class CsvDataWriter:
+    """
+    Appends rows to a CSV file one measurement at a time.
+
+    Each row is flushed to the operating system as soon as it is written, so a crash
+    loses at most the row being written (as with a full rewrite of the file), and the
+    file is synchronised to disk every `fsync_every` rows.
+    """
+
+    def __init__(self, path_file, title_list, fsync_every=10):
+        """
+        Opens the CSV file and writes the column titles.
+
+        Args:
+            path_file (str): The full path of the CSV file.
+            title_list (list): List of column titles for the CSV.
+            fsync_every (int): Number of rows between two synchronisations to disk.
+        """
+        self.path_file = path_file
+        self.fsync_every = fsync_every
+        self.rows_written = 0
+        self.file_csv = open(path_file, 'w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file_csv)
+        self.writer.writerow(title_list)
+        self.sync()
+
+    def write_row(self, row):
+        """
+        Appends one row of data to the CSV file.
+
+        Args:
+            row (list): Values of the row, in the order of the column titles.
+        """
+        self.writer.writerow(row)
+        self.file_csv.flush()
+        self.rows_written += 1
+        if self.rows_written % self.fsync_every == 0:
+            os.fsync(self.file_csv.fileno())
+
+    def sync(self):
+        """
+        Flushes the buffered rows and synchronises the file to disk.
+        """
+        self.file_csv.flush()
+        os.fsync(self.file_csv.fileno())
+
+    def close(self):
+        """
+        Synchronises and closes the CSV file.
+        """
+        if not self.file_csv.closed:
+            self.sync()
+            self.file_csv.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
 
 class ExperimentManager:
@@ -60,6 +126,89 @@ class ExperimentManager:
                 writer.writerow(row)
         return path_file
 
+    def open_data_csv(self, path, title_list, file_name, fsync_every=10):
+        """
+        Opens a CSV file to which the data are appended row by row during an acquisition.
+
+        Args:
+            path (str): The directory path where the CSV file will be saved.
+            title_list (list): List of column titles for the CSV.
+            file_name (str): The name for the CSV file.
+            fsync_every (int): Number of rows between two synchronisations to disk.
+
+        Returns:
+            CsvDataWriter: The writer of the CSV file, to be closed at the end of the acquisition.
+        """
+        path_file = f"{path}/{file_name}.csv"
+        return CsvDataWriter(path_file, title_list, fsync_every)
+
+    def save_data_store(self, path, data_list, title_list, file_name, metadata=None, dtype=None):
+        """
+        Saves the provided data columns to a binary spectrum store (.v634, see SpectrumStore).
+
+        Args:
+            path (str): The directory path where the file will be saved.
+            data_list (list): List of data columns (same order as title_list, lengths may differ).
+            title_list (list): List of column titles.
+            file_name (str): The name for the file (without extension).
+            metadata (dict): Metadata of the experiment, completed with the sample, the slit 
+                and the date of writing.
+            dtype (str): Type of the columns (e.g. 'float32' for raw photodiode data), 
+                float64 by default.
+
+        Returns:
+            path_file (str): The full path of the saved file.
+        """
+        path_file = os.path.join(path, file_name + EXTENSION)
+        metadata = dict({'sample': self.sample_analyzed_name, 'slit': self.slot_size,
+                         'written': datetime.datetime.now().isoformat(timespec='seconds')}, **(metadata or {}))
+        columns = {title: np.asarray(data, dtype=dtype or np.float64) for title, data in zip(title_list, data_list)}
+        SpectrumStore.write(path_file, columns, metadata)
+        return path_file
+
+    def load_data_store(self, path, file_name, memory_map=True):
+        """
+        Loads a binary spectrum store.
+
+        Args:
+            path (str): The directory path where the file is located.
+            file_name (str): The name of the file (without extension).
+            memory_map (bool): Columns memory-mapped (no copy), in memory otherwise.
+
+        Returns:
+            SpectrumStore: Columns (dict of arrays by title) and metadata of the file.
+        """
+        return SpectrumStore.read(os.path.join(path, file_name + EXTENSION), memory_map)
+
+    def extract_data_store(self, path, file_experiment, name_data_x, name_data_y):
+        """
+        Extracts X and Y data from a binary spectrum store (as extract_data_csv).
+
+        Args:
+            path (str): The directory path where the file is located.
+            file_experiment (str): The name of the experiment file (without extension).
+            name_data_x (str): The column name for the X data.
+            name_data_y (str): The column name for the Y data.
+
+        Returns:
+            tuple: Contains the X data and Y data (read-only arrays mapped on the file).
+        """
+        store = self.load_data_store(path, file_experiment)
+        return store.columns[name_data_x], store.columns[name_data_y]
+
+    def export_data_csv(self, path, file_name):
+        """
+        Exports a binary spectrum store to a CSV file of the same name.
+
+        Args:
+            path (str): The directory path where the files are located.
+            file_name (str): The name of the files (without extension).
+
+        Returns:
+            path_file (str): The full path of the CSV file.
+        """
+        return self.load_data_store(path, file_name).to_csv(os.path.join(path, file_name + ".csv"))
+
     def detection_existence_directory(self, path):
         """
         Checks if the specified directory exists.
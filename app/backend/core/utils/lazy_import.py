@@ -0,0 +1,46 @@
+"""
+Imports deferred to the first use of a module, for the heavy packages (matplotlib, pandas,
+scipy, pybaselines, nidaqmx) that the server does not need to start.
+"""
+
+import importlib
+
+
+class LazyImport:
+    """
+    Module, or attribute of a module, imported on first use (attribute access or call).
+
+    Example:
+        plt = LazyImport('matplotlib.pyplot')
+        find_peaks = LazyImport('scipy.signal', 'find_peaks')
+    """
+
+    def __init__(self, module_name, attribute=None):
+        """
+        Args:
+            module_name (str): Name of the module.
+            attribute (str): Attribute of the module (None for the module itself).
+        """
+        self.__dict__['module_name'] = module_name
+        self.__dict__['attribute'] = attribute
+        self.__dict__['target'] = None
+
+    def load(self):
+        """
+        Returns:
+            The module or its attribute, imported on the first call.
+        """
+        if self.target is None:
+            module = importlib.import_module(self.module_name)
+            self.__dict__['target'] = module if self.attribute is None else getattr(module, self.attribute)
+        return self.target
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+    def __call__(self, *args, **kwargs):
+        return self.load()(*args, **kwargs)
+
+    def __repr__(self):
+        name = self.module_name if self.attribute is None else f"{self.module_name}.{self.attribute}"
+        return f"<LazyImport {name}{' (loaded)' if self.target is not None else ''}>"
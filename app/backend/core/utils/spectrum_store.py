@@ -0,0 +1,149 @@
+"""
+Binary columnar store of the spectra and raw photodiode data (.v634 files).
+
+Layout of a file:
+    - magic b'V634SPEC' and version (uint32), length of the header (uint64), little endian;
+    - JSON header (UTF-8): metadata of the experiment (sample, slit, cuvette, calibration,
+      timestamps...) and the name, dtype, offset and length of each column;
+    - the columns, one after the other, each aligned on 64 bytes.
+
+The columns are read through a single read-only memory map of the file: loading a scan or a
+long kinetics trace does not parse nor copy the data. The columns may have different lengths
+(e.g. the peaks saved next to a spectrum).
+"""
+
+import json
+import os
+import struct
+import numpy as np
+
+from core.utils.lazy_import import LazyImport
+
+# Imported on first use (fast start of the server)
+pd = LazyImport('pandas')
+
+
+MAGIC = b'V634SPEC'
+VERSION = 1
+PREFIX = struct.Struct('<8sIQ')  # magic, version, length of the header
+ALIGNMENT = 64
+EXTENSION = '.v634'
+
+
+def aligned(offset):
+    """
+    Args:
+        offset (int): Offset in bytes.
+
+    Returns:
+        int: The offset rounded up to the alignment of the columns.
+    """
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+class SpectrumStore:
+    """
+    Columns and metadata of a .v634 file.
+
+    Attributes:
+        path (str): Path of the file.
+        columns (dict): Arrays of the columns by name, in the order of the file (read-only
+            views of the memory map for a file read).
+        metadata (dict): Metadata of the experiment.
+    """
+
+    def __init__(self, path, columns, metadata):
+        """
+        Args:
+            path (str): Path of the file.
+            columns (dict): Arrays of the columns by name.
+            metadata (dict): Metadata of the experiment.
+        """
+        self.path = path
+        self.columns = columns
+        self.metadata = metadata
+
+    @classmethod
+    def write(cls, path, columns, metadata=None, dtype=None):
+        """
+        Writes a .v634 file (in a temporary file first, so that it is never left half written).
+
+        Args:
+            path (str): Path of the file.
+            columns (dict): Arrays (or lists) of the columns by name.
+            metadata (dict): Metadata of the experiment, serializable in JSON.
+            dtype (str or numpy dtype): Type of all the columns (e.g. float32 for the raw
+                photodiode data), type of each array by default.
+
+        Returns:
+            SpectrumStore: The store written (columns in memory).
+        """
+        arrays = {name: np.ascontiguousarray(values, dtype=dtype) for name, values in columns.items()}
+        arrays = {name: array.astype(array.dtype.newbyteorder('<')) for name, array in arrays.items()}
+        descriptions, offset = [], 0
+        for name, array in arrays.items():
+            descriptions.append({'name': name, 'dtype': array.dtype.str, 'offset': offset, 'length': len(array)})
+            offset = aligned(offset + array.nbytes)
+        header = json.dumps({'metadata': metadata or {}, 'columns': descriptions}, ensure_ascii=False).encode('utf-8')
+        data_start = aligned(PREFIX.size + len(header))
+
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'wb') as file:
+            file.write(PREFIX.pack(MAGIC, VERSION, len(header)))
+            file.write(header)
+            for description, array in zip(descriptions, arrays.values()):
+                file.seek(data_start + description['offset'])
+                file.write(array.tobytes())
+            file.truncate(data_start + offset)
+        os.replace(temporary_path, path)
+        return cls(path, arrays, metadata or {})
+
+    @classmethod
+    def read(cls, path, memory_map=True):
+        """
+        Reads a .v634 file.
+
+        Args:
+            path (str): Path of the file.
+            memory_map (bool): Columns as read-only views of a memory map of the file (no copy),
+                in memory otherwise.
+
+        Returns:
+            SpectrumStore: The store.
+
+        Raises:
+            ValueError: The file is not a .v634 file of a supported version.
+        """
+        with open(path, 'rb') as file:
+            magic, version, header_length = PREFIX.unpack(file.read(PREFIX.size))
+            if magic != MAGIC or version > VERSION:
+                raise ValueError(f"{path} is not a spectrum store (version {VERSION})")
+            header = json.loads(file.read(header_length).decode('utf-8'))
+            data_start = aligned(PREFIX.size + header_length)
+            if not memory_map:
+                file.seek(data_start)
+                content = np.frombuffer(file.read(), dtype=np.uint8)
+        if memory_map:
+            size = os.path.getsize(path) - data_start
+            content = np.memmap(path, dtype=np.uint8, mode='r', offset=data_start, shape=(size,)) if size else np.empty(0, np.uint8)
+        columns = {}
+        for description in header['columns']:
+            dtype = np.dtype(description['dtype'])
+            start = description['offset']
+            columns[description['name']] = content[start:start + description['length'] * dtype.itemsize].view(dtype)
+        return cls(path, columns, header['metadata'])
+
+    def to_csv(self, path_file):
+        """
+        Exports the columns in a CSV file (columns titles on the first line, the shorter
+        columns completed with empty cells).
+
+        Args:
+            path_file (str): Path of the CSV file.
+
+        Returns:
+            str: path_file.
+        """
+        pd.DataFrame({name: pd.Series(values) for name, values in self.columns.items()}).to_csv(
+            path_file, index=False, encoding='utf-8')
+        return path_file
@@ -1,21 +1,26 @@
+import argparse
 import csv
-import sqlite3
+import datetime
 
-# Connexion à la base de données SQLite
-conn = sqlite3.connect('echantillons.db')
-cur = conn.cursor()
+from core.utils.experiment_catalog import ExperimentCatalog
 
-# Créer une table pour les données d'absorbance
-cur.execute('''CREATE TABLE IF NOT EXISTS absorbance
-               (longueur_d_onde REAL, absorbance REAL)''')
+# Import d'un fichier CSV (longueur_d_onde, absorbance) dans le catalogue des expériences
+parser = argparse.ArgumentParser(description="Import d'un spectre CSV dans le catalogue (echantillons.db)")
+parser.add_argument('file', nargs='?', default='data.csv')
+parser.add_argument('--sample', default=None)
+parser.add_argument('--slit', default=None)
+parser.add_argument('--date', default=datetime.date.today().isoformat())
+parser.add_argument('--database', default='echantillons.db')
+arguments = parser.parse_args()
 
-# Lire le fichier CSV et insérer les données
-with open('data.csv', 'r') as csv_file:
-    csv_reader = csv.DictReader(csv_file)
-    for row in csv_reader:
-        cur.execute('''INSERT INTO absorbance (longueur_d_onde, absorbance)
-                       VALUES (?, ?)''', (row['longueur_d_onde'], row['absorbance']))
+# Lire le fichier CSV
+with open(arguments.file, 'r') as csv_file:
+    rows = [(float(row['longueur_d_onde']), float(row['absorbance'])) for row in csv.DictReader(csv_file)]
+wavelength, absorbance = zip(*rows) if rows else ((), ())
 
-# Valider et fermer
-conn.commit()
-conn.close()
+# Insérer le spectre (une transaction, points en bloc) et afficher son identifiant
+run_id = ExperimentCatalog(arguments.database).add_run(
+    sample=arguments.sample, slit=arguments.slit, date=arguments.date, mode='import', path=arguments.file,
+    wavelength_min=min(wavelength, default=None), wavelength_max=max(wavelength, default=None),
+    wavelength=wavelength, absorbance=absorbance)
+print(f"{arguments.file} : run {run_id}, {len(rows)} points")
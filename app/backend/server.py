@@ -1,9 +1,12 @@
-from threading import Lock
+import os
+os.environ['MPLBACKEND'] = 'Agg'  # Graphs of the server only saved in files, never displayed
+import queue
+from threading import Event, Lock
 from flask import Flask
-from flask_socketio import SocketIO
+from flask_socketio import SocketIO, emit
 import serial
 from core.acquisition_mode import Varian634AcquisitionMode
-from core.kinematic_chains.motors_varian_634 import GeneralMotorsController
+from core.kinematic_chains.motors_varian_634 import GeneralMotorsController, StopRequested
 from pyfirmata import Arduino
 
 
@@ -13,10 +16,15 @@ COM_PORT_SENSORS = 'COM9'
 BAUD_RATE = 115200
 INITIALIZATION_TIME = 2
 
-arduino_motors = serial.Serial(COM_PORT_MOTORS, BAUD_RATE)
-
-# INITIALIZATION Optical Fork:
-arduino_sensors = Arduino(COM_PORT_SENSORS)
+if os.environ.get('VARIAN634_SIMULATION') == '1':
+    # Simulated hardware (no COM port, no NI card), optionally faster than real time
+    from core.simulation.backend import create_simulated_backend
+    arduino_motors, arduino_sensors, daq = create_simulated_backend(float(os.environ.get('VARIAN634_SIMULATION_SPEEDUP', 1)))
+else:
+    arduino_motors = serial.Serial(COM_PORT_MOTORS, BAUD_RATE)
+    # INITIALIZATION Optical Fork:
+    arduino_sensors = Arduino(COM_PORT_SENSORS)
+    daq = None
 motors = GeneralMotorsController(arduino_motors, arduino_sensors)
 motors.initialize_arduino_motor()
 
@@ -30,9 +38,13 @@ app.config['SECRET_KEY'] = 'VARIAN634!'
 socketio = SocketIO(app, cors_allowed_origins='*')
 
 # Initialisation MODE d'acquisition Varian634
-
-sensor_data_running = False
-sensor_data_should_stop = False  
+# Les acquisitions tournent dans un thread de travail (acquisition_worker) qui exécute les
+# commandes de la file : les gestionnaires Socket.IO répondent tout de suite, le serveur reste
+# disponible pour les autres clients pendant un balayage de plusieurs heures.
+commands = queue.Queue()
+sensor_data_stop = Event()  # Arrêt demandé : vérifié entre les pas et pendant les mouvements
+status_lock = Lock()
+acquisition_status = {'running': False, 'state': 'idle', 'slit': None, 'slits': [], 'message': None}
 
 
 # Initialisation des variables globales pour stocker les paramètres du mode scanning
@@ -57,38 +69,101 @@ def handle_set_wave_length_params(json):
     print(f'Paramètres de longueur d\'onde reçus : Min = {wavelength_min}, Max = {wavelength_max}, Pas = {step_wavelength}, Cuvette = {selected_cuvette}, Fentes = {selected_slits}, Nom échantillon = {sample_name}')
 
 
-# Initialisation des variables globales pour stocker les paramètres du mode cinétique
-def scanning_mode():
-    global sensor_data_running, wavelength_min, wavelength_max, step_wavelength, selected_cuvette, selected_slits, sample_name
-    sensor_data_running = True
-    sensor_data_should_stop = False  # Réinitialiser pour une nouvelle exécution
-    
-    for slit in selected_slits:
-        if sensor_data_should_stop:
-            break  # Sortie anticipée si un arrêt est demandé       
-        baseline_scanning = Varian634AcquisitionMode(arduino_motors, arduino_sensors, socketio, sample_name, selected_cuvette, slit)
-        baseline_scanning.acquisition(wavelength_min, wavelength_max, step_wavelength)
+def update_status(**changes):
+    """
+    Met à jour l'état de l'acquisition et l'envoie à tous les clients.
+    """
+    with status_lock:
+        acquisition_status.update(changes)
+        # Sous le verrou : les clients reçoivent les états dans l'ordre des mises à jour
+        socketio.emit('acquisitionStatus', dict(acquisition_status))
+
+
+def scanning_mode(parameters):
+    """
+    Balayage de chaque fente sélectionnée (dans le thread de travail).
+    """
+    for index, slit in enumerate(parameters['slits']):
+        if sensor_data_stop.is_set():
+            break  # Sortie anticipée si un arrêt est demandé
+        update_status(slit=slit)
+        baseline_scanning = Varian634AcquisitionMode(arduino_motors, arduino_sensors, socketio, parameters['sample_name'], 
+                                                     parameters['cuvette'], slit, daq=daq, stop_event=sensor_data_stop)
+        # Balayages alternés (zig-zag) : la vis repart de la fin du balayage précédent
+        wavelength_order = "descending" if index % 2 == 0 else "ascending"
+        baseline_scanning.acquisition("scanning", parameters['wavelength_min'], parameters['wavelength_max'], 
+                                      parameters['step_wavelength'], wavelength_order=wavelength_order)
+
+
+def acquisition_worker():
+    """
+    Thread de travail : exécute les commandes de la file l'une après l'autre.
+    """
+    while True:
+        command, parameters = commands.get()
+        state, message = 'done', None
+        try:
+            if command == 'scanning':
+                scanning_mode(parameters)
+            if sensor_data_stop.is_set():
+                state = 'stopped'
+        except StopRequested:
+            state = 'stopped'
+        except Exception as error:  # Le thread reste disponible pour les acquisitions suivantes
+            state, message = 'error', f"{type(error).__name__}: {error}"
+            print(f"Erreur pendant l'acquisition : {message}")
+            socketio.emit('error', {'message': message})
+        print(f"Fin du mode {command} : {state}")
+        update_status(running=False, state=state, slit=None, message=message)
+
+
+def start_worker():
+    """
+    Démarre le thread de travail à la première acquisition.
+    """
+    global thread
+    with thread_lock:
+        if thread is None:
+            thread = socketio.start_background_task(acquisition_worker)
+
 
-    sensor_data_running = False  # Assurez-vous de réinitialiser cela auss
 @socketio.on('startSensorData')
 def handle_start_sensor_data():
-    global wavelength_min, wavelength_max, step_wavelength, sensor_data_running, selected_cuvette, selected_slits
     if None in (wavelength_min, wavelength_max, step_wavelength) or not selected_cuvette or not selected_slits:
         error_msg = "Impossible de démarrer la génération de données du capteur : un ou plusieurs paramètres ne sont pas définis ou invalides."
         print(error_msg)
         socketio.emit('error', {'message': error_msg})
         return
+    with status_lock:
+        if acquisition_status['running']:
+            emit('error', {'message': "Une acquisition est déjà en cours"})
+            return
+        acquisition_status['running'] = True
 
     print("Début du mode scanning")
-    sensor_data_running = True
-    scanning_mode()  # Démarrage effectif de la génération de données
+    sensor_data_stop.clear()
+    # Paramètres figés au démarrage : un nouveau setScanningParams ne modifie pas le balayage en cours
+    parameters = {'wavelength_min': wavelength_min, 'wavelength_max': wavelength_max, 'step_wavelength': step_wavelength,
+                  'cuvette': selected_cuvette, 'slits': list(selected_slits), 'sample_name': sample_name}
+    update_status(state='scanning', slits=parameters['slits'], message=None)
+    commands.put(('scanning', parameters))
+    start_worker()
 
 @socketio.on('stopSensorData')
 def handle_stop_sensor_data():
-    global sensor_data_should_stop
-    sensor_data_should_stop = True
+    with status_lock:
+        # Vérification et mise à jour ensemble : le thread de travail peut finir entre les deux
+        if acquisition_status['running']:
+            sensor_data_stop.set()
+            acquisition_status['state'] = 'stopping'
+            socketio.emit('acquisitionStatus', dict(acquisition_status))
     print("Arrêt du mode scanning demandé")
 
+@socketio.on('getAcquisitionStatus')
+def handle_get_acquisition_status():
+    with status_lock:
+        emit('acquisitionStatus', dict(acquisition_status))
+
 @app.route('/')
 def index():
     return "Bienvenue sur le serveur" 